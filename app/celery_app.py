@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
 
 celery_app = Celery(
     "audio_pipeline",
@@ -17,3 +18,15 @@ celery_app.conf.update(
 )
 
 celery_app.autodiscover_tasks(["app.pipeline.steps.pipeline_tasks"])
+
+
+@worker_init.connect
+def preload_models_on_worker_init(sender=None, **kwargs):
+    from app.pipeline.model_registry import on_worker_init
+    on_worker_init(sender)
+
+
+@worker_process_init.connect
+def preload_models_on_worker_process_init(**kwargs):
+    from app.pipeline.model_registry import on_worker_process_init
+    on_worker_process_init()
@@ -0,0 +1,224 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import soundfile as sf
+import soxr
+import torch
+
+# ---------------- Artifact format ----------------
+# [64 байта заголовка][num_frames отсчётов mono в dtype]
+# заголовок: magic, version, dtype code, sample_rate, num_frames (остальное — нули)
+MAGIC = b"CAPA"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIQ")
+HEADER_SIZE = 64
+DTYPE_CODES = {"float32": 1, "int16": 2}
+CODE_DTYPES = {code: np.dtype(name) for name, code in DTYPE_CODES.items()}
+BLOCK_FRAMES = 1 << 16
+
+_locks: Dict[Path, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def audio_cache_dir(tmp_dir: Path) -> Path:
+    """Каталог кэша декодированного аудио внутри временной директории операции."""
+    return Path(tmp_dir) / "audio_cache"
+
+
+def source_fingerprint(source: str | Path) -> str:
+    """Идентичность исходного файла: путь, размер, mtime."""
+    source = Path(source)
+    st = source.stat()
+    return f"{source.resolve()}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def artifact_path(source: str | Path, sample_rate: int, cache_dir: Path, dtype: str = "float32") -> Path:
+    """Имя артефакта: исходный файл (путь, размер, mtime) + частота + тип отсчётов."""
+    source = Path(source)
+    key = hashlib.sha1(f"{source_fingerprint(source)}|{sample_rate}|{dtype}".encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"{source.stem}_{sample_rate}_{key}.pcm"
+
+
+def build_artifact(
+        source: str | Path,
+        sample_rate: int,
+        out_path: Path,
+        dtype: str = "float32",
+        block_frames: int = BLOCK_FRAMES,
+) -> Path:
+    """
+    Декодирует source блоками -> mono -> sample_rate и пишет артефакт атомарно.
+    Память ограничена одним блоком, независимо от длины записи.
+    """
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(f"{out_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    np_dtype = np.dtype(dtype)
+
+    num_frames = 0
+    with sf.SoundFile(str(source)) as src, open(tmp_path, "wb") as out:
+        resampler = soxr.ResampleStream(src.samplerate, sample_rate, 1, dtype="float32") \
+            if src.samplerate != sample_rate else None
+        out.write(b"\0" * HEADER_SIZE)
+        while True:
+            block = src.read(block_frames, dtype="float32", always_2d=True)
+            last = block.shape[0] < block_frames
+            mono = block.mean(axis=1)
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono, last=last)
+            if np_dtype == np.int16:
+                mono = np.clip(np.round(mono * 32767.0), -32768, 32767)
+            out.write(mono.astype(np_dtype).tobytes())
+            num_frames += mono.shape[0]
+            if last:
+                break
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], sample_rate, num_frames))
+    tmp_path.replace(out_path)
+    return out_path
+
+
+def read_artifact_header(path: Path) -> Dict[str, int]:
+    with open(path, "rb") as f:
+        magic, version, code, sample_rate, num_frames = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} не является аудио-артефактом версии {VERSION}")
+    return {"dtype_code": code, "sample_rate": sample_rate, "num_frames": num_frames}
+
+
+def open_artifact(path: Path) -> np.memmap:
+    """Одномерный memmap отсчётов артефакта (copy-on-write: срезы можно отдавать в torch без копии)."""
+    header = read_artifact_header(path)
+    if header["num_frames"] == 0:
+        return np.zeros(0, dtype=CODE_DTYPES[header["dtype_code"]])
+    return np.memmap(path, dtype=CODE_DTYPES[header["dtype_code"]], mode="c",
+                     offset=HEADER_SIZE, shape=(header["num_frames"],))
+
+
+def get_audio_artifact(
+        source: str | Path,
+        sample_rate: int,
+        cache_dir: Path,
+        dtype: str = "float32",
+) -> np.memmap:
+    """
+    Возвращает декодированное mono-аудио source на частоте sample_rate.
+    Каждый источник декодируется один раз на частоту; все шаги операции получают memmap-представление.
+    """
+    path = artifact_path(source, sample_rate, cache_dir, dtype)
+    if not path.exists():
+        with _locks_guard:
+            lock = _locks.setdefault(path, threading.Lock())
+        with lock:
+            if not path.exists():
+                print(f"[AUDIO_CACHE] Декодируем {Path(source).name} -> {sample_rate} Гц")
+                build_artifact(source, sample_rate, path, dtype)
+    return open_artifact(path)
+
+
+def as_tensor(samples: np.ndarray) -> torch.Tensor:
+    """Тензор формы (1, n) поверх тех же данных (float32 — без копирования)."""
+    if samples.dtype == np.int16:
+        return torch.from_numpy(samples.astype(np.float32) / 32768.0).unsqueeze(0)
+    return torch.from_numpy(samples).unsqueeze(0)
+
+
+# ---------------- Range reads ----------------
+RESAMPLE_PAD = 1024  # запас исходных отсчётов с каждой стороны окна, чтобы ресемплинг не давал краевых артефактов
+
+
+def wav_memmap(path: str | Path) -> Optional[np.memmap]:
+    """memmap (frames, channels) блока data для PCM16/float32 WAV; None для остальных форматов."""
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            cid, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if cid == b"fmt ":
+                body = f.read(size)
+                audio_format, channels, _, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+                if audio_format == 0xFFFE and len(body) >= 26:
+                    audio_format = struct.unpack("<H", body[24:26])[0]
+                fmt = (audio_format, channels, bits)
+                if size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif cid == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + size % 2, os.SEEK_CUR)
+    if fmt is None:
+        return None
+    dtype = {(1, 16): np.int16, (3, 32): np.float32}.get((fmt[0], fmt[2]))
+    if dtype is None:
+        return None
+    frames = size // (np.dtype(dtype).itemsize * fmt[1])
+    if frames == 0:
+        return None
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(frames, fmt[1]))
+
+
+class AudioRangeReader:
+    """
+    Чтение диапазонов одного исходного файла: заголовок разбирается и файл открывается один раз,
+    дальше каждый интервал — срез memmap (PCM WAV) или seek+read по общему дескриптору.
+    Безопасен для вызова из потоков пула (seek+read под замком).
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = str(path)
+        info = sf.info(self.path)
+        self.samplerate, self.frames = info.samplerate, info.frames
+        self._memmap = wav_memmap(self.path)
+        self._file = sf.SoundFile(self.path) if self._memmap is None else None
+        self._lock = threading.Lock()
+
+    def length(self, sample_rate: int) -> int:
+        """Длина файла в отсчётах на частоте sample_rate."""
+        return int(self.frames * sample_rate // self.samplerate)
+
+    def _source_frames(self, lo: int, hi: int) -> np.ndarray:
+        """Mono float32 отсчёты [lo, hi) исходного файла без чтения остального."""
+        if self._memmap is not None:
+            block = np.asarray(self._memmap[lo:hi])
+            block = block.astype(np.float32) / 32768.0 if block.dtype == np.int16 else block.astype(np.float32)
+            return block.mean(axis=1)
+        with self._lock:
+            self._file.seek(lo)
+            return self._file.read(hi - lo, dtype="float32", always_2d=True).mean(axis=1)
+
+    def read(self, start: int, end: int, sample_rate: int) -> np.ndarray:
+        """
+        Отсчёты [start, end) на частоте sample_rate. Ресемплируется только окно с запасом
+        RESAMPLE_PAD по краям, который затем отрезается.
+        """
+        src_sr = self.samplerate
+        if src_sr == sample_rate:
+            return self._source_frames(max(0, start), min(end, self.frames))
+
+        # Начало окна выравнивается на шаг, кратный отношению частот: тогда сетка отсчётов окна
+        # совпадает с сеткой полного ресемплинга, и вырезка не сдвигается на долю отсчёта.
+        step = src_sr // math.gcd(src_sr, sample_rate)
+        lo = max(0, (start * src_sr // sample_rate - RESAMPLE_PAD) // step * step)
+        hi = min(self.frames, -(-end * src_sr // sample_rate) + RESAMPLE_PAD)
+        window = soxr.resample(self._source_frames(lo, hi), src_sr, sample_rate)
+        skip = start - lo * sample_rate // src_sr
+        out = window[skip:skip + (end - start)]
+        if out.shape[0] < end - start:
+            out = np.pad(out, (0, end - start - out.shape[0]))
+        return out.astype(np.float32, copy=False)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._memmap = None
@@ -16,10 +16,19 @@ PATH_TO_AUDIO = BASE_DIR / "app" / "api" / "data" / "audio"
 RESULTS_PATH = BASE_DIR / "app" / "api" / "results"
 TMP_PATH = BASE_DIR / "app" / "api" / "tmp"
 METRICS_PATH = BASE_DIR / "app" / "api" / "metrics"
+CACHE_PATH = BASE_DIR / "app" / "api" / "cache"
 
 CALC_METRICS = True
 RANDOM_SEED = 42
 
+# =====================
+# MERGE AUDIO
+# =====================
+
+MERGE_STREAMING = True          # потоковое сведение блоками, без загрузки всех файлов в память
+MERGE_BLOCK_FRAMES = 1 << 16    # размер блока в отсчётах
+MERGE_MAX_WORKERS = min(8, os.cpu_count() or 1)  # пул декодирования/ресемплинга микрофонов
+
 # =====================
 # WARNINGS & TORCH SETTINGS
 # =====================
@@ -34,11 +43,102 @@ torch.backends.cudnn.allow_tf32 = True
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# =====================
+# MODEL REGISTRY
+# =====================
+
+MODEL_PRELOAD_WORKER_PREFIX = "gpu@"  # воркеры (-n gpu@%h), которые загружают и прогревают модели при старте
+DIARIZATION_WARMUP_SECONDS = 5.0      # длина синтетического аудио для прогрева pyannote
+
+# =====================
+# DIARIZATION
+# =====================
+
+DIARIZATION_WINDOW_SECONDS = 0             # > 0 — диаризация окнами этой длины для записей длиннее окна
+DIARIZATION_WINDOW_OVERLAP_SECONDS = 30.0  # перекрытие соседних окон
+DIARIZATION_LINK_THRESHOLD = 0.5           # мин. косинусная близость для сшивки спикеров между окнами
+DIARIZATION_BATCH_WINDOW_SECONDS = 0       # > 0 — собирать запросы разных заседаний в общий GPU-батч
+DIARIZATION_BATCH_MAX_RECORDINGS = 4       # макс. записей в одном батче (воркер: -P threads -c N)
+DIARIZATION_BATCH_MAX_ROWS = 128           # макс. чанков в одном вызове модели
+
+# =====================
+# VOICEPRINTS
+# =====================
+
+VOICEPRINT_CACHE_PATH = CACHE_PATH / "voiceprints"
+VOICEPRINT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+VOICEPRINT_MODEL_VERSION = "pyannote-embedding-v1"  # менять при смене модели эмбеддингов — старый кэш станет невалиден
+VOICEPRINT_PARAMS = {"seed": 42}                    # параметры выборки, влияющие на отпечаток
+VOICEPRINT_BATCHED = False                 # батчевые отпечатки спикеров и микрофонов одной моделью VOICEPRINT_EMBEDDING_MODEL
+VOICEPRINT_EMBEDDING_MODEL = "pyannote/wespeaker-voxceleb-resnet34-LM"  # модель батчевого пути (обе стороны сравнения)
+VOICEPRINT_BATCH_SIZE = 32
+VOICEPRINT_MAX_INTERVALS_PER_SPEAKER = 50
+VOICEPRINT_MIN_INTERVAL_SECONDS = 1.0
+VOICEPRINT_MAX_INTERVAL_SECONDS = 10.0
+SPEAKER_ENERGY_FAST_PATH = True            # назначение спикер -> микрофон по энергии каналов, без эмбеддингов
+SPEAKER_ENERGY_MARGIN_DB = 6.0             # мин. запас выбранного микрофона над следующим, иначе — эмбеддинги
+SPEAKER_ENERGY_FRAME_SECONDS = 0.02
+
+# =====================
+# SEGMENTS
+# =====================
+
+SEGMENTS_VIRTUAL = False  # манифест (артефакт, смещение, длина) вместо отдельного WAV на каждый интервал
+SEGMENTS_VIRTUAL_MAX_OPEN = 16  # открытых memmap артефактов на процесс (LRU), остальные закрываются
+SEGMENTS_RANGE_READS = True  # без готового артефакта читать и ресемплировать только диапазоны интервалов
+SEGMENTS_WRITER_WORKERS = min(8, os.cpu_count() or 1)  # пул вырезки/кодирования сегментов
+SEGMENTS_WRITER_MAX_PENDING = 64  # сегментов в работе одновременно (ограничивает память)
+SEGMENTS_DELIVERY_FORMAT = "mp3"  # "mp3" | "opus" | None — файл доставки рядом с сегментом, export не перекодирует
+SEGMENTS_PACKED = False  # сегменты операции одним контейнером + индекс смещений (воспроизведение Range-запросом)
+
+# =====================
+# TRANSCRIPTION
+# =====================
+
+TRANSCRIBE_ENGINE = os.getenv("TRANSCRIBE_ENGINE", "yandex_async")  # "yandex_async" | "speechkit_dispatcher"
+SPEECHKIT_URL = os.getenv("SPEECHKIT_URL", "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize")
+SPEECHKIT_API_KEY = os.getenv("SPEECHKIT_API_KEY", "")
+SPEECHKIT_FOLDER_ID = os.getenv("SPEECHKIT_FOLDER_ID", "")
+SPEECHKIT_CONCURRENCY_INITIAL = 4     # стартовый лимит параллельных запросов (AIMD)
+SPEECHKIT_CONCURRENCY_MIN = 1
+SPEECHKIT_CONCURRENCY_MAX = 32
+SPEECHKIT_LATENCY_TARGET = 2.0        # сек; ответ дольше цели — сигнал перегрузки, лимит снижается
+SPEECHKIT_LATENCY_PER_SECOND = 0.3    # прибавка к цели на секунду аудио в запросе
+SPEECHKIT_SYNC_MAX_SECONDS = 29.0     # лимиты синхронного распознавания (30 с / 1 МБ): длиннее — режем на части
+SPEECHKIT_SYNC_MAX_BYTES = 1_000_000
+SPEECHKIT_MAX_RETRIES = 5
+SPEECHKIT_DEADLINE = 60.0             # сек на запрос вместе со всеми повторами
+# Упаковка коротких сегментов в один запрос (0 — выключено). Нужны таймкоды слов в ответе: синхронный
+# v1 REST их не возвращает, поэтому пока это только для speechkit_mock --word-timestamps.
+SPEECHKIT_PACK_MAX_SECONDS = 0.0
+SPEECHKIT_PACK_SHORT_SECONDS = 3.0    # упаковываются сегменты короче этого
+SPEECHKIT_PACK_GAP_SECONDS = 0.3      # тишина между сегментами в упакованном аудио
+TRANSCRIBE_STREAM_QUEUE_SIZE = 32     # очередь сегментов между вырезкой и распознаванием (extract_transcribe_step)
+TRANSCRIBE_CHECKPOINT = True          # журнал готовых сегментов (fsync) для продолжения после падения
+TRANSCRIBE_CHECKPOINT_CHUNK = 50      # порция сегментов между контрольными точками для transcribe_with_yandex_async
+TRANSCRIBE_CHUNKS_IN_FLIGHT = 3       # порций в работе одновременно: пока одна ждёт медленный сегмент, другие идут
+
+TRANSCRIPTION_CACHE = True            # текст по sha256 PCM сегмента + движок/модель/язык
+TRANSCRIPTION_CACHE_PATH = CACHE_PATH / "transcriptions"
+TRANSCRIPTION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# =====================
+# EXPORT
+# =====================
+
+EXPORT_ENCODE_WORKERS = min(8, os.cpu_count() or 1)  # пул процессов кодирования сегментов (WAV -> MP3/Opus)
+EXPORT_MP3_BITRATE = "192k"                          # битрейт MP3 сегментов и Merged.mp3
+EXPORT_MERGED_CHUNK_SECONDS = 300.0                 # Merged.mp3 кодируется кусками параллельно (границы по кадрам MP3)
+EXPORT_MERGED_PREROLL_FRAMES = 4                    # кадров разгона до/после куска, отбрасываются при склейке
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+EXPORT_CONTENT_ADDRESSED = False                    # аудио в S3 по sha256 (blobs/), у операции — manifest.json в operations/<id>/;
+                                                    # меняет раскладку S3 для потребителей — см. README перед включением
+
 # =====================
 # INIT DIRECTORIES
 # =====================
 
-for path in [PATH_TO_AUDIO, RESULTS_PATH, TMP_PATH, METRICS_PATH]:
+for path in [PATH_TO_AUDIO, RESULTS_PATH, TMP_PATH, METRICS_PATH, CACHE_PATH]:
     path.mkdir(parents=True, exist_ok=True)
 
 # Проверка наличия разметки, если нужно вычислять метрики
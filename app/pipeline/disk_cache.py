@@ -0,0 +1,67 @@
+import os
+import threading
+from pathlib import Path
+from typing import List
+
+# ---------------- Disk LRU ----------------
+
+
+class DiskLRUCache:
+    """
+    Каталог записей с вытеснением по давности использования.
+
+    Запись — один или несколько файлов с общим именем-ключом (<key>.npy, <key>.json, ...).
+    Время последнего использования — mtime файлов (обновляется при чтении через touch),
+    при превышении max_bytes удаляются самые давние записи целиком.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, key: str, suffix: str) -> Path:
+        return self.root / f"{key}{suffix}"
+
+    def touch(self, key: str) -> None:
+        """Отмечает запись как использованную."""
+        for path in self.files(key):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    def files(self, key: str) -> List[Path]:
+        return [p for p in self.root.glob(f"{key}.*") if not p.name.endswith(".tmp")]
+
+    def write_bytes(self, key: str, suffix: str, data: bytes) -> Path:
+        """Атомарная запись файла записи."""
+        path = self.path(key, suffix)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+        return path
+
+    def evict(self) -> int:
+        """Удаляет самые давние записи, пока размер каталога больше max_bytes. Возвращает число удалённых."""
+        with self._lock:
+            entries = {}
+            for p in self.root.iterdir():
+                if not p.is_file() or p.name.endswith(".tmp"):
+                    continue
+                st = p.stat()
+                key = p.name.split(".", 1)[0]
+                size, mtime = entries.get(key, (0, 0.0))
+                entries[key] = (size + st.st_size, max(mtime, st.st_mtime))
+
+            total = sum(size for size, _ in entries.values())
+            removed = 0
+            for key, (size, _) in sorted(entries.items(), key=lambda kv: kv[1][1]):
+                if total <= self.max_bytes:
+                    break
+                for p in self.files(key):
+                    p.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+            return removed
@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import torch
+
+from app.pipeline.config import (
+    DEVICE,
+    DIARIZATION_WARMUP_SECONDS,
+    MODEL_PRELOAD_WORKER_PREFIX,
+    VOICEPRINT_EMBEDDING_MODEL,
+)
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Process-resident state ----------------
+_lock = threading.Lock()
+_pipeline = None
+_embedding = None
+_timings: Dict[str, float] = {}
+_preload_enabled = False
+
+
+# ---------------- Diarization pipeline ----------------
+def load_diarization_pipeline():
+    """Загружает pyannote pipeline и закрепляет его на DEVICE."""
+    from app.pipeline.global_diarization import get_pipeline
+
+    t0 = time.perf_counter()
+    pipeline = get_pipeline()
+    pipeline.to(DEVICE)
+    _timings["diarization_load_sec"] = time.perf_counter() - t0
+    return pipeline
+
+
+def warmup_diarization_pipeline(pipeline, seconds: float = DIARIZATION_WARMUP_SECONDS, sample_rate: int = 16000) -> None:
+    """
+    Прогоняет pipeline на синтетическом аудио, чтобы инициализация CUDA, cudnn и аллокатора
+    не ложилась на первое реальное заседание.
+    """
+    generator = torch.Generator().manual_seed(0)
+    waveform = 0.01 * torch.randn(1, int(seconds * sample_rate), generator=generator)
+
+    t0 = time.perf_counter()
+    try:
+        with torch.inference_mode():
+            pipeline({"waveform": waveform.to(DEVICE), "sample_rate": sample_rate})
+        if DEVICE.type == "cuda":
+            torch.cuda.synchronize(DEVICE)
+    except Exception as e:
+        # на шуме кластеризация может не найти спикеров — для прогрева это не важно
+        logger.warning(f"[MODELS] Прогрев pyannote завершился ошибкой: {e}")
+    _timings["diarization_warmup_sec"] = time.perf_counter() - t0
+
+
+def get_diarization_pipeline():
+    """Возвращает загруженный и прогретый pipeline процесса (загружает при первом обращении)."""
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
+    with _lock:
+        if _pipeline is None:
+            pipeline = load_diarization_pipeline()
+            warmup_diarization_pipeline(pipeline)
+            _pipeline = pipeline
+            logger.info(
+                f"[MODELS] pyannote на {DEVICE}: загрузка {_timings['diarization_load_sec']:.2f} с, "
+                f"прогрев {_timings['diarization_warmup_sec']:.2f} с"
+            )
+    return _pipeline
+
+
+# ---------------- Speaker embedding model ----------------
+def load_embedding_model(name: str = VOICEPRINT_EMBEDDING_MODEL):
+    """
+    Загружает модель эмбеддингов спикеров отдельно от pipeline диаризации.
+    Единственный источник модели для батчевых отпечатков: и спикеры, и микрофоны
+    считаются ею, поэтому сравниваются векторы одного пространства.
+    """
+    from pyannote.audio.pipelines.speaker_verification import PretrainedSpeakerEmbedding
+
+    t0 = time.perf_counter()
+    model = PretrainedSpeakerEmbedding(name, device=DEVICE, token=os.environ.get("HF_TOKEN"))
+    _timings["embedding_load_sec"] = time.perf_counter() - t0
+    return model
+
+
+def get_embedding_model():
+    """Возвращает модель эмбеддингов процесса (загружает при первом обращении)."""
+    global _embedding
+    if _embedding is not None:
+        return _embedding
+    with _lock:
+        if _embedding is None:
+            _embedding = load_embedding_model()
+            logger.info(f"[MODELS] {VOICEPRINT_EMBEDDING_MODEL} на {DEVICE}: загрузка {_timings['embedding_load_sec']:.2f} с")
+    return _embedding
+
+
+def get_model_timings() -> Dict[str, float]:
+    """Время загрузки и прогрева моделей в текущем процессе (сек)."""
+    return dict(_timings)
+
+
+# ---------------- Celery hooks ----------------
+def _runs_tasks_in_main_process(worker) -> bool:
+    pool_cls = getattr(worker, "pool_cls", None)
+    name = pool_cls if isinstance(pool_cls, str) else getattr(pool_cls, "__module__", "")
+    return "solo" in name or "thread" in name
+
+
+def on_worker_init(worker: Optional[object] = None) -> None:
+    """
+    worker_init: решает, нужна ли предзагрузка на этом воркере (по имени -n gpu@%h).
+    Для solo/threads задачи выполняются в главном процессе — грузим сразу,
+    для prefork флаг наследуется дочерними процессами и загрузка идёт в worker_process_init.
+    """
+    global _preload_enabled
+    hostname = getattr(worker, "hostname", "") or ""
+    _preload_enabled = hostname.startswith(MODEL_PRELOAD_WORKER_PREFIX)
+    if _preload_enabled and _runs_tasks_in_main_process(worker):
+        get_diarization_pipeline()
+
+
+def on_worker_process_init() -> None:
+    """worker_process_init: загрузка и прогрев в каждом дочернем процессе prefork."""
+    if _preload_enabled:
+        get_diarization_pipeline()
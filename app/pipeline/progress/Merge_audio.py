@@ -1,34 +1,153 @@
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Iterator, List
 
+import numpy as np
+import soundfile as sf
 import torch
 import torchaudio
 from tqdm import tqdm
+
+from app.pipeline.audio_cache import get_audio_artifact
+
 SAMPLE_RATE = 16000
+BLOCK_FRAMES = 1 << 16
 
-def make_one_channel_audio(files_path: List[str], sr: int = SAMPLE_RATE) -> torch.Tensor:
+def load_mono(path: str, sr: int = SAMPLE_RATE) -> torch.Tensor:
+    '''
+    Загружает файл, сводит в mono и ресемплирует к sr.
+
+    :param str path: Path to the audiofile
+    :param int sr: Target sample rate
+    :rtype torch.tensor: Waveform of shape (1, n)
+    '''
+    waveform, sample_rate = torchaudio.load(path)
+    if waveform.size(0) > 1:
+        waveform = waveform.mean(dim=0, keepdim=True)
+    if sample_rate != sr:
+        waveform = torchaudio.functional.resample(waveform, sample_rate, sr)
+    return waveform
+
+
+def load_all_parallel(files_path: List[str], sr: int = SAMPLE_RATE, max_workers: int | None = None) -> List[torch.Tensor]:
+    '''
+    Декодирует и ресемплирует все файлы одновременно на ограниченном пуле потоков.
+    Время загрузки определяется самым долгим файлом, а не суммой всех.
+    '''
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(tqdm(pool.map(lambda p: load_mono(p, sr), files_path), total=len(files_path)))
+
+
+def make_one_channel_audio(files_path: List[str], sr: int = SAMPLE_RATE, max_workers: int | None = None) -> torch.Tensor:
     '''
     :param List[str] files_path: Paths to the audiofile or one-dimensional signal
     :param int sr: Signal sample rate
+    :param max_workers: Size of the decoding pool
     :rtype torch.tensor: Concated waveform among all files
     '''
-    concated_waveform, sample_rate = torchaudio.load(files_path[0])
-    for i in tqdm(range(1, len(files_path))):
-        waveform, sample_rate = torchaudio.load(files_path[i])
+    waveforms = load_all_parallel(files_path, sr, max_workers)
+    length = max(w.size(1) for w in waveforms)
 
-        if waveform.size(1) > concated_waveform.size(1):
-            padding = waveform.size(1) - concated_waveform.size(1)
-            concated_waveform = torch.nn.functional.pad(concated_waveform, (0, padding))
-        elif waveform.size(1) < concated_waveform.size(1):
-            padding = concated_waveform.size(1) - waveform.size(1)
-            waveform = torch.nn.functional.pad(waveform, (0, padding))
-
-        concated_waveform += waveform
+    concated_waveform = torch.zeros(1, length)
+    for waveform in waveforms:
+        concated_waveform[:, :waveform.size(1)] += waveform
 
     concated_waveform = concated_waveform / torch.max(torch.abs(concated_waveform))
     return concated_waveform
 
 
+def prepare_channels_parallel(
+        files_path: List[str],
+        sr: int,
+        cache_dir: Path,
+        max_workers: int | None = None,
+) -> List[np.ndarray]:
+    '''
+    Параллельно декодирует все микрофонные файлы в кэш аудио-артефактов (mono, частота sr).
+    Память ограничена: каждый поток держит только один блок своего файла,
+    результат — memmap-представления артефактов.
+    '''
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(get_audio_artifact, p, sr, cache_dir) for p in files_path]
+        return [f.result() for f in tqdm(futures)]
+
+
 def save_audio(tensor, file_path, sample_rate):
     if len(tensor.shape) == 0 or tensor.shape[0] != 1:
         tensor = tensor.unsqueeze(0)
-    torchaudio.save(file_path, tensor, sample_rate)
\ No newline at end of file
+    torchaudio.save(file_path, tensor, sample_rate)
+
+
+def _block_reader(stack: ExitStack, source, block_frames: int) -> Callable[[], np.ndarray]:
+    """Читатель последовательных mono-блоков из файла или из одномерного массива (memmap)."""
+    if isinstance(source, np.ndarray):
+        pos = 0
+
+        def read_array() -> np.ndarray:
+            nonlocal pos
+            block = np.array(source[pos:pos + block_frames], dtype=np.float32)
+            pos += block.shape[0]
+            return block
+
+        return read_array
+
+    src = stack.enter_context(sf.SoundFile(str(source)))
+    return lambda: src.read(block_frames, dtype="float32", always_2d=True).mean(axis=1)
+
+
+def iter_mixed_blocks(files_path: List[str | np.ndarray], block_frames: int = BLOCK_FRAMES) -> Iterator[np.ndarray]:
+    '''
+    Читает все источники блоками по block_frames отсчётов и отдаёт их поблочную сумму (mono float32).
+    Короткие источники дополняются тишиной до длины самого длинного.
+
+    :param files_path: Paths to the audiofiles or one-dimensional signals
+    :param int block_frames: Block size in frames
+    :rtype Iterator[np.ndarray]: Summed one-dimensional blocks
+    '''
+    with ExitStack() as stack:
+        readers = [_block_reader(stack, source, block_frames) for source in files_path]
+        while True:
+            mixed = None
+            for read in readers:
+                block = read()
+                if block.shape[0] == 0:
+                    continue
+                if mixed is None:
+                    mixed = block
+                elif block.shape[0] > mixed.shape[0]:
+                    block[:mixed.shape[0]] += mixed
+                    mixed = block
+                else:
+                    mixed[:block.shape[0]] += block
+            if mixed is None:
+                return
+            yield mixed
+
+
+def make_one_channel_audio_streaming(
+        files_path: List[str | np.ndarray],
+        output_path: str | Path,
+        sr: int = SAMPLE_RATE,
+        block_frames: int = BLOCK_FRAMES,
+) -> Path:
+    '''
+    Потоковое сведение в один канал с постоянным расходом памяти.
+    Первый проход только ищет пик суммы, второй — пишет нормированную сумму в output_path блоками.
+
+    :param files_path: Paths to the audiofiles or one-dimensional signals
+    :param output_path: Path to the resulting wav file
+    :param int sr: Signal sample rate
+    :param int block_frames: Block size in frames
+    :rtype Path: Path to the written file
+    '''
+    peak = 0.0
+    for block in iter_mixed_blocks(files_path, block_frames):
+        peak = max(peak, float(np.max(np.abs(block))))
+    scale = 1.0 / peak if peak > 0 else 1.0
+
+    output_path = Path(output_path)
+    with sf.SoundFile(str(output_path), "w", samplerate=sr, channels=1, subtype="FLOAT", format="WAV") as out:
+        for block in tqdm(iter_mixed_blocks(files_path, block_frames)):
+            out.write(block * scale)
+    return output_path
\ No newline at end of file
@@ -0,0 +1,218 @@
+import copy
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from pyannote.core import Annotation
+
+from app.pipeline.progress.windowed_diarization import run_diarization
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """Один вызов модели от одного потока-записи."""
+
+    def __init__(self, args: Tuple[torch.Tensor, ...], kwargs: Dict[str, Any]):
+        self.args = args
+        self.kwargs = kwargs
+        self.rows = int(args[0].shape[0])
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SharedBatchRunner:
+    """
+    Склеивает вызовы модели из нескольких потоков (по одному на запись) в общий батч.
+
+    Отдельный поток забирает вызовы из очереди, ждёт остальные активные записи
+    не дольше max_wait секунд, выполняет модель один раз и раздаёт строки результата обратно.
+    """
+
+    def __init__(self, fn: Callable[..., Any], max_rows: int, max_wait: float, producers: Callable[[], int]):
+        self.fn = fn
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.producers = producers
+        self._queue: "queue.Queue[_Call]" = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True, name="diarization-batch-runner").start()
+
+    def __call__(self, *args, **kwargs):
+        call = _Call(args, kwargs)
+        self._queue.put(call)
+        call.event.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            rows = batch[0].rows
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_rows and len(batch) < self.producers():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    call = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(call)
+                rows += call.rows
+            self._run(batch)
+
+    def _run(self, batch: List[_Call]) -> None:
+        try:
+            if len(batch) == 1:
+                batch[0].result = self.fn(*batch[0].args, **batch[0].kwargs)
+            else:
+                args = [torch.cat([c.args[i] for c in batch]) for i in range(len(batch[0].args))]
+                kwargs = {
+                    k: torch.cat([c.kwargs[k] for c in batch]) if isinstance(v, torch.Tensor) else v
+                    for k, v in batch[0].kwargs.items()
+                }
+                output = self.fn(*args, **kwargs)
+                offsets = np.cumsum([c.rows for c in batch])[:-1]
+                parts = np.split(output, offsets) if isinstance(output, np.ndarray) \
+                    else torch.tensor_split(output, offsets.tolist())
+                for call, part in zip(batch, parts):
+                    call.result = part
+        except BaseException as e:
+            for call in batch:
+                call.error = e
+        finally:
+            for call in batch:
+                call.event.set()
+
+
+class _EmbeddingProxy:
+    """Подменяет pipeline._embedding: вызов идёт через общий батч, остальные атрибуты — к оригиналу."""
+
+    def __init__(self, embedding, runner: SharedBatchRunner):
+        self._original = embedding
+        self._runner = runner
+
+    def __getattr__(self, name):
+        return getattr(self._original, name)
+
+    def __call__(self, waveforms: torch.Tensor, masks: Optional[torch.Tensor] = None):
+        if masks is None:
+            return self._runner(waveforms)
+        return self._runner(waveforms, masks=masks)
+
+
+def private_pipeline(pipeline, shared: List[Any]):
+    """Глубокая копия pipeline без копирования весов: объекты из shared (модели) остаются общими."""
+    return copy.deepcopy(pipeline, memo={id(obj): obj for obj in shared})
+
+
+class BatchedDiarizationService:
+    """
+    Сервис пакетной диаризации на GPU-воркере.
+
+    Запросы разных заседаний группируются в течение window секунд (не более max_recordings),
+    чтобы записи стартовали вместе; каждая запись диаризуется в своём потоке, а вызовы
+    сегментационной и эмбеддинговой моделей всех идущих потоков склеиваются в общие батчи.
+    Сборщик потоки не ждёт: запрос, пришедший во время долгой диаризации, занимает свободный
+    слот сразу после своего окна и не стоит в очереди за чужими записями. Одновременно идёт
+    не больше max_recordings записей (по числу копий pipeline). Результат возвращается каждому
+    запросу через Future, по его request_id (operation_id).
+
+    Потокобезопасность: pipeline процесса не изменяется. Каждый поток записи работает со своей
+    копией pipeline (private_pipeline: всё состояние apply() — своё, веса общие), у копии
+    _segmentation.infer и _embedding направлены в SharedBatchRunner. Сами модели вызываются только
+    из потока своего SharedBatchRunner (по одному на модель), то есть прямые проходы не пересекаются.
+    """
+
+    def __init__(
+            self,
+            pipeline,
+            window: float,
+            max_recordings: int,
+            max_rows: int = 128,
+            max_wait: float = 0.05,
+    ):
+        self.pipeline = pipeline
+        self.window = window
+        self.max_recordings = max_recordings
+        self._requests: "queue.Queue[Tuple[str, torch.Tensor, int, Dict[str, Any], Future]]" = queue.Queue()
+        self._active = 0
+        self._active_lock = threading.Lock()
+
+        original_embedding = pipeline._embedding
+        segmentation = SharedBatchRunner(pipeline._segmentation.infer, max_rows, max_wait, lambda: self._active)
+        embedding = SharedBatchRunner(
+            lambda w, masks=None: original_embedding(w, masks=masks), max_rows, max_wait, lambda: self._active
+        )
+        # по копии pipeline на каждый одновременный поток записи
+        self._slots: "queue.Queue[Any]" = queue.Queue()
+        for _ in range(max(1, max_recordings)):
+            private = private_pipeline(pipeline, [pipeline._segmentation.model, original_embedding])
+            private._segmentation.infer = segmentation
+            private._embedding = _EmbeddingProxy(original_embedding, embedding)
+            self._slots.put(private)
+
+        threading.Thread(target=self._collect, daemon=True, name="diarization-batch-collector").start()
+
+    def submit(self, request_id: str, waveform: torch.Tensor, sample_rate: int, **kwargs) -> Future:
+        future: Future = Future()
+        self._requests.put((request_id, waveform, sample_rate, kwargs, future))
+        return future
+
+    def diarize(self, request_id: str, waveform: torch.Tensor, sample_rate: int, **kwargs) -> Tuple[Annotation, Optional[np.ndarray]]:
+        return self.submit(request_id, waveform, sample_rate, **kwargs).result()
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_recordings:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch) -> None:
+        """Запускает потоки записей группы и сразу возвращается к приёму запросов."""
+        logger.info(f"[DIARIZATION] группа из {len(batch)} записей: {', '.join(item[0] for item in batch)}")
+        for item in batch:
+            threading.Thread(target=self._worker, args=item, daemon=True, name=f"diarization-{item[0]}").start()
+
+    def _worker(self, request_id, waveform, sample_rate, kwargs, future) -> None:
+        private = self._slots.get()  # свободная копия pipeline; ждём, только если идут max_recordings записей
+        with self._active_lock:
+            self._active += 1
+        t0 = time.perf_counter()
+        try:
+            future.set_result(run_diarization(private, waveform, sample_rate, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._active_lock:
+                self._active -= 1
+            self._slots.put(private)
+            logger.info(f"[DIARIZATION] {request_id}: {time.perf_counter() - t0:.1f} с")
+
+
+_service: Optional[BatchedDiarizationService] = None
+_service_lock = threading.Lock()
+
+
+def get_batch_service(pipeline, window: float, max_recordings: int, max_rows: int) -> BatchedDiarizationService:
+    """Сервис процесса (создаётся при первом обращении; общий pipeline не изменяется)."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = BatchedDiarizationService(pipeline, window, max_recordings, max_rows)
+    return _service
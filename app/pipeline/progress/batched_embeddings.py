@@ -0,0 +1,150 @@
+import random
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import torch
+
+from app.pipeline.audio_cache import get_audio_artifact
+
+Interval = Tuple[float, float, str]
+Crop = Tuple[str, int, int]  # (speaker, start_sample, end_sample)
+
+
+def sample_speaker_crops(
+        intervals: List[Interval],
+        sample_rate: int,
+        max_per_speaker: int,
+        min_duration: float,
+        max_duration: float,
+        seed: int = 42,
+) -> List[Crop]:
+    """
+    Выбирает до max_per_speaker интервалов каждого спикера (не короче min_duration)
+    и обрезает их до max_duration секунд. Возвращает вырезки в отсчётах.
+    """
+    by_speaker: Dict[str, List[Tuple[float, float]]] = {}
+    for start, end, spk in intervals:
+        if end - start >= min_duration:
+            by_speaker.setdefault(spk, []).append((start, end))
+
+    rng = random.Random(seed)
+    crops: List[Crop] = []
+    for spk in sorted(by_speaker):
+        chosen = by_speaker[spk]
+        if len(chosen) > max_per_speaker:
+            chosen = rng.sample(chosen, max_per_speaker)
+        for start, end in chosen:
+            end = min(end, start + max_duration)
+            crops.append((spk, int(start * sample_rate), int(end * sample_rate)))
+    return crops
+
+
+def iter_crop_batches(audio: np.ndarray, crops: List[Crop], batch_size: int) -> Iterator[Tuple[List[str], torch.Tensor, torch.Tensor]]:
+    """
+    Батчи (speakers, waveforms (B, 1, T), masks (B, T)).
+    Вырезки сортируются по длине, поэтому в батче похожие длины и паддинг минимален.
+    """
+    crops = sorted(crops, key=lambda c: c[2] - c[1])
+    for i in range(0, len(crops), batch_size):
+        batch = crops[i:i + batch_size]
+        length = max(min(e, len(audio)) - s for _, s, e in batch)
+        waveforms = torch.zeros(len(batch), 1, max(length, 1))
+        masks = torch.zeros(len(batch), max(length, 1))
+        for j, (_, s, e) in enumerate(batch):
+            chunk = torch.from_numpy(np.asarray(audio[s:min(e, len(audio))], dtype=np.float32))
+            waveforms[j, 0, :chunk.shape[0]] = chunk
+            masks[j, :chunk.shape[0]] = 1.0
+        yield [spk for spk, _, _ in batch], waveforms, masks
+
+
+def build_src_speaker_voiceprints_batched(
+        intervals: List[Interval],
+        merged_audio_path: Path,
+        embedding,
+        cache_dir: Path,
+        batch_size: int = 32,
+        max_per_speaker: int = 50,
+        min_duration: float = 1.0,
+        max_duration: float = 10.0,
+        sample_rate: int = 16000,
+) -> Dict[str, np.ndarray]:
+    """
+    Голосовые отпечатки диаризованных спикеров по общему аудио.
+
+    Все выбранные интервалы всех спикеров режутся из кэша артефактов, раскладываются
+    по батчам фиксированного размера с маской паддинга, и модель эмбеддингов
+    вызывается один раз на батч. Отпечаток спикера — среднее его эмбеддингов.
+    Работает одинаково на CPU и GPU (устройство определяется моделью).
+    """
+    audio = get_audio_artifact(merged_audio_path, sample_rate, cache_dir)
+    crops = sample_speaker_crops(intervals, sample_rate, max_per_speaker, min_duration, max_duration)
+
+    sums: Dict[str, np.ndarray] = {}
+    counts: Dict[str, int] = {}
+    with torch.inference_mode():
+        for speakers, waveforms, masks in iter_crop_batches(audio, crops, batch_size):
+            vectors = np.asarray(embedding(waveforms, masks=masks))
+            for spk, vec in zip(speakers, vectors):
+                if not np.all(np.isfinite(vec)):
+                    continue
+                sums[spk] = sums.get(spk, 0) + vec
+                counts[spk] = counts.get(spk, 0) + 1
+
+    print(f"[VOICEPRINTS] {len(crops)} интервалов, {len(sums)} спикеров, батчей: {-(-len(crops) // batch_size)}")
+    return {spk: sums[spk] / counts[spk] for spk in sums}
+
+
+def sample_file_crops(
+        key: str,
+        audio: np.ndarray,
+        sample_rate: int,
+        max_crops: int,
+        crop_duration: float,
+) -> List[Crop]:
+    """
+    Вырезки микрофонного файла: окна по crop_duration секунд, max_crops самых громких
+    (на своём микрофоне участник громче всего, тишина и фон отбрасываются).
+    """
+    window = max(1, int(crop_duration * sample_rate))
+    n = len(audio) // window
+    if n == 0:
+        return [(key, 0, len(audio))] if len(audio) else []
+    rms = np.sqrt(np.mean(np.square(np.asarray(audio[:n * window], dtype=np.float32).reshape(n, window)), axis=1))
+    chosen = sorted(np.argsort(rms)[::-1][:max_crops])
+    return [(key, int(i) * window, (int(i) + 1) * window) for i in chosen]
+
+
+def build_file_voiceprints_batched(
+        wav_files: List[Path],
+        embedding,
+        cache_dir: Path,
+        key_fn,
+        batch_size: int = 32,
+        max_per_file: int = 50,
+        crop_duration: float = 10.0,
+        sample_rate: int = 16000,
+) -> Dict[str, np.ndarray]:
+    """
+    Голосовые отпечатки микрофонных файлов той же моделью embedding, что и
+    build_src_speaker_voiceprints_batched: вырезки всех файлов идут в общие батчи,
+    отпечаток файла — среднее его эмбеддингов, ключ — key_fn(path).
+    """
+    sums: Dict[str, np.ndarray] = {}
+    counts: Dict[str, int] = {}
+    n_crops = 0
+    with torch.inference_mode():
+        for path in wav_files:
+            key = key_fn(path)
+            audio = get_audio_artifact(path, sample_rate, cache_dir)
+            crops = sample_file_crops(key, audio, sample_rate, max_per_file, crop_duration)
+            n_crops += len(crops)
+            for keys, waveforms, masks in iter_crop_batches(audio, crops, batch_size):
+                vectors = np.asarray(embedding(waveforms, masks=masks))
+                for k, vec in zip(keys, vectors):
+                    if np.all(np.isfinite(vec)):
+                        sums[k] = sums.get(k, 0) + vec
+                        counts[k] = counts.get(k, 0) + 1
+
+    print(f"[VOICEPRINTS] {len(wav_files)} микрофонов, {n_crops} вырезок")
+    return {k: sums[k] / counts[k] for k in sums}
@@ -0,0 +1,74 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from app.pipeline.progress.interval_table import IntervalSource, load_intervals
+
+
+BLOCK_FRAMES = 1 << 14
+
+
+def frame_energies(audio: np.ndarray, frame: int) -> np.ndarray:
+    """Средняя энергия (x²) по кадрам длиной frame отсчётов; читает memmap блоками."""
+    num_frames = len(audio) // frame
+    out = np.empty(num_frames, dtype=np.float64)
+    for i in range(0, num_frames, BLOCK_FRAMES):
+        j = min(i + BLOCK_FRAMES, num_frames)
+        block = np.asarray(audio[i * frame:j * frame], dtype=np.float64).reshape(j - i, frame)
+        out[i:j] = np.mean(block * block, axis=1)
+    return out
+
+
+def speaker_mic_energy_db(
+        intervals: IntervalSource,
+        channels: List[np.ndarray],
+        sample_rate: int,
+        frame_sec: float = 0.02,
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Матрица спикер × микрофон: средняя энергия речи спикера в канале микрофона (дБ)
+    относительно средней энергии этого канала за всю запись (компенсирует разное усиление микрофонов).
+    """
+    table = load_intervals(intervals)
+    frame = max(1, int(frame_sec * sample_rate))
+    start_f = (table.starts * sample_rate / frame).astype(np.int64)
+    end_f = np.ceil(table.ends * sample_rate / frame).astype(np.int64)
+    num_speakers = len(table.labels)
+
+    matrix = np.empty((num_speakers, len(channels)))
+    for m, audio in enumerate(channels):
+        energy = frame_energies(audio, frame)
+        cumsum = np.concatenate([[0.0], np.cumsum(energy)])
+        s = np.clip(start_f, 0, len(energy))
+        e = np.clip(end_f, 0, len(energy))
+        sums = np.bincount(table.codes, weights=cumsum[e] - cumsum[s], minlength=num_speakers)
+        counts = np.bincount(table.codes, weights=(e - s).astype(np.float64), minlength=num_speakers)
+        speech = sums / np.maximum(counts, 1)
+        matrix[:, m] = 10 * np.log10((speech + 1e-12) / (energy.mean() + 1e-12)) if len(energy) else -np.inf
+    return table.labels, matrix
+
+
+def assign_by_energy(
+        speakers: List[str],
+        labels: List[str],
+        matrix_db: np.ndarray,
+        margin_db: float,
+) -> Tuple[Optional[Dict[str, str]], float]:
+    """
+    Венгерский алгоритм по матрице энергий. Возвращает (speaker -> label, минимальный запас в дБ)
+    или (None, запас), если назначение неоднозначно: спикеров больше, чем микрофонов,
+    либо для какого-то спикера выбранный микрофон громче следующего меньше чем на margin_db.
+    """
+    if len(speakers) == 0 or len(speakers) > len(labels):
+        return None, 0.0
+
+    rows, cols = linear_sum_assignment(-matrix_db)
+    margins = []
+    for r, c in zip(rows, cols):
+        others = np.delete(matrix_db[r], c)
+        margins.append(matrix_db[r, c] - others.max() if len(others) else np.inf)
+    margin = float(min(margins))
+    if margin < margin_db:
+        return None, margin
+    return {speakers[r]: labels[c] for r, c in zip(rows, cols)}, margin
@@ -1,9 +1,15 @@
+import os
 import re
 import json
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from docx import Document
 from pydub import AudioSegment
+import soundfile as sf
+
+from app.pipeline.progress.segment_writer import encode_delivery
 
 
 def format_time_hms(seconds: float) -> str:
@@ -119,6 +125,71 @@ def wav_to_mp3(input_path: str, output_path: str | None = None, bitrate: str = "
     return str(output_path)
 
 
+def encode_segment(wav_path: str, out_path: str, delivery_format: str = "mp3", bitrate: str = "192k") -> Tuple[str, float]:
+    """
+    Кодирует один сегмент через временный файл (оборванное кодирование не оставит битый файл).
+    Возвращает (путь к результату, секунды кодирования). Вызывается в процессе пула.
+    """
+    started = time.perf_counter()
+    out = Path(out_path)
+    tmp = out.with_name(f"{out.stem}.{os.getpid()}.tmp{out.suffix}")
+    if delivery_format == "mp3":
+        wav_to_mp3(wav_path, tmp, bitrate=bitrate)
+    else:
+        data, sr = sf.read(wav_path, dtype="float32")
+        encode_delivery(data, sr, tmp, delivery_format)
+    tmp.replace(out)
+    return out_path, time.perf_counter() - started
+
+
+def encode_segments_parallel(
+        jobs: List[Tuple[Path, Path]],
+        delivery_format: str = "mp3",
+        bitrate: str = "192k",
+        max_workers: int = 4,
+) -> Dict[str, float]:
+    """
+    Параллельное кодирование сегментов WAV -> MP3/Opus в пуле процессов.
+
+    jobs — пары (wav, целевой файл); уже существующие целевые файлы пропускаются.
+    Каждый сегмент — отдельный ffmpeg/libsndfile, поэтому пул процессов, а не цикл.
+    Если процессы создать нельзя (демонический воркер), кодируем в пуле потоков.
+    Возвращает {имя файла: секунды кодирования}.
+    """
+    pending = [(wav, out) for wav, out in jobs if not Path(out).exists()]
+    timings: Dict[str, float] = {}
+    if not pending:
+        return timings
+
+    def run(executor: Executor) -> None:
+        futures = [
+            executor.submit(encode_segment, str(wav), str(out), delivery_format, bitrate)
+            for wav, out in pending if Path(out).name not in timings
+        ]
+        for future in as_completed(futures):
+            out_path, seconds = future.result()
+            timings[Path(out_path).name] = seconds
+            print(f"[ENCODE] {Path(out_path).name}: {seconds:.2f} с")
+
+    workers = max(1, min(max_workers, len(pending)))
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            run(executor)
+    except AssertionError:
+        # daemonic processes are not allowed to have children
+        print("[ENCODE] пул процессов недоступен, кодируем в пуле потоков")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            run(executor)
+
+    wall = time.perf_counter() - started
+    print(
+        f"[ENCODE] закодировано {len(timings)} сегментов за {wall:.2f} с "
+        f"(воркеров {workers}, сумма {sum(timings.values()):.2f} с, макс {max(timings.values()):.2f} с)"
+    )
+    return timings
+
+
 def speaker_name_to_id(spk: str) -> int:
     """
     'SPEAKER_02' -> 2
@@ -179,6 +250,7 @@ def convert_intervals_to_target_json_s3(
         speaker_to_file: Dict[str, str],
         label_to_file: Optional[Dict[str, str]] = None,
         s3_prefix: str = "segments",
+        delivery_suffix: str = ".mp3",
 ) -> List[Dict[str, Any]]:
 
     label_to_id = build_label_to_id(speaker_to_label)
@@ -197,7 +269,7 @@ def convert_intervals_to_target_json_s3(
         wav_path = it.get("file_name")
         if wav_path:
             wav_path = Path(wav_path)
-            mp3_name = wav_path.with_suffix(".mp3").name
+            mp3_name = wav_path.with_suffix(delivery_suffix).name
             s3_key = f"{s3_prefix}/{mp3_name}"
             file_url = s3_key
         else:
@@ -0,0 +1,155 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+Interval = Tuple[float, float, str]  # (start, end, speaker)
+
+
+class IntervalTable:
+    """
+    Колоночное хранилище интервалов: starts/ends (float64), коды спикеров (int32)
+    и таблица меток labels[code]. Все операции векторизованы и возвращают новую таблицу.
+    """
+
+    __slots__ = ("starts", "ends", "codes", "labels")
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, codes: np.ndarray, labels: Sequence[str]):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.labels = list(labels)
+
+    # ---------------- Conversion ----------------
+    @classmethod
+    def from_tuples(cls, intervals: Iterable[Sequence]) -> "IntervalTable":
+        """Из списка (start, end, speaker); порядок меток — порядок первого появления."""
+        intervals = list(intervals)
+        label_index: Dict[str, int] = {}
+        codes = [label_index.setdefault(spk, len(label_index)) for _, _, spk in intervals]
+        return cls(
+            np.fromiter((it[0] for it in intervals), dtype=np.float64, count=len(intervals)),
+            np.fromiter((it[1] for it in intervals), dtype=np.float64, count=len(intervals)),
+            np.asarray(codes, dtype=np.int32),
+            list(label_index),
+        )
+
+    def to_tuples(self) -> List[Interval]:
+        labels = self.labels
+        return list(zip(self.starts.tolist(), self.ends.tolist(), [labels[c] for c in self.codes.tolist()]))
+
+    def __len__(self) -> int:
+        return int(self.starts.shape[0])
+
+    def _take(self, index) -> "IntervalTable":
+        return IntervalTable(self.starts[index], self.ends[index], self.codes[index], self.labels)
+
+    # ---------------- Operations ----------------
+    def sort(self) -> "IntervalTable":
+        """Сортировка по началу (стабильная)."""
+        return self._take(np.argsort(self.starts, kind="stable"))
+
+    def merge_consecutive(self, gap: float = np.inf) -> "IntervalTable":
+        """
+        Склеивает подряд идущие интервалы одного спикера, если пауза между ними не больше gap.
+        Конец склеенного интервала — максимум концов группы (как в merge_consecutive_intervals).
+        """
+        if len(self) == 0:
+            return self
+        new_group = np.empty(len(self), dtype=bool)
+        new_group[0] = True
+        new_group[1:] = self.codes[1:] != self.codes[:-1]
+        if np.isfinite(gap):
+            # пауза считается от текущего конца группы (максимум концов), а не от конца предыдущего
+            # интервала: вложенный короткий интервал не должен разрывать группу
+            running = self.ends.copy()
+            bounds = np.append(np.flatnonzero(new_group), len(self))
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                running[a:b] = np.maximum.accumulate(self.ends[a:b])
+            new_group[1:] |= self.starts[1:] - running[:-1] > gap
+        heads = np.flatnonzero(new_group)
+        return IntervalTable(
+            self.starts[heads],
+            np.maximum.reduceat(self.ends, heads),
+            self.codes[heads],
+            self.labels,
+        )
+
+    def filter_min_duration(self, min_duration: float) -> "IntervalTable":
+        """Отбрасывает интервалы короче min_duration секунд."""
+        return self._take((self.ends - self.starts) >= min_duration)
+
+    def clip_overlaps(self) -> "IntervalTable":
+        """Обрезает конец каждого интервала по началу следующего (таблица должна быть отсортирована)."""
+        ends = self.ends.copy()
+        ends[:-1] = np.minimum(ends[:-1], self.starts[1:])
+        table = IntervalTable(self.starts, ends, self.codes, self.labels)
+        return table._take(table.ends > table.starts)
+
+    def pad(self, start: float = 0.0, end: float = 0.0, max_end: float | None = None) -> "IntervalTable":
+        """Расширяет интервалы на start секунд назад и end секунд вперёд, с ограничением [0, max_end]."""
+        starts = np.maximum(self.starts - start, 0.0)
+        ends = self.ends + end
+        if max_end is not None:
+            ends = np.minimum(ends, max_end)
+        return IntervalTable(starts, ends, self.codes, self.labels)
+
+    def relabel(self, mapping: Dict[str, str]) -> "IntervalTable":
+        """
+        Переименование спикеров через таблицу меток, без прохода по интервалам.
+        Спикер без метки в mapping — KeyError (как при поштучной замене speaker_to_label[spk]).
+        """
+        used = np.unique(self.codes).tolist()
+        missing = [self.labels[c] for c in used if self.labels[c] not in mapping]
+        if missing:
+            raise KeyError(f"Нет метки для спикеров: {missing}")
+        new_labels = [mapping.get(lbl, lbl) for lbl in self.labels]
+        unique: Dict[str, int] = {}
+        remap = np.asarray([unique.setdefault(lbl, len(unique)) for lbl in new_labels], dtype=np.int32)
+        return IntervalTable(self.starts, self.ends, remap[self.codes] if len(remap) else self.codes, list(unique))
+
+    def sample_ranges(self, sample_rate: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Границы интервалов в отсчётах (как int(t * sr) поштучно)."""
+        return (self.starts * sample_rate).astype(np.int64), (self.ends * sample_rate).astype(np.int64)
+
+    # ---------------- Binary I/O ----------------
+    def save(self, path: Path) -> Path:
+        """Компактное бинарное сохранение (.npz: starts, ends, codes, labels), атомарно."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp.npz")  # np.savez дописывает .npz к имени без него
+        np.savez(
+            tmp_path,
+            starts=self.starts,
+            ends=self.ends,
+            codes=self.codes,
+            labels=np.asarray(self.labels, dtype=np.str_),
+        )
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "IntervalTable":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["starts"], data["ends"], data["codes"], data["labels"].tolist())
+
+
+IntervalSource = Union[IntervalTable, Path, str, Sequence[Sequence]]
+
+
+def load_intervals(source: IntervalSource) -> IntervalTable:
+    """
+    Интервалы для шага пайплайна: таблица как есть, .npz от IntervalTable.save,
+    JSON-список (start, end, speaker) прежних версий или сам список.
+    """
+    if isinstance(source, IntervalTable):
+        return source
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        if path.suffix == ".npz":
+            return IntervalTable.load(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return IntervalTable.from_tuples(json.load(f))
+    return IntervalTable.from_tuples(source)
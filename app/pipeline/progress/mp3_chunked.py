@@ -0,0 +1,146 @@
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Deque, List, Optional, Tuple
+
+import soundfile as sf
+
+# Layer III: битрейты (кбит/с) по индексу; частоты по биту версии (3 — MPEG1, 2 — MPEG2, 0 — MPEG2.5)
+MP3_BITRATES = {
+    "mpeg1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "mpeg2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def mp3_frame_samples(sample_rate: int) -> int:
+    """Отсчётов в кадре Layer III: 1152 для MPEG1 (32–48 кГц), 576 для MPEG2/2.5 (8–24 кГц)."""
+    return 1152 if sample_rate >= 32000 else 576
+
+
+def mp3_frames(data: bytes) -> List[Tuple[int, int]]:
+    """
+    Разбор потока MP3 на кадры по заголовкам: [(смещение, длина), ...].
+    ID3v2 в начале и ID3v1 в конце пропускаются, всё остальное обязано быть кадрами Layer III.
+    """
+    pos = 0
+    if data[:3] == b"ID3":
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        pos = 10 + size
+    frames: List[Tuple[int, int]] = []
+    while pos + 4 <= len(data):
+        if data[pos:pos + 3] == b"TAG":
+            break
+        header = int.from_bytes(data[pos:pos + 4], "big")
+        version = (header >> 19) & 3
+        layer = (header >> 17) & 3
+        bitrate_idx = (header >> 12) & 0xF
+        sr_idx = (header >> 10) & 3
+        if header >> 21 != 0x7FF or version == 1 or layer != 1 or bitrate_idx in (0, 15) or sr_idx == 3:
+            raise ValueError(f"Битый заголовок кадра MP3 на смещении {pos}")
+        sample_rate = MP3_SAMPLE_RATES[version][sr_idx]
+        kbps = MP3_BITRATES["mpeg1" if version == 3 else "mpeg2"][bitrate_idx]
+        length = (144 if version == 3 else 72) * kbps * 1000 // sample_rate + ((header >> 9) & 1)
+        frames.append((pos, length))
+        pos += length
+    return frames
+
+
+def encode_mp3_chunk(
+        wav_path: str,
+        first: int,
+        last: int,
+        keep_from: int,
+        keep_count: Optional[int],
+        bitrate: str,
+        ffmpeg: str = "ffmpeg",
+) -> bytes:
+    """
+    Кодирует отсчёты [first, last) через ffmpeg (stdin/stdout, без временных файлов) и возвращает
+    кадры [keep_from, keep_from + keep_count) — без кадров разгона и дозаписи.
+    CBR без bit reservoir: кадр не ссылается на байты предыдущих, поэтому кадры можно резать и склеивать.
+    """
+    with sf.SoundFile(wav_path) as f:
+        f.seek(first)
+        pcm = f.read(last - first, dtype="int16", always_2d=True)
+        sample_rate, channels = f.samplerate, f.channels
+    proc = subprocess.run(
+        [
+            ffmpeg, "-hide_banner", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+            "-c:a", "libmp3lame", "-b:a", bitrate, "-reservoir", "0",
+            "-write_xing", "0", "-id3v2_version", "0", "-map_metadata", "-1",
+            "-f", "mp3", "pipe:1",
+        ],
+        input=pcm.tobytes(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg: {proc.stderr.decode(errors='replace').strip()}")
+    frames = mp3_frames(proc.stdout)
+    kept = frames[keep_from:] if keep_count is None else frames[keep_from:keep_from + keep_count]
+    return b"".join(proc.stdout[offset:offset + length] for offset, length in kept)
+
+
+def encode_mp3_chunked(
+        wav_path: Path,
+        out_path: Path,
+        bitrate: str = "192k",
+        max_workers: int = 4,
+        chunk_seconds: float = 300.0,
+        preroll_frames: int = 4,
+        ffmpeg: str = "ffmpeg",
+) -> Path:
+    """
+    MP3 длинной записи: WAV режется по границам кадров на куски по chunk_seconds,
+    куски кодируются параллельно (max_workers процессов ffmpeg) и склеиваются в один поток без щелчков.
+
+    Каждый кусок кодируется с preroll_frames кадров до и после своих границ: разгон энкодера и
+    перекрытие MDCT на стыке считаются по настоящему сигналу, а лишние кадры отбрасываются по
+    заголовкам. Задержка энкодера у всех кусков одинакова, поэтому оставленный кадр j куска
+    соответствует тем же отсчётам, что кадр j цельного кодирования. В памяти — не больше
+    2 * max_workers кусков, WAV целиком не читается. Запись атомарная (tmp + replace).
+    """
+    wav_path, out_path = Path(wav_path), Path(out_path)
+    info = sf.info(str(wav_path))
+    total = info.frames
+    frame = mp3_frame_samples(info.samplerate)
+    chunk_frames = max(preroll_frames + 1, round(chunk_seconds * info.samplerate / frame))
+    chunk = chunk_frames * frame
+    margin = preroll_frames * frame
+
+    jobs = []
+    for start in range(0, max(total, 1), chunk):
+        end = min(start + chunk, total)
+        is_first, is_last = start == 0, end >= total
+        jobs.append((
+            str(wav_path),
+            start if is_first else start - margin,
+            end if is_last else min(end + margin, total),
+            0 if is_first else preroll_frames,
+            None if is_last else chunk_frames,
+            bitrate,
+            ffmpeg,
+        ))
+
+    started = time.perf_counter()
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool, open(tmp_path, "wb") as out:
+        # ffmpeg — отдельные процессы, потокам остаётся только ждать; порядок записи = порядок кусков
+        window: Deque[Future] = deque()
+        for job in jobs:
+            window.append(pool.submit(encode_mp3_chunk, *job))
+            if len(window) >= 2 * max(1, max_workers):
+                out.write(window.popleft().result())
+        while window:
+            out.write(window.popleft().result())
+    tmp_path.replace(out_path)
+
+    print(
+        f"[MP3] {out_path.name}: {total / info.samplerate:.0f} с аудио, {len(jobs)} кусков, "
+        f"{max(1, max_workers)} воркеров, {time.perf_counter() - started:.2f} с"
+    )
+    return out_path
@@ -0,0 +1,57 @@
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Упакованные сегменты: один файл-контейнер на операцию (конкатенация файлов доставки сегментов)
+# + индекс {имя сегмента: [смещение, длина]}. Каждый диапазон — самостоятельный MP3/Opus файл,
+# поэтому сегмент воспроизводится обычным Range-запросом к одному объекту.
+# Ссылка на сегмент в file_name: "<ключ контейнера>#bytes=<первый байт>-<последний байт>".
+
+PACK_REF_MARK = "#bytes="
+
+
+def pack_ref(key: str, offset: int, length: int) -> str:
+    return f"{key}{PACK_REF_MARK}{offset}-{offset + length - 1}"
+
+
+def parse_pack_ref(ref: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """(ключ, (первый, последний байт)) для ссылки в контейнер; (ref, None) для обычного ключа."""
+    key, mark, byte_range = ref.partition(PACK_REF_MARK)
+    if not mark:
+        return ref, None
+    first, last = byte_range.split("-", 1)
+    return key, (int(first), int(last))
+
+
+def index_path(pack_path: Path) -> Path:
+    return pack_path.with_name(pack_path.name + ".index.json")
+
+
+def build_pack(files: List[Path], pack_path: Path) -> Dict[str, Tuple[int, int]]:
+    """
+    Склеивает files в pack_path и пишет индекс рядом (оба атомарно).
+    Если контейнер с тем же набором файлов уже собран — возвращает его индекс.
+    """
+    idx_path = index_path(pack_path)
+    names = [f.name for f in files]
+    if pack_path.exists() and idx_path.exists():
+        index = {name: tuple(v) for name, v in json.loads(idx_path.read_text(encoding="utf-8")).items()}
+        if sorted(index) == sorted(names):
+            return index
+
+    index: Dict[str, Tuple[int, int]] = {}
+    tmp_pack = pack_path.with_name(pack_path.name + ".tmp")
+    with open(tmp_pack, "wb") as out:
+        for f in files:
+            offset = out.tell()
+            with open(f, "rb") as src:
+                shutil.copyfileobj(src, out, 1 << 20)
+            index[f.name] = (offset, out.tell() - offset)
+    tmp_pack.replace(pack_path)
+
+    tmp_idx = idx_path.with_name(idx_path.name + ".tmp")
+    tmp_idx.write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+    tmp_idx.replace(idx_path)
+    print(f"[PACK] {pack_path.name}: {len(index)} сегментов, {pack_path.stat().st_size} байт")
+    return index
@@ -0,0 +1,171 @@
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+import soundfile as sf
+
+# формат доставки -> (расширение, параметры soundfile); MP3 кодируется ffmpeg (encode_mp3)
+DELIVERY_FORMATS = {
+    "mp3": (".mp3", None),
+    "opus": (".opus", {"format": "OGG", "subtype": "OPUS"}),
+}
+
+
+def delivery_suffix(delivery_format: Optional[str]) -> str:
+    """Расширение файла доставки; без формата — MP3, как раньше в export."""
+    return DELIVERY_FORMATS[delivery_format or "mp3"][0]
+
+
+def write_audio_atomic(path: Path, samples: np.ndarray, sample_rate: int, **kwargs) -> Path:
+    """Запись через временный файл (расширение сохраняется, чтобы libsndfile понял формат)."""
+    tmp_path = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp{path.suffix}")
+    sf.write(str(tmp_path), samples, sample_rate, **kwargs)
+    tmp_path.replace(path)
+    return path
+
+
+def encode_mp3(samples: np.ndarray, sample_rate: int, out_path: Path, bitrate: str, ffmpeg: str = "ffmpeg") -> Path:
+    """
+    MP3 через ffmpeg/libmp3lame с явным битрейтом — тот же энкодер и битрейт, что давал pydub в export.
+    PCM подаётся в stdin, запись атомарная.
+    """
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+    tmp_path = out_path.with_name(f"{out_path.stem}.{threading.get_ident()}.tmp{out_path.suffix}")
+    proc = subprocess.run(
+        [
+            ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+            "-c:a", "libmp3lame", "-b:a", bitrate, "-f", "mp3", str(tmp_path),
+        ],
+        input=pcm.tobytes(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        tmp_path.unlink(missing_ok=True)
+        raise RuntimeError(f"ffmpeg: {proc.stderr.decode(errors='replace').strip()}")
+    tmp_path.replace(out_path)
+    return out_path
+
+
+def encode_delivery(
+        samples: np.ndarray,
+        sample_rate: int,
+        out_path: Path,
+        delivery_format: str,
+        mp3_bitrate: str = "192k",
+        ffmpeg: str = "ffmpeg",
+) -> Path:
+    if delivery_format == "mp3":
+        return encode_mp3(samples, sample_rate, out_path, mp3_bitrate, ffmpeg)
+    return write_audio_atomic(out_path, samples, sample_rate, **DELIVERY_FORMATS[delivery_format][1])
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """Жёсткая ссылка на уже закодированный файл; копия, если ссылка невозможна (другой диск)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class SegmentWriter:
+    """
+    Пул, который вырезает и кодирует сегменты параллельно.
+
+    submit() ставит сегмент в очередь и блокируется, если в работе уже max_pending сегментов,
+    поэтому в памяти одновременно не больше max_pending вырезок. Каждый сегмент пишется в WAV
+    (если write_wav) и/или сразу в формат доставки рядом с ним (seg_xxx.mp3 / seg_xxx.opus),
+    чтобы export не кодировал его второй раз. Уже существующие файлы не перезаписываются.
+    MP3 кодируется ffmpeg с битрейтом mp3_bitrate (EXPORT_MP3_BITRATE), как раньше в export.
+    """
+
+    def __init__(
+            self,
+            max_workers: int,
+            max_pending: int,
+            delivery_format: Optional[str] = None,
+            write_wav: bool = True,
+            mp3_bitrate: str = "192k",
+            ffmpeg: str = "ffmpeg",
+    ):
+        if delivery_format is not None and delivery_format not in DELIVERY_FORMATS:
+            raise ValueError(f"Неизвестный формат доставки: {delivery_format}")
+        self.delivery_format = delivery_format
+        self.write_wav = write_wav
+        self.mp3_bitrate = mp3_bitrate
+        self.ffmpeg = ffmpeg
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="segment-writer")
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._futures: List[Future] = []
+        self.written = 0
+        self._written_lock = threading.Lock()
+
+    def outputs(self, seg_path: Path) -> List[Path]:
+        paths = [seg_path] if self.write_wav else []
+        if self.delivery_format:
+            paths.append(seg_path.with_suffix(delivery_suffix(self.delivery_format)))
+        return paths
+
+    def is_done(self, seg_path: Path) -> bool:
+        return all(p.exists() for p in self.outputs(seg_path))
+
+    def _write(
+            self,
+            seg_path: Path,
+            read_fn: Callable[[], np.ndarray],
+            sample_rate: int,
+            on_done: Optional[Callable[[], None]],
+    ) -> None:
+        try:
+            samples = np.asarray(read_fn(), dtype=np.float32)
+            if self.write_wav and not seg_path.exists():
+                write_audio_atomic(seg_path, samples, sample_rate, subtype="FLOAT")
+            if self.delivery_format:
+                out_path = seg_path.with_suffix(delivery_suffix(self.delivery_format))
+                if not out_path.exists():
+                    encode_delivery(samples, sample_rate, out_path, self.delivery_format, self.mp3_bitrate, self.ffmpeg)
+            with self._written_lock:
+                self.written += 1
+            if on_done is not None:
+                on_done()
+        finally:
+            self._slots.release()
+
+    def submit(
+            self,
+            seg_path: Path,
+            read_fn: Callable[[], np.ndarray],
+            sample_rate: int,
+            on_done: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """on_done вызывается в потоке пула, когда все файлы сегмента записаны."""
+        self._slots.acquire()
+        try:
+            self._futures.append(self._executor.submit(self._write, seg_path, read_fn, sample_rate, on_done))
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def close(self) -> None:
+        """Дожидается всех сегментов; первая ошибка пробрасывается."""
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._futures.clear()
+
+    def __enter__(self) -> "SegmentWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,487 @@
+import asyncio
+import random
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+import soundfile as sf
+
+from app.pipeline.progress.virtual_segments import read_segment
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SpeechKitError(Exception):
+    def __init__(self, status: int, message: str, retry_after: Optional[str] = None):
+        super().__init__(f"SpeechKit {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+# ---------------- AIMD ----------------
+
+
+class AIMDLimiter:
+    """
+    Лимит одновременных запросов в стиле AIMD:
+    - успешный ответ быстрее целевой задержки — лимит +increase (аддитивный рост);
+    - 429 / 5xx / таймаут или ответ медленнее целевой задержки — лимит ×decrease (мультипликативный спад),
+      не чаще раза в cooldown секунд, чтобы одна волна ошибок не обрушила лимит до минимума.
+    Целевая задержка растёт с длиной аудио: latency_target + latency_per_second * секунд аудио,
+    иначе обычное время распознавания длинного сегмента принималось бы за перегрузку.
+    """
+
+    def __init__(
+            self,
+            initial: int,
+            min_limit: int,
+            max_limit: int,
+            latency_target: float,
+            latency_per_second: float = 0.0,
+            increase: float = 1.0,
+            decrease: float = 0.5,
+            cooldown: float = 0.2,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.latency_per_second = latency_per_second
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def target(self, audio_seconds: float) -> float:
+        return self.latency_target + self.latency_per_second * audio_seconds
+
+    async def release(self, latency: Optional[float], overloaded: bool, audio_seconds: float = 0.0) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded or (latency is not None and latency > self.target(audio_seconds)):
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self._last_decrease = now
+            elif latency is not None:
+                # +increase за «окно» из limit успешных ответов
+                self.limit = min(self.max_limit, self.limit + self.increase / max(self.limit, 1.0))
+            self._cond.notify_all()
+
+
+# ---------------- Метрики ----------------
+
+
+class RequestMetrics:
+    """Задержка, число попыток и итог по каждому запросу + сводка для meta."""
+
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+        self.limits: List[float] = []
+        self.packed_segments = 0
+
+    def add(self, **record) -> None:
+        self.records.append(record)
+
+    def summary(self) -> Dict[str, Any]:
+        latencies = np.array([r["latency"] for r in self.records if r["status"] == "ok"])
+        return {
+            "requests": len(self.records),
+            "ok": int(sum(r["status"] == "ok" for r in self.records)),
+            "failed": int(sum(r["status"] != "ok" for r in self.records)),
+            "retries": int(sum(r["attempts"] - 1 for r in self.records)),
+            "latency_p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "latency_p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+            "concurrency_max": max(self.limits) if self.limits else None,
+            "concurrency_final": self.limits[-1] if self.limits else None,
+            "packed_segments": self.packed_segments,
+        }
+
+
+# ---------------- Клиент ----------------
+
+
+def segment_samples(segment: Dict[str, Any]) -> Tuple[np.ndarray, int]:
+    """Моно float32 отсчёты сегмента; виртуальный сегмент читается из артефакта без записи WAV."""
+    if segment.get("virtual"):
+        return np.asarray(read_segment(segment), dtype=np.float32), int(segment["sample_rate"])
+    samples, sr = sf.read(str(segment["segment_path"]), dtype="float32", always_2d=True)
+    return samples.mean(axis=1), sr
+
+
+def to_lpcm(samples: np.ndarray) -> bytes:
+    return (np.clip(np.asarray(samples, dtype=np.float32), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def segment_lpcm(segment: Dict[str, Any]) -> Tuple[bytes, int]:
+    """16-битный LPCM моно сегмента."""
+    samples, sr = segment_samples(segment)
+    return to_lpcm(samples), sr
+
+
+def split_for_limit(samples: np.ndarray, max_frames: int, sample_rate: int, frame_seconds: float = 0.05) -> List[np.ndarray]:
+    """
+    Режет аудио на части не длиннее max_frames отсчётов. Граница части — самый тихий кадр
+    frame_seconds в последней четверти допустимого окна, чтобы не резать слово посередине.
+    """
+    if len(samples) <= max_frames:
+        return [samples]
+    frame = max(1, int(frame_seconds * sample_rate))
+    parts: List[np.ndarray] = []
+    pos = 0
+    while len(samples) - pos > max_frames:
+        lo, hi = pos + max_frames * 3 // 4, pos + max_frames
+        n = (hi - lo) // frame
+        if n > 0:
+            energy = np.square(samples[lo:lo + n * frame]).reshape(n, frame).sum(axis=1)
+            cut = lo + int(np.argmin(energy)) * frame + frame // 2
+        else:
+            cut = hi
+        parts.append(samples[pos:cut])
+        pos = cut
+    parts.append(samples[pos:])
+    return parts
+
+
+# ---------------- Упаковка коротких сегментов ----------------
+
+Window = Tuple[float, float]  # (начало, конец) сегмента внутри упакованного аудио, сек
+
+
+def pack_groups(interval_segments: List[Dict[str, Any]], short_seconds: float, max_seconds: float, gap_seconds: float) -> List[List[int]]:
+    """
+    Группы индексов подряд идущих коротких сегментов (короче short_seconds), суммарно
+    с паузами не длиннее max_seconds. Длинные сегменты — отдельные группы из одного элемента.
+    """
+    groups: List[List[int]] = []
+    current: List[int] = []
+    total = 0.0
+    for idx, segment in enumerate(interval_segments):
+        duration = float(segment["end"]) - float(segment["start"])
+        if duration >= short_seconds:
+            if current:
+                groups.append(current)
+                current, total = [], 0.0
+            groups.append([idx])
+            continue
+        added = duration + (gap_seconds if current else 0.0)
+        if current and total + added > max_seconds:
+            groups.append(current)
+            current, total, added = [], 0.0, duration
+        current.append(idx)
+        total += added
+    if current:
+        groups.append(current)
+    return groups
+
+
+def pack_audio(segments: List[Dict[str, Any]], gap_seconds: float) -> Tuple[np.ndarray, int, List[Window]]:
+    """Склейка сегментов через тишину gap_seconds; окна сегментов в секундах упакованного аудио."""
+    parts: List[np.ndarray] = []
+    windows: List[Window] = []
+    sample_rate = None
+    position = 0
+    for segment in segments:
+        samples, sr = segment_samples(segment)
+        if sample_rate is None:
+            sample_rate = sr
+        elif sr != sample_rate:
+            raise ValueError("Сегменты группы с разной частотой дискретизации")
+        if parts:
+            gap = np.zeros(int(gap_seconds * sr), dtype=np.float32)
+            parts.append(gap)
+            position += len(gap)
+        windows.append((position / sr, (position + len(samples)) / sr))
+        parts.append(samples)
+        position += len(samples)
+    return np.concatenate(parts), sample_rate, windows
+
+
+def _seconds(value: Any) -> float:
+    return float(str(value).rstrip("s"))
+
+
+def parse_words(response: Dict[str, Any]) -> Optional[List[Tuple[str, float, float]]]:
+    """Слова с таймкодами ({"word", "startTime", "endTime"}, время числом или "1.200s"); None, если их нет."""
+    words = response.get("words")
+    if words is None:
+        return None
+    return [(w["word"], _seconds(w["startTime"]), _seconds(w["endTime"])) for w in words]
+
+
+def split_words(words: List[Tuple[str, float, float]], windows: List[Window]) -> List[str]:
+    """Раскладывает слова по окнам сегментов: по середине слова, вне окон — к ближайшему окну."""
+    texts: List[List[str]] = [[] for _ in windows]
+    for word, start, end in words:
+        mid = (start + end) / 2
+        distances = [0.0 if a <= mid <= b else min(abs(mid - a), abs(mid - b)) for a, b in windows]
+        texts[int(np.argmin(distances))].append(word)
+    return [" ".join(t) for t in texts]
+
+
+class SpeechKitDispatcher:
+    """
+    Распознавание сегментов через REST SpeechKit (синхронное распознавание коротких аудио)
+    с адаптивным лимитом параллельности, повторами с джиттером и дедлайном на запрос.
+
+    Синхронный API принимает не больше sync_max_seconds аудио и sync_max_bytes тела запроса
+    (30 с / 1 МБ), больше — 400. Сегмент длиннее лимита заранее режется по паузам на части,
+    которые распознаются отдельно, а текст склеивается.
+    """
+
+    def __init__(
+            self,
+            url: str,
+            api_key: str,
+            limiter: AIMDLimiter,
+            *,
+            folder_id: str = "",
+            pack_max_seconds: float = 0.0,
+            pack_short_seconds: float = 3.0,
+            pack_gap_seconds: float = 0.3,
+            sync_max_seconds: float = 29.0,
+            sync_max_bytes: int = 1_000_000,
+            max_retries: int = 5,
+            deadline: float = 60.0,
+            backoff_base: float = 0.5,
+            backoff_max: float = 10.0,
+    ):
+        self.url = url
+        self.api_key = api_key
+        self.folder_id = folder_id
+        self.pack_max_seconds = min(pack_max_seconds, sync_max_seconds)
+        self.sync_max_seconds = sync_max_seconds
+        self.sync_max_bytes = sync_max_bytes
+        self.pack_short_seconds = pack_short_seconds
+        self.pack_gap_seconds = pack_gap_seconds
+        self.packing = self.pack_max_seconds > 0
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.metrics = RequestMetrics()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        # full jitter: равномерно в [0, min(max, base * 2^attempt)]
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            try:
+                # Retry-After — нижняя граница; джиттер сверху, чтобы повторы не шли одной волной
+                return float(retry_after) + delay
+            except ValueError:
+                pass
+        return delay
+
+    async def _post(self, session: aiohttp.ClientSession, audio: bytes, params: Dict[str, str], timeout: float) -> Dict[str, Any]:
+        headers = {"Authorization": f"Api-Key {self.api_key}"} if self.api_key else {}
+        async with session.post(
+                self.url, params=params, data=audio, headers=headers,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as resp:
+            if resp.status != 200:
+                raise SpeechKitError(resp.status, await resp.text(), resp.headers.get("Retry-After"))
+            return await resp.json()
+
+    def max_frames(self, sample_rate: int) -> int:
+        """Отсчётов 16-битного LPCM в одном синхронном запросе (меньший из лимитов по длине и по байтам)."""
+        return min(int(self.sync_max_seconds * sample_rate), self.sync_max_bytes // 2)
+
+    async def recognize(self, session: aiohttp.ClientSession, audio: bytes, params: Dict[str, str], tag: Any = None) -> Dict[str, Any]:
+        """Ответ сервиса целиком ({"result": текст, ...})."""
+        deadline = time.monotonic() + self.deadline
+        audio_seconds = len(audio) / 2 / int(params["sampleRateHertz"])
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.limiter.acquire()
+            started = time.monotonic()
+            remaining = deadline - started
+            if remaining <= 0:
+                # дедлайн истёк в ожидании слота — запрос не отправляем
+                await self.limiter.release(None, overloaded=False)
+                self.metrics.add(tag=tag, status="error:deadline", latency=0.0, attempts=attempt)
+                raise asyncio.TimeoutError(f"дедлайн {self.deadline} с истёк до отправки запроса")
+            try:
+                response = await self._post(session, audio, params, remaining)
+            except (SpeechKitError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = getattr(e, "status", None)
+                retryable = not isinstance(e, SpeechKitError) or status in RETRY_STATUSES
+                await self.limiter.release(None, overloaded=retryable)
+                self.metrics.limits.append(self.limiter.limit)
+                delay = self._backoff(attempt, getattr(e, "retry_after", None))
+                if not retryable or attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                    self.metrics.add(tag=tag, status=f"error:{status or type(e).__name__}",
+                                     latency=time.monotonic() - started, attempts=attempt)
+                    raise
+                await asyncio.sleep(delay)
+                continue
+
+            latency = time.monotonic() - started
+            await self.limiter.release(latency, overloaded=False, audio_seconds=audio_seconds)
+            self.metrics.limits.append(self.limiter.limit)
+            self.metrics.add(tag=tag, status="ok", latency=latency, attempts=attempt)
+            return response
+
+    def _params(self, sample_rate: int, language_code: str, model: str) -> Dict[str, str]:
+        params = {"lang": language_code, "topic": model, "format": "lpcm", "sampleRateHertz": str(sample_rate)}
+        if self.folder_id:
+            params["folderId"] = self.folder_id
+        return params
+
+    async def recognize_segment(
+            self,
+            session: aiohttp.ClientSession,
+            idx: int,
+            segment: Dict[str, Any],
+            language_code: str,
+            model: str,
+    ) -> str:
+        """Текст одного сегмента; пустая строка, если распознать не удалось."""
+        samples, sr = await asyncio.to_thread(segment_samples, segment)
+        parts = split_for_limit(samples, self.max_frames(sr), sr)
+        if len(parts) > 1:
+            print(f"[SPEECHKIT] interval {idx:04d}: {len(samples) / sr:.1f} с больше лимита синхронного "
+                  f"распознавания, отправляем {len(parts)} частями")
+        params = self._params(sr, language_code, model)
+        try:
+            responses = await asyncio.gather(*(
+                self.recognize(session, to_lpcm(part), params, tag=idx) for part in parts
+            ))
+            return " ".join(r.get("result", "").strip() for r in responses).strip()
+        except Exception as e:
+            print(f"[SPEECHKIT] interval {idx:04d}: {e}")
+            return ""
+
+    async def transcribe_stream(
+            self,
+            source: "asyncio.Queue[Optional[Tuple[int, Dict[str, Any]]]]",
+            on_result: Callable[[int, Dict[str, Any], str], None],
+            *,
+            language_code: str = "ru-RU",
+            model: str = "general",
+    ) -> None:
+        """
+        Потребитель очереди (позиция, сегмент): каждый сегмент уходит в распознавание сразу,
+        как только появился, результат отдаётся в on_result(позиция, сегмент, текст).
+        None в очереди — конец потока. Упаковка коротких сегментов здесь не применяется.
+        """
+        pending = asyncio.Semaphore(2 * self.limiter.max_limit)
+
+        async def one(session: aiohttp.ClientSession, idx: int, segment: Dict[str, Any]) -> None:
+            try:
+                on_result(idx, segment, await self.recognize_segment(session, idx, segment, language_code, model))
+            finally:
+                pending.release()
+
+        tasks = []
+        async with aiohttp.ClientSession() as session:
+            while True:
+                item = await source.get()
+                if item is None:
+                    break
+                await pending.acquire()
+                tasks.append(asyncio.create_task(one(session, *item)))
+            await asyncio.gather(*tasks)
+
+    async def transcribe_segments(
+            self,
+            interval_segments: List[Dict[str, Any]],
+            *,
+            language_code: str = "ru-RU",
+            model: str = "general",
+            not_recognized_text: str = "Распознать текст не удалось",
+            on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Возвращает (intervals_with_text, intervals_with_text_all) в формате transcribe_with_yandex_async:
+        сегмент + file_name + transcription; в первом списке только распознанные.
+        on_result(индекс, элемент) вызывается по готовности каждого сегмента (для контрольных точек).
+
+        При pack_max_seconds > 0 подряд идущие короткие сегменты уходят одним запросом (через паузы
+        pack_gap_seconds), а текст раскладывается обратно по таймкодам слов. Если сервис не вернул
+        таймкоды, группа и все следующие отправляются по одному сегменту. Синхронный v1 REST
+        таймкодов не возвращает — упаковка работает только против speechkit_mock --word-timestamps.
+        """
+        # аудио в памяти держим только для сегментов, которые вот-вот уйдут в запрос
+        pending = asyncio.Semaphore(2 * self.limiter.max_limit)
+        texts: List[str] = [""] * len(interval_segments)
+        # первая упакованная группа — проба: остальные ждут её, чтобы при отсутствии
+        # таймкодов не отправлять впустую несколько упакованных запросов параллельно
+        probe = {"started": False, "done": asyncio.Event()}
+
+        def item(idx: int) -> Dict[str, Any]:
+            segment = interval_segments[idx]
+            return dict(segment, file_name=str(Path(segment["segment_path"])), transcription=texts[idx] or not_recognized_text)
+
+        def finished(idx: int, text: str) -> None:
+            texts[idx] = text
+            if on_result is not None:
+                on_result(idx, item(idx))
+
+        async def one(session: aiohttp.ClientSession, idx: int) -> None:
+            async with pending:
+                text = await self.recognize_segment(session, idx, interval_segments[idx], language_code, model)
+            finished(idx, text)
+
+        async def packed(session: aiohttp.ClientSession, group: List[int]) -> None:
+            is_probe = not probe["started"]
+            probe["started"] = True
+            if not is_probe:
+                await probe["done"].wait()
+            try:
+                await recognize_group(session, group)
+            finally:
+                if is_probe:
+                    probe["done"].set()
+
+        async def recognize_group(session: aiohttp.ClientSession, group: List[int]) -> None:
+            words = None
+            if self.packing:
+                async with pending:
+                    samples, sr, windows = await asyncio.to_thread(
+                        pack_audio, [interval_segments[i] for i in group], self.pack_gap_seconds
+                    )
+                    try:
+                        if len(samples) > self.max_frames(sr):
+                            raise ValueError("упакованное аудио больше лимита запроса, сегменты — по одному")
+                        response = await self.recognize(
+                            session, to_lpcm(samples), self._params(sr, language_code, model), tag=group
+                        )
+                        words = parse_words(response)
+                        if words is None:
+                            print("[SPEECHKIT] сервис не вернул таймкоды слов — упаковка отключена")
+                            self.packing = False
+                    except Exception as e:
+                        print(f"[SPEECHKIT] intervals {group[0]:04d}-{group[-1]:04d}: {e}")
+            if words is None:
+                await asyncio.gather(*(one(session, i) for i in group))
+                return
+            for idx, text in zip(group, split_words(words, windows)):
+                finished(idx, text.strip())
+            self.metrics.packed_segments += len(group)
+
+        if self.packing:
+            groups = pack_groups(interval_segments, self.pack_short_seconds, self.pack_max_seconds, self.pack_gap_seconds)
+        else:
+            groups = [[i] for i in range(len(interval_segments))]
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(
+                one(session, g[0]) if len(g) == 1 else packed(session, g) for g in groups
+            ))
+
+        summary = self.metrics.summary()
+        print(f"[SPEECHKIT] запросов {summary['requests']}, ошибок {summary['failed']}, повторов {summary['retries']}, "
+              f"упаковано сегментов {summary['packed_segments']}, "
+              f"p50 {summary['latency_p50']}, p95 {summary['latency_p95']}, лимит {summary['concurrency_final']}")
+        results = [item(idx) for idx in range(len(interval_segments))]
+        return [item for item, text in zip(results, texts) if text], results
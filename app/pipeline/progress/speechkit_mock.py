@@ -0,0 +1,89 @@
+"""
+Локальная заглушка REST SpeechKit для офлайн-проверки пропускной способности и backoff.
+
+    python -m app.pipeline.progress.speechkit_mock --port 8089 --capacity 8 --error-rate 0.05
+
+и SPEECHKIT_URL=http://localhost:8089/speech/v1/stt:recognize для воркера.
+Сервер отвечает 429, если одновременных запросов больше capacity, случайными 5xx с вероятностью
+error_rate, а время ответа растёт с длиной аудио и с загрузкой (как у перегруженного сервиса).
+Аудио длиннее 30 с или тело больше 1 МБ отклоняется с 400, как синхронным API.
+С --word-timestamps в ответ добавляются слова с таймкодами (по одному на каждый непрерывный
+участок ненулевого сигнала) — для проверки упаковки коротких сегментов.
+"""
+import argparse
+import asyncio
+import random
+
+import numpy as np
+from aiohttp import web
+
+MAX_SECONDS = 30.0
+MAX_BYTES = 1024 * 1024
+
+
+def fake_words(audio: bytes, sample_rate: int):
+    """Слово на каждый участок без цифровой тишины: текст — время начала участка."""
+    voiced = np.frombuffer(audio, dtype="<i2") != 0
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]])))
+    return [
+        {"word": f"слово{start / sample_rate:.2f}", "startTime": f"{start / sample_rate:.3f}s", "endTime": f"{end / sample_rate:.3f}s"}
+        for start, end in zip(edges[::2], edges[1::2])
+    ]
+
+
+def create_app(
+        capacity: int = 8,
+        error_rate: float = 0.0,
+        base_latency: float = 0.05,
+        realtime_factor: float = 0.05,
+        word_timestamps: bool = False,
+) -> web.Application:
+    state = {"in_flight": 0, "requests": 0, "throttled": 0, "errors": 0}
+
+    async def recognize(request: web.Request) -> web.Response:
+        state["requests"] += 1
+        if state["in_flight"] >= capacity:
+            state["throttled"] += 1
+            return web.json_response({"error_code": "RESOURCE_EXHAUSTED"}, status=429, headers={"Retry-After": "0.2"})
+        if random.random() < error_rate:
+            state["errors"] += 1
+            return web.json_response({"error_code": "INTERNAL"}, status=503)
+
+        state["in_flight"] += 1
+        try:
+            audio = await request.read()
+            sample_rate = int(request.query.get("sampleRateHertz", 8000))
+            seconds = len(audio) / 2 / sample_rate
+            if seconds > MAX_SECONDS or len(audio) > MAX_BYTES:
+                return web.json_response({"error_code": "BAD_REQUEST", "error_message": "audio is too long"}, status=400)
+            load = state["in_flight"] / capacity
+            await asyncio.sleep((base_latency + seconds * realtime_factor) * (1 + load))
+            if not word_timestamps:
+                return web.json_response({"result": f"тестовый текст {seconds:.2f} с"})
+            words = fake_words(audio, sample_rate)
+            return web.json_response({"result": " ".join(w["word"] for w in words), "words": words})
+        finally:
+            state["in_flight"] -= 1
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(state)
+
+    app = web.Application(client_max_size=8 * 1024 * 1024)
+    app.router.add_post("/speech/v1/stt:recognize", recognize)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock SpeechKit STT")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--base-latency", type=float, default=0.05)
+    parser.add_argument("--realtime-factor", type=float, default=0.05)
+    parser.add_argument("--word-timestamps", action="store_true")
+    args = parser.parse_args()
+    web.run_app(
+        create_app(args.capacity, args.error_rate, args.base_latency, args.realtime_factor, args.word_timestamps),
+        port=args.port,
+    )
@@ -0,0 +1,46 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from app.pipeline.disk_cache import DiskLRUCache
+from app.pipeline.progress.speechkit_client import segment_lpcm
+
+
+class TranscriptionCache:
+    """
+    Дисковый кэш распознанного текста сегментов.
+
+    Ключ — sha256 PCM-отсчётов сегмента + движок + модель + язык, поэтому побайтно
+    одинаковая вырезка не отправляется в распознавание повторно (force=True, повтор
+    после правки диаризации, другая операция с тем же аудио). Размер ограничен LRU-вытеснением.
+    """
+
+    def __init__(self, root, max_bytes: int, engine: str, model: str, language_code: str):
+        self.cache = DiskLRUCache(root, max_bytes)
+        self.scope = f"{engine}|{model}|{language_code}"
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, segment: Dict[str, Any]) -> str:
+        pcm, sample_rate = segment_lpcm(segment)
+        pcm_sha = hashlib.sha256(pcm).hexdigest()
+        return hashlib.sha256(f"{pcm_sha}|{sample_rate}|{self.scope}".encode()).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.cache.path(key, ".json")
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.cache.touch(key)
+        self.hits += 1
+        return entry["transcription"]
+
+    def put(self, key: str, transcription: str) -> None:
+        self.cache.write_bytes(key, ".json", json.dumps(
+            {"transcription": transcription}, ensure_ascii=False
+        ).encode("utf-8"))
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
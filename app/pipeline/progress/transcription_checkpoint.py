@@ -0,0 +1,87 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+class TranscriptionCheckpoint:
+    """
+    Журнал распознанных сегментов: JSONL только на дописывание, fsync после каждой строки.
+
+    Первая строка — {"scope": ...} (хэш списка сегментов и параметров распознавания); журнал
+    с другим scope считается чужим и начинается заново. Каждая следующая строка —
+    {"position": индекс сегмента, "item": результат}. Оборванная при падении последняя строка
+    пропускается, поэтому перезапущенная задача продолжает с первого незавершённого сегмента.
+    Пишутся только распознанные сегменты: неудачные при продолжении отправляются заново.
+
+    Запись и fsync идут в отдельном потоке (по порядку вызовов append): append вызывается из
+    event loop диспетчера и не должен ждать диск. close() дожидается всех строк.
+    """
+
+    def __init__(self, path: Path, scope: str):
+        self.path = Path(path)
+        self.scope = scope
+        self._file = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._error: Optional[BaseException] = None
+
+    def load(self) -> Dict[int, Dict[str, Any]]:
+        done: Dict[int, Dict[str, Any]] = {}
+        if not self.path.exists():
+            return done
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        try:
+            if json.loads(lines[0]).get("scope") != self.scope:
+                print(f"[CHECKPOINT] {self.path.name}: другой набор сегментов, начинаем заново")
+                return done
+        except (ValueError, AttributeError):
+            return done
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # пустой хвост или строка, оборванная при падении
+            done[int(record["position"])] = record["item"]
+        if done:
+            print(f"[CHECKPOINT] {self.path.name}: продолжаем, уже готово {len(done)} сегментов")
+        return done
+
+    def open(self, done: Dict[int, Dict[str, Any]]) -> None:
+        """Переписывает журнал начисто (scope + уже готовые записи) и открывает на дописывание."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"scope": self.scope}) + "\n")
+            for position in sorted(done):
+                f.write(json.dumps({"position": position, "item": done[position]}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path.replace(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+
+    def _write_line(self, line: str) -> None:
+        try:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except BaseException as e:
+            self._error = self._error or e
+
+    def append(self, position: int, item: Dict[str, Any]) -> None:
+        line = json.dumps({"position": position, "item": item}, ensure_ascii=False) + "\n"
+        self._writer.submit(self._write_line, line)
+
+    def close(self, remove: bool = False) -> None:
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if remove:
+            self.path.unlink(missing_ok=True)
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import soundfile as sf
+
+from app.pipeline.audio_cache import open_artifact
+from app.pipeline.config import SEGMENTS_VIRTUAL_MAX_OPEN
+
+# Виртуальный сегмент — запись манифеста prepare_audio_segments:
+# {"source": <путь к аудио-артефакту>, "offset": <отсчёт>, "length": <отсчётов>,
+#  "sample_rate": ..., "speaker_label": ..., "segment_path": <куда материализовать>, "virtual": True}
+
+# LRU открытых артефактов: воркер живёт долго, а операций много — без вытеснения дескрипторы копятся.
+# Вытесненный memmap закрывается, когда на него не останется ссылок (срезы держат его открытым).
+_opened: "OrderedDict[str, np.memmap]" = OrderedDict()
+_opened_lock = threading.Lock()
+
+
+def _artifact(source: str) -> np.memmap:
+    with _opened_lock:
+        audio = _opened.get(source)
+        if audio is None:
+            audio = _opened[source] = open_artifact(Path(source))
+            while len(_opened) > SEGMENTS_VIRTUAL_MAX_OPEN:
+                _opened.popitem(last=False)
+        else:
+            _opened.move_to_end(source)
+        return audio
+
+
+def read_segment(segment: Dict[str, Any]) -> np.ndarray:
+    """Отсчёты сегмента — срез memmap артефакта, без копирования и без записи на диск."""
+    offset, length = int(segment["offset"]), int(segment["length"])
+    return _artifact(segment["source"])[offset:offset + length]
+
+
+def iter_segment_blocks(segment: Dict[str, Any], block_frames: int = 1 << 14) -> Iterator[np.ndarray]:
+    """Потоковое чтение сегмента блоками (для отправки по сети без загрузки целиком)."""
+    samples = read_segment(segment)
+    for i in range(0, len(samples), block_frames):
+        yield samples[i:i + block_frames]
+
+
+def ensure_segment_file(segment: Dict[str, Any]) -> Path:
+    """
+    Материализует сегмент в WAV по segment_path, только если потребителю нужен настоящий файл.
+    Повторный вызов ничего не пишет.
+    """
+    seg_path = Path(segment["segment_path"])
+    if not seg_path.exists():
+        tmp_path = seg_path.with_name(seg_path.name + ".tmp.wav")
+        sf.write(str(tmp_path), read_segment(segment), int(segment["sample_rate"]), subtype="FLOAT")
+        tmp_path.rename(seg_path)
+    return seg_path
+
+
+def materialize_segments(interval_segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Гарантирует наличие файлов для всех виртуальных сегментов списка."""
+    for segment in interval_segments:
+        if segment.get("virtual"):
+            ensure_segment_file(segment)
+    return interval_segments
@@ -0,0 +1,210 @@
+import hashlib
+import io
+import json
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from app.pipeline.audio_cache import source_fingerprint
+from app.pipeline.disk_cache import DiskLRUCache
+
+BLOCK_FRAMES = 1 << 16
+HEAD_FRAMES = BLOCK_FRAMES  # по хэшу начала файла ищутся записи, продолжением которых он может быть
+MAX_PREFIX_CANDIDATES = 8
+
+BuildFn = Callable[[List[Path]], Dict[Any, np.ndarray]]
+KeyFn = Callable[[Path], Any]  # ключ, под которым build_fn возвращает отпечаток файла
+
+
+def pcm_hashes(path: Path, checkpoints: Iterable[int] = ()) -> Tuple[str, Dict[int, str]]:
+    """
+    sha256 от PCM-отсчётов файла за один проход: (хэш всего файла, {n: хэш первых n кадров}).
+    Заголовок WAV не учитывается, поэтому дописанный файл совпадает по префиксу.
+    Точки checkpoints длиннее файла в ответ не попадают.
+    """
+    h = hashlib.sha256()
+    marks = sorted(set(checkpoints))
+    prefixes: Dict[int, str] = {}
+    done = 0
+    with sf.SoundFile(str(path)) as f:
+        h.update(f"{f.samplerate}:{f.channels}".encode())
+        while True:
+            while marks and marks[0] <= done:
+                if marks[0] == done:
+                    prefixes[done] = h.copy().hexdigest()
+                marks.pop(0)
+            block = f.read(BLOCK_FRAMES if not marks else min(BLOCK_FRAMES, marks[0] - done), dtype="int16")
+            if block.shape[0] == 0:
+                break
+            h.update(block.tobytes())
+            done += block.shape[0]
+    return h.hexdigest(), prefixes
+
+
+def pcm_hash(path: Path, num_frames: Optional[int] = None) -> str:
+    """sha256 от PCM-отсчётов файла (первых num_frames, по умолчанию всех)."""
+    full, prefixes = pcm_hashes(path, () if num_frames is None else (num_frames,))
+    return full if num_frames is None else prefixes.get(num_frames, full)
+
+
+class VoiceprintStore:
+    """
+    Дисковый кэш голосовых отпечатков микрофонных файлов.
+
+    Ключ записи — хэш PCM-содержимого файла + версия модели эмбеддингов + параметры выборки:
+    тот же звук, загруженный заново (другой путь или mtime), попадает в кэш без вызова модели.
+    Рядом лежат два небольших индекса в том же LRU-каталоге:
+    - <fingerprint>.ref — идентичность файла (путь, размер, mtime) -> хэш содержимого,
+      чтобы неизменённый файл не приходилось читать;
+    - <хэш начала>.head — записи, начинающиеся с тех же HEAD_FRAMES кадров: кандидаты,
+      продолжением которых может быть дописанный файл (тогда считается только хвост).
+    """
+
+    def __init__(self, root: Path, max_bytes: int, model_version: str, params: Dict[str, Any]):
+        self.cache = DiskLRUCache(root, max_bytes)
+        self.model_version = model_version
+        self.params_json = json.dumps(params, sort_keys=True)
+
+    def key(self, content_hash: str) -> str:
+        return hashlib.sha256(f"{content_hash}|{self.model_version}|{self.params_json}".encode()).hexdigest()[:32]
+
+    @staticmethod
+    def _index_key(kind: str, value: str) -> str:
+        return hashlib.sha256(f"{kind}|{value}".encode()).hexdigest()[:32]
+
+    def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        key = self.key(content_hash)
+        meta_path, vec_path = self.cache.path(key, ".json"), self.cache.path(key, ".npy")
+        if not (meta_path.exists() and vec_path.exists()):
+            return None
+        self.cache.touch(key)
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        meta["vector"] = np.load(vec_path)
+        return meta
+
+    def put(self, content_hash: str, vector: np.ndarray, meta: Dict[str, Any]) -> None:
+        key = self.key(content_hash)
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(vector))
+        self.cache.write_bytes(key, ".npy", buffer.getvalue())
+        self.cache.write_bytes(key, ".json", json.dumps(
+            dict(meta, content_hash=content_hash, model_version=self.model_version), ensure_ascii=False
+        ).encode("utf-8"))
+
+    # ---------------- Indexes ----------------
+    def content_hash_for(self, fingerprint: str) -> Optional[str]:
+        """Хэш содержимого, уже посчитанный для этой идентичности файла."""
+        key = self._index_key("fingerprint", fingerprint)
+        try:
+            content_hash = self.cache.path(key, ".ref").read_text(encoding="utf-8").strip()
+        except OSError:
+            return None
+        self.cache.touch(key)
+        return content_hash or None
+
+    def remember(self, fingerprint: str, content_hash: str) -> None:
+        self.cache.write_bytes(self._index_key("fingerprint", fingerprint), ".ref", content_hash.encode("utf-8"))
+
+    def prefix_candidates(self, head_hash: str) -> List[Dict[str, Any]]:
+        """Записи с тем же началом файла: [{"num_frames", "content_hash"}], самые длинные первыми."""
+        key = self._index_key("head", head_hash)
+        try:
+            candidates = json.loads(self.cache.path(key, ".head").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return []
+        self.cache.touch(key)
+        return sorted(candidates, key=lambda c: c["num_frames"], reverse=True)
+
+    def add_prefix_candidate(self, head_hash: str, num_frames: int, content_hash: str) -> None:
+        candidates = [c for c in self.prefix_candidates(head_hash) if c["content_hash"] != content_hash]
+        candidates.insert(0, {"num_frames": num_frames, "content_hash": content_hash})
+        self.cache.write_bytes(
+            self._index_key("head", head_hash), ".head", json.dumps(candidates[:MAX_PREFIX_CANDIDATES]).encode("utf-8")
+        )
+
+
+def _write_tail(path: Path, start_frame: int, tmp_dir: Path) -> Path:
+    """Кадры [start_frame:] файла во временный WAV с тем же именем (ключ build_fn тот же)."""
+    data, sr = sf.read(str(path), start=start_frame, dtype="float32", always_2d=True)
+    tail_path = Path(tmp_dir) / path.name
+    sf.write(str(tail_path), data, sr)
+    return tail_path
+
+
+def cached_file_voiceprints(
+        wav_files: List[Path],
+        build_fn: BuildFn,
+        store: VoiceprintStore,
+        key_fn: KeyFn,
+) -> Dict[Any, np.ndarray]:
+    """
+    То же, что build_fn(wav_files), но через VoiceprintStore:
+    - файл не менялся (путь, размер, mtime) — хэш содержимого берётся из индекса, файл не читается;
+    - то же содержимое уже встречалось (в том числе под другим путём или mtime) — модель не вызывается;
+    - файл — продолжение сохранённой записи — эмбеддинг считается по хвосту и усредняется
+      с сохранённым по длительности;
+    - иначе — эмбеддинг файла целиком.
+    Все промахи и хвосты считаются одним вызовом build_fn; key_fn(path) — ключ файла в его ответе.
+    """
+    result: Dict[Any, np.ndarray] = {}
+    hits = 0
+    misses: List[Tuple[Path, str, str, Any]] = []  # (путь, хэш содержимого, хэш начала, запись префикса или None)
+    for path in map(Path, wav_files):
+        fingerprint = source_fingerprint(path)
+        content_hash = store.content_hash_for(fingerprint)
+        entry = None if content_hash is None else store.get(content_hash)
+        head_hash, prefix = "", None
+        if entry is None:
+            num_frames = sf.info(str(path)).frames
+            head_hash = pcm_hash(path, HEAD_FRAMES)
+            candidates = [c for c in store.prefix_candidates(head_hash) if c["num_frames"] < num_frames]
+            content_hash, prefix_hashes = pcm_hashes(path, [c["num_frames"] for c in candidates])
+            store.remember(fingerprint, content_hash)
+            entry = store.get(content_hash)
+            if entry is None:
+                for candidate in candidates:
+                    if prefix_hashes.get(candidate["num_frames"]) == candidate["content_hash"]:
+                        prefix = store.get(candidate["content_hash"])
+                        if prefix is not None:
+                            break
+        if entry is not None:
+            hits += 1
+            result[key_fn(path)] = entry["vector"]
+        else:
+            misses.append((path, content_hash, head_hash, prefix))
+
+    if misses:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inputs = []
+            for path, _, _, prefix in misses:
+                if prefix is None:
+                    inputs.append(path)
+                else:
+                    print(f"[VOICEPRINTS] {path.name}: дописан, считаем эмбеддинг только по новым кадрам")
+                    inputs.append(_write_tail(path, prefix["num_frames"], Path(tmp_dir)))
+            vectors = build_fn(inputs)
+
+        for path, content_hash, head_hash, prefix in misses:
+            key = key_fn(path)
+            if key not in vectors:
+                raise KeyError(f"build_fn не вернул отпечаток для {path.name} (ключ {key!r})")
+            vector = np.asarray(vectors[key])
+            info = sf.info(str(path))
+            if prefix is not None:
+                w_old, w_new = prefix["num_frames"], info.frames - prefix["num_frames"]
+                vector = (prefix["vector"] * w_old + vector * w_new) / (w_old + w_new)
+            result[key] = vector
+            store.put(content_hash, vector, {
+                "source": str(path.resolve()),
+                "num_frames": info.frames,
+                "sample_rate": info.samplerate,
+            })
+            if info.frames >= HEAD_FRAMES:
+                store.add_prefix_candidate(head_hash, info.frames, content_hash)
+
+    store.cache.evict()
+    print(f"[VOICEPRINTS] из кэша {hits}/{len(wav_files)} файлов")
+    return result
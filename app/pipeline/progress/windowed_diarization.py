@@ -0,0 +1,185 @@
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+from pyannote.core import Annotation, Segment
+from scipy.optimize import linear_sum_assignment
+
+TARGET_SR = 16000
+
+DiarizeFn = Callable[[torch.Tensor, int], Tuple[Annotation, Optional[np.ndarray]]]
+
+
+class MissingSpeakerEmbeddings(RuntimeError):
+    """Pipeline не отдаёт эмбеддинги спикеров — сшить окна между собой нечем."""
+
+
+def run_diarization(pipeline, waveform: torch.Tensor, sample_rate: int, **kwargs) -> Tuple[Annotation, Optional[np.ndarray]]:
+    """
+    Один вызов pyannote. Возвращает разметку и эмбеддинги спикеров
+    (строка i соответствует ann.labels()[i]) или None, если pipeline их не отдаёт.
+    """
+    device = getattr(pipeline, "device", torch.device("cpu"))
+    with torch.inference_mode():
+        out = pipeline({"waveform": waveform.to(device), "sample_rate": sample_rate}, **kwargs)
+
+    # pyannote может вернуть либо speaker_diarization, либо annotation
+    ann = getattr(out, "speaker_diarization", getattr(out, "annotation", out))
+    embeddings = getattr(out, "speaker_embeddings", None)
+    return ann, embeddings
+
+
+def iter_windows(duration: float, window: float, overlap: float) -> Iterator[Tuple[float, float]]:
+    """Перекрывающиеся окна [start, end) длиной window с шагом window - overlap."""
+    step = window - overlap
+    if step <= 0:
+        raise ValueError(f"Перекрытие окон ({overlap}) должно быть меньше длины окна ({window})")
+    start = 0.0
+    while True:
+        end = min(start + window, duration)
+        yield start, end
+        if end >= duration:
+            return
+        start += step
+
+
+def read_window(path: Path, start: float, end: float, target_sr: int = TARGET_SR) -> torch.Tensor:
+    """Читает только нужный диапазон файла -> mono -> target_sr, форма (1, n)."""
+    with sf.SoundFile(str(path)) as f:
+        sr = f.samplerate
+        f.seek(int(start * sr))
+        data = f.read(int(round((end - start) * sr)), dtype="float32", always_2d=True)
+    waveform = torch.from_numpy(data.mean(axis=1)).unsqueeze(0)
+    if sr != target_sr:
+        waveform = torchaudio.functional.resample(waveform, sr, target_sr)
+    return waveform
+
+
+class SpeakerLinker:
+    """
+    Связывает локальные метки спикеров отдельных окон с глобальными спикерами
+    по косинусной близости эмбеддингов (венгерский алгоритм внутри окна).
+    Глобальный эмбеддинг — среднее по окнам, взвешенное длительностью речи.
+    """
+
+    def __init__(self, max_speakers: int, threshold: float = 0.5):
+        self.max_speakers = max_speakers
+        self.threshold = threshold
+        self.centroids: List[np.ndarray] = []
+        self.weights: List[float] = []
+
+    @staticmethod
+    def _normalize(x: np.ndarray) -> np.ndarray:
+        return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-8)
+
+    def _add(self, vector: Optional[np.ndarray], weight: float) -> int:
+        self.centroids.append(vector if vector is not None else np.zeros(0))
+        self.weights.append(weight if vector is not None else 0.0)
+        return len(self.centroids) - 1
+
+    def _update(self, idx: int, vector: np.ndarray, weight: float) -> None:
+        total = self.weights[idx] + weight
+        if total > 0:
+            self.centroids[idx] = (self.centroids[idx] * self.weights[idx] + vector * weight) / total
+            self.weights[idx] = total
+
+    def link(self, embeddings: Dict[str, np.ndarray], durations: Dict[str, float]) -> Dict[str, int]:
+        """Возвращает {локальная метка: индекс глобального спикера}."""
+        valid = [lbl for lbl, vec in embeddings.items() if vec is not None and np.all(np.isfinite(vec)) and np.any(vec)]
+        known = [i for i, w in enumerate(self.weights) if w > 0]
+        mapping: Dict[str, int] = {}
+
+        sim = None
+        if valid and known:
+            vectors = np.stack([embeddings[lbl] for lbl in valid])
+            sim = np.full((len(valid), len(self.centroids)), -1.0)
+            sim[:, known] = self._normalize(vectors) @ self._normalize(np.stack([self.centroids[i] for i in known])).T
+            rows, cols = linear_sum_assignment(-sim)
+            for r, c in zip(rows, cols):
+                if sim[r, c] >= self.threshold:
+                    mapping[valid[r]] = int(c)
+
+        for r, lbl in enumerate(valid):
+            if lbl in mapping:
+                continue
+            if len(self.centroids) < self.max_speakers or sim is None:
+                mapping[lbl] = self._add(None, 0.0)
+            else:
+                # лимит спикеров исчерпан — к ближайшему, даже если он уже занят в этом окне
+                mapping[lbl] = int(np.argmax(sim[r]))
+
+        for lbl in valid:
+            idx = mapping[lbl]
+            if self.weights[idx] == 0:
+                self.centroids[idx] = embeddings[lbl].astype(np.float64)
+                self.weights[idx] = durations.get(lbl, 0.0) or 1e-3
+            else:
+                self._update(idx, embeddings[lbl], durations.get(lbl, 0.0))
+
+        # спикеры без эмбеддинга (слишком короткая речь) — к самому «говорящему» глобальному
+        for lbl in durations:
+            if lbl not in mapping:
+                mapping[lbl] = int(np.argmax(self.weights)) if self.weights else self._add(None, 0.0)
+        return mapping
+
+
+def diarize_windowed(
+        diarize_fn: DiarizeFn,
+        input_audio: Path,
+        max_speakers: int,
+        window_sec: float,
+        overlap_sec: float,
+        threshold: float = 0.5,
+        sample_rate: int = TARGET_SR,
+        audio: Optional[np.ndarray] = None,
+) -> Annotation:
+    """
+    Диаризация длинной записи перекрывающимися окнами.
+
+    Каждое окно диаризуется отдельно (пиковая память ограничена длиной окна),
+    локальные метки связываются между окнами по эмбеддингам, а из каждого окна
+    берётся только его «ядро» — половина перекрытия с каждой стороны отдаётся соседям.
+    На выходе одна Annotation с глобальными метками SPEAKER_XX.
+    Если передан audio (memmap артефакта на sample_rate), окна берутся срезами из него.
+    Без эмбеддингов спикеров от pipeline — MissingSpeakerEmbeddings.
+    """
+    duration = len(audio) / sample_rate if audio is not None else sf.info(str(input_audio)).duration
+    windows = list(iter_windows(duration, window_sec, overlap_sec))
+    half = overlap_sec / 2
+    linker = SpeakerLinker(max_speakers, threshold)
+    result = Annotation(uri=Path(input_audio).stem)
+
+    for i, (w_start, w_end) in enumerate(windows):
+        if audio is not None:
+            waveform = torch.from_numpy(audio[int(w_start * sample_rate):int(w_end * sample_rate)]).unsqueeze(0)
+        else:
+            waveform = read_window(input_audio, w_start, w_end, sample_rate)
+        ann, embeddings = diarize_fn(waveform, sample_rate)
+        del waveform
+
+        labels = ann.labels()
+        if embeddings is None and labels:
+            # без эмбеддингов все метки окон ушли бы в одного глобального спикера
+            raise MissingSpeakerEmbeddings(
+                f"Окно {i + 1}: pipeline не вернул speaker_embeddings, оконная диаризация невозможна"
+            )
+        emb = {lbl: embeddings[k] for k, lbl in enumerate(labels)} if embeddings is not None else {}
+        durations = {lbl: ann.label_duration(lbl) for lbl in labels}
+        mapping = linker.link(emb, durations)
+
+        core_start = w_start + half if i > 0 else w_start
+        core_end = w_end - half if i < len(windows) - 1 else w_end
+        for turn, _, spk in ann.itertracks(yield_label=True):
+            start = max(turn.start + w_start, core_start)
+            end = min(turn.end + w_start, core_end)
+            if end > start:
+                segment = Segment(start, end)
+                result[segment, result.new_track(segment)] = f"SPEAKER_{mapping[spk]:02d}"
+
+        print(f"[DIARIZATION] окно {i + 1}/{len(windows)} ({w_start:.0f}-{w_end:.0f} c): "
+              f"{len(labels)} спикеров, глобально {len(linker.centroids)}")
+
+    return result
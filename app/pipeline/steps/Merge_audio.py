@@ -1,7 +1,13 @@
 from pathlib import Path
-from app.pipeline.progress.Merge_audio import make_one_channel_audio, save_audio
+from app.pipeline.progress.Merge_audio import (
+    make_one_channel_audio,
+    make_one_channel_audio_streaming,
+    prepare_channels_parallel,
+    save_audio,
+)
+from app.pipeline.audio_cache import audio_cache_dir
 from app.pipeline.utils import get_unique_result_path
-from app.pipeline.config import PATH_TO_AUDIO, TMP_PATH
+from app.pipeline.config import PATH_TO_AUDIO, TMP_PATH, MERGE_STREAMING, MERGE_BLOCK_FRAMES, MERGE_MAX_WORKERS
 SAMPLE_RATE = 8000
 
 def run_merge_audio_step(operation_id: str) -> Path:
@@ -21,11 +27,16 @@ def run_merge_audio_step(operation_id: str) -> Path:
         raise FileNotFoundError("Нет входных wav-файлов")
 
 
-    merged = make_one_channel_audio(wav_files, SAMPLE_RATE)
-
     # атомарная запись
     tmp_output = tmp_dir / "Merged_tmp.wav"
-    save_audio(merged, tmp_output, sample_rate=SAMPLE_RATE)
+    if MERGE_STREAMING:
+        channels = prepare_channels_parallel(
+            wav_files, SAMPLE_RATE, audio_cache_dir(tmp_dir), MERGE_MAX_WORKERS
+        )
+        make_one_channel_audio_streaming(channels, tmp_output, SAMPLE_RATE, MERGE_BLOCK_FRAMES)
+    else:
+        merged = make_one_channel_audio(wav_files, SAMPLE_RATE, MERGE_MAX_WORKERS)
+        save_audio(merged, tmp_output, sample_rate=SAMPLE_RATE)
     tmp_output.rename(output_path)
 
     return output_path
\ No newline at end of file
@@ -8,7 +8,7 @@ from uuid import uuid4
 
 from celery.result import AsyncResult
 from fastapi import FastAPI, HTTPException, Body, Path, Query, Depends
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
@@ -18,7 +18,8 @@ from app.pipeline.config import TMP_PATH, PATH_TO_AUDIO
 from app.pipeline.steps.bd import SessionLocal, PipelineOperation, PipelineSegment, Meeting, MeetingMicrophone
 from app.pipeline.steps.pipeline_workflow import run_pipeline_chain
 from app.pipeline.utils import get_unique_result_path
-from app.storage.s3 import generate_presigned_url
+from app.pipeline.progress.segment_pack import parse_pack_ref
+from app.storage.s3 import generate_presigned_url, get_s3_object_range
 
 # ----------------------
 # FastAPI instance
@@ -150,6 +151,19 @@ def format_time(seconds: float) -> str:
     millis = int((seconds - int(seconds)) * 1000)
     return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
 
+def segment_audio_ref(file_name: Optional[str]) -> dict:
+    """
+    Ссылка на аудио сегмента для ответа API. Для сегмента в контейнере — presigned URL контейнера
+    и диапазон байт (клиент делает GET с заголовком Range) — один объект S3 на всю операцию.
+    """
+    if not file_name:
+        return {"file_name": None, "byte_range": None}
+    key, byte_range = parse_pack_ref(file_name)
+    return {
+        "file_name": generate_presigned_url(key, expires_in=3600),
+        "byte_range": f"bytes={byte_range[0]}-{byte_range[1]}" if byte_range else None,
+    }
+
 def parse_filename(filename: str):
     parts = filename.replace(".wav", "").split("_")
     mic_number = int(parts[2])
@@ -379,7 +393,8 @@ def get_segments(
         "total": total,
         "segments": [
             {
-                "file_name": generate_presigned_url(seg.file_name, expires_in=3600) if seg.file_name else None,
+                "id": seg.id,
+                **segment_audio_ref(seg.file_name),
                 "start": format_time(seg.start),
                 "end": format_time(seg.end),
                 "id_speaker": seg.id_speaker,
@@ -390,3 +405,19 @@ def get_segments(
         ],
         "docx_url": presigned_url,
     }
+
+@app.get("/pipeline/segments/{operation_id}/{segment_id}/audio")
+def get_segment_audio(operation_id: str, segment_id: int, session: Session = Depends(get_session)):
+    """Аудио одного сегмента через API: для контейнера читается только его диапазон байт."""
+    seg = session.query(PipelineSegment).filter_by(operation_id=operation_id, id=segment_id).first()
+    if not seg or not seg.file_name:
+        raise HTTPException(status_code=404, detail="Segment not found")
+
+    key, byte_range = parse_pack_ref(seg.file_name)
+    if byte_range is None:
+        raise HTTPException(status_code=400, detail="Segment is not packed, use file_name URL")
+
+    obj = get_s3_object_range(key, *byte_range)
+    # тип задан при загрузке контейнера; по ключу не угадывается (blobs/<sha>.pack)
+    media_type = obj.get("ContentType") or "application/octet-stream"
+    return StreamingResponse(obj["Body"].iter_chunks(), media_type=media_type)
@@ -1,13 +1,31 @@
 from pathlib import Path
+from typing import Optional
 
 import torch
 import torchaudio
 from pyannote.audio import Pipeline
 from pyannote.database.util import load_rttm
-from app.pipeline.global_diarization import get_pipeline
+from app.pipeline.audio_cache import as_tensor, audio_cache_dir, get_audio_artifact
+from app.pipeline.config import (
+    DIARIZATION_WINDOW_SECONDS,
+    DIARIZATION_WINDOW_OVERLAP_SECONDS,
+    DIARIZATION_LINK_THRESHOLD,
+    DIARIZATION_BATCH_WINDOW_SECONDS,
+    DIARIZATION_BATCH_MAX_RECORDINGS,
+    DIARIZATION_BATCH_MAX_ROWS,
+)
+from app.pipeline.model_registry import get_diarization_pipeline
+from app.pipeline.progress.batched_diarization import get_batch_service
+from app.pipeline.progress.windowed_diarization import MissingSpeakerEmbeddings, diarize_windowed, run_diarization
 
 
-def diarization_step(input_audio: Path, speakers_folder: Path, output_dir: Path, pad_end: float = 0.4):
+def diarization_step(
+        input_audio: Path,
+        speakers_folder: Path,
+        output_dir: Path,
+        pad_end: float = 0.4,
+        cache_dir: Optional[Path] = None,
+):
     """
     Диаризация аудио с кэшированием результата.
 
@@ -16,6 +34,7 @@ def diarization_step(input_audio: Path, speakers_folder: Path, output_dir: Path,
         speakers_folder: папка с файлами спикеров для определения max_speakers
         output_dir: директория для RTTM и кэша
         pad_end: дополнительное время в конце каждого сегмента (сек)
+        cache_dir: кэш декодированного аудио (по умолчанию audio_cache рядом с input_audio)
 
     Returns:
         dict: {имя файла: [(start, end+pad_end, spk), ...]}
@@ -33,21 +52,35 @@ def diarization_step(input_audio: Path, speakers_folder: Path, output_dir: Path,
     # --- Рассчёт диаризации ---
     max_speakers = sum(1 for f in Path(speakers_folder).iterdir() if f.suffix.lower() == ".wav")
 
-    waveform, sr = torchaudio.load(input_audio)
-    if waveform.size(0) > 1:
-        waveform = waveform.mean(dim=0, keepdim=True)
-    if sr != 16000:
-        waveform = torchaudio.functional.resample(waveform, sr, 16000)
-        sr = 16000
+    pipeline = get_diarization_pipeline()
+    audio = get_audio_artifact(input_audio, 16000, cache_dir or audio_cache_dir(input_audio.parent))
 
-    pipeline = get_pipeline()
-    device = pipeline.device
+    if DIARIZATION_BATCH_WINDOW_SECONDS:
+        # --- Общий GPU-батч с другими заседаниями, ответ возвращается по operation_id ---
+        service = get_batch_service(
+            pipeline, DIARIZATION_BATCH_WINDOW_SECONDS, DIARIZATION_BATCH_MAX_RECORDINGS, DIARIZATION_BATCH_MAX_ROWS
+        )
+        diarize = lambda w, s, **kw: service.diarize(input_audio.parent.name, w, s, **kw)
+    else:
+        diarize = lambda w, s, **kw: run_diarization(pipeline, w, s, **kw)
 
-    with torch.inference_mode():
-        out = pipeline({"waveform": waveform.to(device), "sample_rate": sr}, num_speakers=max_speakers)
-
-    # pyannote может вернуть либо speaker_diarization, либо annotation
-    ann = getattr(out, "speaker_diarization", getattr(out, "annotation", out))
+    ann = None
+    if DIARIZATION_WINDOW_SECONDS and len(audio) / 16000 > DIARIZATION_WINDOW_SECONDS:
+        # --- Длинная запись: окна с перекрытием + сшивка спикеров по эмбеддингам ---
+        try:
+            ann = diarize_windowed(
+                lambda w, s: diarize(w, s, max_speakers=max_speakers),
+                input_audio,
+                max_speakers,
+                window_sec=DIARIZATION_WINDOW_SECONDS,
+                overlap_sec=DIARIZATION_WINDOW_OVERLAP_SECONDS,
+                threshold=DIARIZATION_LINK_THRESHOLD,
+                audio=audio,
+            )
+        except MissingSpeakerEmbeddings as e:
+            print(f"[DIARIZATION] {e} — диаризуем запись целиком")
+    if ann is None:
+        ann, _ = diarize(as_tensor(audio), 16000, num_speakers=max_speakers)
 
     # --- Атомарная запись RTTM ---
     tmp_rttm = rttm_path.with_suffix(".tmp.rttm")
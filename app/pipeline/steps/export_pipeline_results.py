@@ -1,66 +1,74 @@
 from pathlib import Path
-import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import json
-from requests.exceptions import Timeout, ConnectionError
-from app.pipeline.progress.export_pipeline_results import wav_to_mp3, convert_intervals_to_target_json_s3, save_intervals_to_docx
-from app.storage.s3 import upload_mp3_to_s3, upload_json_to_s3, s3_object_exists, upload_file_to_s3, get_s3_object_md5
+from app.pipeline.progress.export_pipeline_results import (
+    encode_segments_parallel, convert_intervals_to_target_json_s3, save_intervals_to_docx,
+)
+from app.storage.s3 import upload_many, S3_LEDGER_VERIFY
+from app.storage.blob_store import OperationManifest, operation_prefix
+from app.storage.upload_ledger import UploadLedger
 from app.pipeline.steps.bd import PipelineSegment
+from app.pipeline.config import (
+    EXPORT_CONTENT_ADDRESSED, EXPORT_ENCODE_WORKERS, EXPORT_MERGED_CHUNK_SECONDS, EXPORT_MERGED_PREROLL_FRAMES, EXPORT_MP3_BITRATE, FFMPEG_BINARY,
+    SEGMENTS_DELIVERY_FORMAT, SEGMENTS_PACKED,
+)
+from app.pipeline.progress.mp3_chunked import encode_mp3_chunked
+from app.pipeline.progress.segment_pack import build_pack, index_path, pack_ref
+from app.pipeline.progress.segment_writer import delivery_suffix, link_or_copy
 from sqlalchemy.orm import Session
 
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s | %(levelname)s | %(message)s'
 )
 
-def file_checksum(path: Path) -> str:
-    """Возвращает md5 хеш файла для идемпотентной проверки"""
-    h = hashlib.md5()
-    with path.open("rb") as f:
-        while chunk := f.read(8192):
-            h.update(chunk)
-    return h.hexdigest()
-
-
-def safe_upload_to_s3(file_path: Path, s3_key: str):
-    """Идемпотентная загрузка: пропускаем, если объект существует и checksum совпадает"""
-    if s3_object_exists(s3_key):
-        remote_md5 = get_s3_object_md5(s3_key)
-        local_md5 = file_checksum(file_path)
-        if remote_md5 == local_md5:
-            logger.info(f"[S3] {s3_key} уже существует и md5 совпадает, пропускаем upload")
-            return
-        else:
-            logger.warning(f"[S3] {s3_key} существует, но md5 не совпадает, перезаписываем")
-    try:
-        upload_mp3_to_s3(file_path, s3_key)
-        print(f"[S3] {s3_key} загружен")
-    except (Timeout, ConnectionError) as e:
-        print(f"[S3] {s3_key} временная ошибка: {e}")
-        raise
-
-
-def safe_upload_file_to_s3(file_path: Path, s3_key: str):
-    """Идемпотентная загрузка любых файлов (JSON, DOCX, MP3)"""
-    if s3_object_exists(s3_key):
-        if s3_object_exists(s3_key):
-            remote_md5 = get_s3_object_md5(s3_key)
-            local_md5 = file_checksum(file_path)
-            if remote_md5 == local_md5:
-                logger.info(f"[S3] {s3_key} уже существует и md5 совпадает, пропускаем upload")
-                return
-            else:
-                logger.warning(f"[S3] {s3_key} существует, но md5 не совпадает, перезаписываем")
-    try:
-        upload_json_to_s3(file_path, s3_key)
-        print(f"[S3] {s3_key} загружен")
-    except (Timeout, ConnectionError) as e:
-        print(f"[S3] {s3_key} временная ошибка: {e}")
-        raise
+def upload_batch(
+        items: List[Tuple[Path, str, str]],
+        ledger: Optional[UploadLedger] = None,
+        shared: bool = False,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    upload_many с пропуском уже загруженных по журналу операции (повторный export — без запросов
+    к S3); упавшие объекты — ошибка шага (задача уйдёт в retry).
+    shared — ключи, общие для всех операций (segments/pipeline_intervals.json и т.п.): другая операция
+    могла их перезаписать, поэтому журналу не верим на слово — ETag сверяется HEAD'ом.
+    """
+    results = upload_many(items, skip_existing=True, ledger=ledger, verify=S3_LEDGER_VERIFY or shared)
+    failed = {key: r["error"] for key, r in results.items() if r["status"] == "failed"}
+    if failed:
+        raise RuntimeError(f"[S3] не загружено {len(failed)} объектов: {failed}")
+    return results
 
 
+def upload_blobs(manifest: OperationManifest) -> None:
+    """
+    Загружает blob'ы, о которых манифест не знает. Blob, уже лежащий на S3 (то же аудио из другой
+    операции или перезапуска), не грузится повторно — ключ по sha256 гарантирует то же содержимое.
+    """
+    pending = manifest.pending()
+    failed = {}
+    if pending:
+        results = upload_many(pending, skip_existing=True)
+        manifest.mark_uploaded(key for key, r in results.items() if r["status"] != "failed")
+        failed = {key: r["error"] for key, r in results.items() if r["status"] == "failed"}
+    manifest.save()
+    if failed:
+        raise RuntimeError(f"[S3] не загружено {len(failed)} blob: {failed}")
+
+
+def write_json_if_changed(path: Path, data: Any) -> Path:
+    """Атомарная запись JSON; одинаковое содержимое не перезаписывается (mtime не меняется — журнал не сомневается)."""
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if path.exists() and path.read_text(encoding="utf-8") == text:
+        return path
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    tmp_path.replace(path)
+    return path
 
 
 def export_pipeline_results(
@@ -77,14 +85,29 @@ def export_pipeline_results(
 ) -> Dict[str, Any]:
     """
     Полностью идемпотентный финальный шаг пайплайна:
-    - WAV → MP3
-    - S3 загрузки (идемпотентные)
+    - WAV → MP3 (пул процессов, уже готовые файлы пропускаются)
+    - при SEGMENTS_PACKED — один контейнер сегментов вместо объекта на сегмент (file_url = ключ#bytes=a-b)
+    - при EXPORT_CONTENT_ADDRESSED — аудио как blobs/<sha[:2]>/<sha256>.<ext> (одинаковое — один раз
+      на весь bucket), JSON/DOCX/manifest.json — под operations/<operation_id>/; иначе всё под s3_prefix
+    - S3 загрузки (идемпотентные, пакетом через upload_many)
     - JSON локально и на S3
     - DOCX локально
     """
     results_path_op.mkdir(parents=True, exist_ok=True)
-
-    # 1️⃣ MP3 сегменты
+    manifest: Optional[OperationManifest] = None
+    if EXPORT_CONTENT_ADDRESSED:
+        s3_prefix = operation_prefix(operation_id)
+        manifest = OperationManifest(results_path_op / "manifest.local.json", operation_id)
+    # префикс только этой операции можно сверять одним списком объектов; общий (segments/) — нет,
+    # а его JSON/DOCX/контейнер/Merged.mp3 перезаписывает каждая операция
+    shared = not EXPORT_CONTENT_ADDRESSED
+    ledger = UploadLedger(results_path_op / "upload_ledger.json", s3_prefix, listable=EXPORT_CONTENT_ADDRESSED)
+
+    # 1️⃣ MP3 (или Opus) сегменты: берём файл доставки, записанный при вырезке, иначе кодируем в пуле процессов
+    suffix = delivery_suffix(SEGMENTS_DELIVERY_FORMAT)
+    content_type = "audio/ogg" if suffix == ".opus" else "audio/mpeg"
+    delivery_files: List[Path] = []
+    encode_jobs: List[Tuple[Path, Path]] = []
     seen = set()
     for it in intervals_with_text:
         wav_path = Path(it["file_name"])
@@ -92,14 +115,51 @@ def export_pipeline_results(
             continue
         seen.add(wav_path)
 
-        mp3_name = wav_path.with_suffix(".mp3").name
-        tmp_mp3 = results_path_op / mp3_name
+        tmp_mp3 = results_path_op / wav_path.with_suffix(suffix).name
+        encoded = wav_path.with_suffix(suffix)
+
+        if SEGMENTS_PACKED and encoded.exists():
+            delivery_files.append(encoded)  # в контейнер берём прямо из audio_segments, без копии
+            continue
 
         if not tmp_mp3.exists():
-            wav_to_mp3(wav_path, tmp_mp3)
+            if encoded.exists():
+                link_or_copy(encoded, tmp_mp3)
+            else:
+                encode_jobs.append((wav_path, tmp_mp3))
+        delivery_files.append(tmp_mp3)
+
+    encode_segments_parallel(
+        encode_jobs,
+        delivery_format=SEGMENTS_DELIVERY_FORMAT or "mp3",
+        bitrate=EXPORT_MP3_BITRATE,
+        max_workers=EXPORT_ENCODE_WORKERS,
+    )
+
+    if not SEGMENTS_PACKED:
+        if manifest:
+            for tmp_mp3 in delivery_files:
+                manifest.add(tmp_mp3, content_type)
+        else:
+            upload_batch([(tmp_mp3, f"{s3_prefix}/{tmp_mp3.name}", content_type) for tmp_mp3 in delivery_files], ledger)
+
+    # 2️⃣ Контейнер: один объект на операцию + индекс смещений
+    pack_index: Dict[str, Tuple[int, int]] = {}
+    if SEGMENTS_PACKED:
+        pack_path = results_path_op / f"segments{suffix}.pack"
+        pack_index = build_pack(delivery_files, pack_path)
+        if manifest:
+            pack_s3_key = manifest.add(pack_path, content_type)
+            manifest.add(index_path(pack_path), "application/json")
+        else:
+            pack_s3_key = f"{s3_prefix}/{pack_path.name}"
+            upload_batch([
+                (pack_path, pack_s3_key, content_type),
+                (index_path(pack_path), f"{s3_prefix}/{index_path(pack_path).name}", "application/json"),
+            ], ledger, shared)
 
-        s3_key = f"{s3_prefix}/{mp3_name}"
-        safe_upload_to_s3(tmp_mp3, s3_key)
+    if manifest:
+        upload_blobs(manifest)
 
     # 3️⃣ JSON с presigned URL
     target_json = convert_intervals_to_target_json_s3(
@@ -108,35 +168,62 @@ def export_pipeline_results(
         speaker_to_file=speaker_to_file,
         label_to_file=label_to_file,
         s3_prefix=s3_prefix,
+        delivery_suffix=suffix,
     )
+    for it in target_json:
+        if not it["file_url"]:
+            continue
+        name = Path(it["file_url"]).name
+        if SEGMENTS_PACKED:
+            it["file_url"] = pack_ref(pack_s3_key, *pack_index[name])
+        elif manifest:
+            it["file_url"] = manifest.objects[name]["blob"]
 
     # 4️⃣ JSON локально атомарно
-    json_path = results_path_op / "pipeline_intervals.json"
-    tmp_json = json_path.with_name(json_path.name + ".tmp")
-    with open(tmp_json, "w", encoding="utf-8") as f:
-        json.dump(target_json, f, ensure_ascii=False, indent=2)
-    tmp_json.rename(json_path)
+    json_path = write_json_if_changed(results_path_op / "pipeline_intervals.json", target_json)
 
     # 5️⃣ JSON на S3 идемпотентно
     json_s3_key = f"{s3_prefix}/pipeline_intervals.json"
-    safe_upload_file_to_s3(target_json, json_s3_key)
+    upload_batch([(json_path, json_s3_key, "application/json")], ledger, shared)
 
 
-    # 6️⃣ DOCX атомарно
+    # 6️⃣ DOCX атомарно: пересобирается, только если изменился JSON (байты DOCX не детерминированы,
+    # новый файл при каждом запуске журнал считал бы изменённым и загружал заново)
     docx_path = results_path_op / "pipeline_result.docx"
-    tmp_docx = docx_path.with_name(docx_path.name + ".tmp")
-    save_intervals_to_docx(intervals_with_text, tmp_docx)
-    tmp_docx.rename(docx_path)
+    if not docx_path.exists() or docx_path.stat().st_mtime_ns < json_path.stat().st_mtime_ns:
+        tmp_docx = docx_path.with_name(docx_path.name + ".tmp")
+        save_intervals_to_docx(intervals_with_text, tmp_docx)
+        tmp_docx.replace(docx_path)
 
     docx_s3_key = f"{s3_prefix}/pipeline_result.docx"
-    upload_file_to_s3(docx_path, docx_s3_key)
+    upload_batch([(docx_path, docx_s3_key, DOCX_CONTENT_TYPE)], ledger, shared)
 
-    # 7️⃣ Merged audio MP3
+    # 7️⃣ Merged audio MP3: кусками по кадрам на всех ядрах, WAV целиком в память не читается
     merged_mp3_path = results_path_op / "Merged.mp3"
     if not merged_mp3_path.exists():
-        wav_to_mp3(merged_audio_path, merged_mp3_path)
+        encode_mp3_chunked(
+            merged_audio_path,
+            merged_mp3_path,
+            bitrate=EXPORT_MP3_BITRATE,
+            max_workers=EXPORT_ENCODE_WORKERS,
+            chunk_seconds=EXPORT_MERGED_CHUNK_SECONDS,
+            preroll_frames=EXPORT_MERGED_PREROLL_FRAMES,
+            ffmpeg=FFMPEG_BINARY,
+        )
+    # загрузка вне проверки: MP3 мог остаться от прерванного запуска, журнал скажет, загружен ли он
+    if manifest:
+        s3_key_merged = manifest.add(merged_mp3_path, "audio/mpeg")
+        upload_blobs(manifest)  # большой файл — multipart
+    else:
         s3_key_merged = f"{s3_prefix}/Merged.mp3"
-        safe_upload_to_s3(merged_mp3_path, s3_key_merged)
+        upload_batch([(merged_mp3_path, s3_key_merged, "audio/mpeg")], ledger, shared)  # большой файл — multipart
+
+    # манифест операции: имя файла -> blob (одинаковый при повторе — журнал не загружает его снова)
+    manifest_s3_key = None
+    if manifest:
+        manifest_path = write_json_if_changed(results_path_op / "manifest.json", manifest.to_json())
+        manifest_s3_key = f"{s3_prefix}/manifest.json"
+        upload_batch([(manifest_path, manifest_s3_key, "application/json")], ledger)
 
     # 8️⃣ Сохраняем сегменты в БД (идемпотентно через delete+insert)
     db.query(PipelineSegment).filter_by(operation_id=operation_id).delete()
@@ -156,4 +243,6 @@ def export_pipeline_results(
     return {
         "json_s3_key": json_s3_key,
         "docx_s3_key": docx_s3_key,
+        "merged_s3_key": s3_key_merged,
+        "manifest_s3_key": manifest_s3_key,
     }
\ No newline at end of file
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.pipeline.config import (
+    TRANSCRIBE_CHECKPOINT, TRANSCRIBE_ENGINE, TRANSCRIBE_STREAM_QUEUE_SIZE, TRANSCRIPTION_CACHE,
+    TRANSCRIPTION_CACHE_MAX_BYTES, TRANSCRIPTION_CACHE_PATH,
+)
+from app.pipeline.progress.interval_table import IntervalSource, load_intervals
+from app.pipeline.progress.transcription_cache import TranscriptionCache
+from app.pipeline.progress.transcription_checkpoint import TranscriptionCheckpoint
+from app.pipeline.steps.prepare_audio_segments import prepare_audio_segments, segments_cache_path
+from app.pipeline.steps.transcribe_yandex import (
+    NOT_RECOGNIZED_TEXT, build_dispatcher, checkpoint_scope, json_safe, transcribe_step_yandex,
+    write_transcription_json,
+)
+
+PUT_POLL_SECONDS = 0.5  # как часто поток вырезки, ждущий места в очереди, проверяет, жив ли потребитель
+
+
+class _ConsumerStopped(Exception):
+    """Распознавание завершилось (с ошибкой) — класть сегменты в очередь больше некому."""
+
+
+def extract_transcribe_step(
+        wav_files: List[Path],
+        intervals: IntervalSource,
+        speaker_to_label: Dict[str, str],
+        unique_tmp_path: Path,
+        output_path: str | Path,
+        *,
+        sample_rate: int = 8000,
+        model: str = "general",
+        language_code: str = "ru-RU",
+        engine: str = TRANSCRIBE_ENGINE,
+        force: bool = False,
+        queue_size: int = TRANSCRIBE_STREAM_QUEUE_SIZE,
+        use_cache: bool = TRANSCRIPTION_CACHE,
+        use_checkpoint: bool = TRANSCRIBE_CHECKPOINT,
+) -> Tuple[Path, Path]:
+    """
+    Вырезка сегментов и распознавание одновременно (производитель — потребитель).
+
+    prepare_audio_segments отдаёт каждый готовый сегмент в ограниченную очередь (queue_size),
+    диспетчер SpeechKit сразу отправляет его в распознавание; при полной очереди вырезка ждёт.
+    Распознанные сегменты дописываются в тот же журнал <output>.checkpoint.jsonl и с тем же scope
+    (transcribe_yandex.checkpoint_scope), что у transcribe_step_yandex, поэтому оба пути продолжают
+    работу друг друга; итоговый JSON — в том же формате.
+    Если распознавание падает, вырезка останавливается на следующем сегменте (не ждёт места
+    в очереди, которую никто не разбирает), и шаг завершается ошибкой распознавания.
+    Потоковый режим есть только у engine="speechkit_dispatcher"; другой движок принимает готовый
+    список, поэтому для него сегменты вырезаются целиком и передаются в transcribe_step_yandex.
+    Возвращает (путь к JSON сегментов, путь к JSON распознавания).
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    intervals = load_intervals(intervals)  # .npz читается один раз, дальше передаётся таблица
+    segments_path = segments_cache_path(unique_tmp_path, intervals, speaker_to_label)
+    if output_path.exists() and segments_path.exists() and not force:
+        return segments_path, output_path
+
+    if engine != "speechkit_dispatcher":
+        segments_path = prepare_audio_segments(wav_files, intervals, speaker_to_label, unique_tmp_path, sample_rate)
+        with open(segments_path, "r", encoding="utf-8") as f:
+            interval_segments = json.load(f)["interval_segments"]
+        return segments_path, transcribe_step_yandex(
+            interval_segments, output_path, force=force, model=model, language_code=language_code, engine=engine,
+            use_cache=use_cache, use_checkpoint=use_checkpoint,
+        )
+
+    cache = TranscriptionCache(
+        TRANSCRIPTION_CACHE_PATH, TRANSCRIPTION_CACHE_MAX_BYTES, engine, model, language_code
+    ) if use_cache else None
+    dispatcher = build_dispatcher()
+    keys: Dict[int, Optional[str]] = {}
+    checkpoint_path = output_path.with_name(output_path.name + ".checkpoint.jsonl")
+    state: Dict[str, Any] = {"checkpoint": None}
+    results: Dict[int, Dict[str, Any]] = {}
+    resumed: set = set()
+
+    async def run() -> Path:
+        loop = asyncio.get_running_loop()
+        queue: "asyncio.Queue[Optional[Tuple[int, Dict[str, Any]]]]" = asyncio.Queue(maxsize=queue_size)
+        stop = threading.Event()
+
+        def put(item: Optional[Tuple[int, Dict[str, Any]]]) -> None:
+            # из потока вырезки: ждём место в очереди порциями, между ними проверяем stop
+            while True:
+                if stop.is_set():
+                    raise _ConsumerStopped()
+                try:
+                    asyncio.run_coroutine_threadsafe(
+                        asyncio.wait_for(queue.put(item), PUT_POLL_SECONDS), loop
+                    ).result()
+                    return
+                except asyncio.TimeoutError:
+                    continue
+
+        try:
+            def on_result(position: int, segment: Dict[str, Any], text: str, cached: bool = False) -> None:
+                item = dict(segment, file_name=str(Path(segment["segment_path"])), transcription=text or NOT_RECOGNIZED_TEXT)
+                results[position] = item
+                if state["checkpoint"] and text:
+                    state["checkpoint"].append(position, json_safe(item))
+                if cache and text and keys.get(position) and not cached:
+                    cache.put(keys[position], text)
+
+            def on_plan(interval_segments: List[Dict[str, Any]]) -> None:
+                # список сегментов известен до вырезки — журнал с тем же scope, что у transcribe_step_yandex
+                if not use_checkpoint:
+                    return
+                checkpoint = TranscriptionCheckpoint(
+                    checkpoint_path, checkpoint_scope(interval_segments, engine, model, language_code)
+                )
+                results.update(checkpoint.load())
+                resumed.update(results)
+                checkpoint.open(results)
+                state["checkpoint"] = checkpoint
+
+            def on_segment(position: int, segment: Dict[str, Any]) -> None:
+                # поток вырезки: уже в журнале — пропуск; попадание в кэш — сразу результат,
+                # иначе в очередь (ждём, если полна)
+                if position in resumed:
+                    return
+                key = cache.key(segment) if cache else None
+                keys[position] = key
+                text = cache.get(key) if cache else None
+                if text is not None:
+                    loop.call_soon_threadsafe(on_result, position, segment, text, True)
+                else:
+                    put((position, segment))
+
+            def produce() -> Path:
+                try:
+                    return prepare_audio_segments(
+                        wav_files, intervals, speaker_to_label, unique_tmp_path, sample_rate,
+                        on_segment=on_segment, on_plan=on_plan,
+                    )
+                finally:
+                    try:
+                        put(None)
+                    except _ConsumerStopped:
+                        pass
+
+            consumer = asyncio.create_task(dispatcher.transcribe_stream(
+                queue, on_result, language_code=language_code, model=model
+            ))
+            producer = asyncio.create_task(asyncio.to_thread(produce))
+            done, _ = await asyncio.wait({consumer, producer}, return_when=asyncio.FIRST_EXCEPTION)
+            if consumer in done and (consumer.cancelled() or consumer.exception() is not None):
+                stop.set()
+                await asyncio.gather(producer, return_exceptions=True)
+                await consumer  # поднимает ошибку распознавания, а не _ConsumerStopped вырезки
+            segments_path = await producer
+            await consumer
+            await asyncio.sleep(0)  # дать выполниться on_result, поставленным из потока вырезки
+        finally:
+            stop.set()
+            if state["checkpoint"]:
+                state["checkpoint"].close()
+        return segments_path
+
+    segments_path = asyncio.run(run())
+
+    with open(segments_path, "r", encoding="utf-8") as f:
+        interval_segments = json.load(f)["interval_segments"]
+    intervals_with_text_all = []
+    for position, segment in enumerate(interval_segments):
+        intervals_with_text_all.append(results.get(position) or dict(
+            segment, file_name=str(Path(segment["segment_path"])), transcription=NOT_RECOGNIZED_TEXT
+        ))
+    if cache:
+        cache.cache.evict()
+        print(f"[TRANSCRIBE] кэш: попаданий {cache.hits}, промахов {cache.misses}")
+
+    write_transcription_json(output_path, {
+        "engine": "yandex_speechkit_v1_rest",
+        "model": model,
+        "language": language_code,
+        "intervals_total": len(interval_segments),
+        "streaming": True,
+        "requests": dispatcher.metrics.summary(),
+        "cache": cache.stats() if cache else None,
+        "resumed": len(resumed),
+    }, intervals_with_text_all)
+    if state["checkpoint"]:
+        state["checkpoint"].close(remove=True)
+    return segments_path, output_path
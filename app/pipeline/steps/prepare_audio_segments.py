@@ -1,42 +1,108 @@
 from pathlib import Path
-from typing import List, Dict, Tuple, Any
+from typing import Any, Callable, List, Dict, Optional, Tuple
 import os
-import torch
-import torchaudio
+import numpy as np
+from app.pipeline.audio_cache import (
+    AudioRangeReader, artifact_path, audio_cache_dir, get_audio_artifact, source_fingerprint,
+)
+from app.pipeline.config import (
+    EXPORT_MP3_BITRATE, FFMPEG_BINARY, SEGMENTS_DELIVERY_FORMAT, SEGMENTS_RANGE_READS, SEGMENTS_VIRTUAL,
+    SEGMENTS_WRITER_MAX_PENDING, SEGMENTS_WRITER_WORKERS,
+)
+from app.pipeline.progress.interval_table import IntervalSource, load_intervals
+from app.pipeline.progress.segment_writer import SegmentWriter, link_or_copy
 from app.pipeline.utils import get_speaker_name
 import hashlib
 import json
 
 
-def hash_intervals(intervals: List[Tuple[float, float, str]], speaker_to_label: Dict[str, str]) -> Path:
+def hash_intervals(intervals: IntervalSource, speaker_to_label: Dict[str, str]) -> Path:
     """
     Создаёт короткий детерминированный hash для intervals + speaker_to_label
     """
     m = hashlib.sha256()
-    m.update(json.dumps(intervals, sort_keys=True).encode())
+    m.update(json.dumps(load_intervals(intervals).to_tuples(), sort_keys=True).encode())
     m.update(json.dumps(speaker_to_label, sort_keys=True).encode())
     return m.hexdigest()[:16]  # короткий hash
 
+
+def segment_key(fingerprint: str, start_sample: int, end_sample: int, sample_rate: int, label: str) -> str:
+    """
+    Ключ одного сегмента: исходный файл (путь, размер, mtime) + диапазон отсчётов + частота + метка.
+    Не зависит от остальных интервалов, поэтому при изменении одного интервала остальные файлы переиспользуются.
+    """
+    return hashlib.sha256(f"{fingerprint}|{start_sample}|{end_sample}|{sample_rate}|{label}".encode()).hexdigest()[:16]
+
+
+def existing_segments_by_key(segments_dir: Path) -> Dict[str, Path]:
+    """
+    Уже вырезанные сегменты каталога: segment_key -> путь WAV (seg_<idx>_<key>_<label>.wav).
+    Файла WAV может не быть (virtual-режим) — тогда рядом лежит только файл доставки.
+    """
+    found: Dict[str, Path] = {}
+    for path in segments_dir.glob("seg_*"):
+        parts = path.name.split(".", 1)[0].split("_", 3)
+        if len(parts) == 4 and parts[1].isdigit() and not path.name.endswith(".tmp"):
+            found.setdefault(parts[2], path.with_suffix(".wav"))
+    return found
+
+def segments_cache_path(unique_tmp_path: Path, intervals: IntervalSource, speaker_to_label: Dict[str, str]) -> Path:
+    """JSON-кэш сегментов для этого набора интервалов и меток (может ещё не существовать)."""
+    return unique_tmp_path / "audio_segments" / f"audio_segments_{hash_intervals(intervals, speaker_to_label)}.json"
+
+
 def prepare_audio_segments(
         wav_files: List[Path],
-        intervals: List[Tuple[float, float, str]],
+        intervals: IntervalSource,
         speaker_to_label: Dict[str, str],
         unique_tmp_path: Path,
-        sample_rate: int = 8000
+        sample_rate: int = 8000,
+        virtual: bool = SEGMENTS_VIRTUAL,
+        delivery_format: Optional[str] = SEGMENTS_DELIVERY_FORMAT,
+        on_segment: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+        on_plan: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
 ) -> Tuple[List[Dict[str, Any]], List[str], List[Tuple[float, float, str]], Dict[str, str], Dict[str, str]]:
     """
     Загружает аудио файлов спикеров, вырезает сегменты по интервалам, сохраняет сегменты и метаданные.
+    intervals — IntervalTable, её .npz (merge_intervals_step) или список (start, end, speaker).
     Кэш хранится в JSON + hash(intervals + speaker_to_label) в имени.
+    Имя файла сегмента — seg_<индекс>_<segment_key>_<метка>: индекс сохраняет порядок по времени
+    и различает одинаковые интервалы, а по segment_key при повторном запуске находится уже вырезанный
+    файл (под любым прежним индексом) — он переиспользуется жёсткой ссылкой, заново вырезаются
+    только интервалы, которых ещё нет на диске.
+
+    При virtual=True файлы сегментов не пишутся: в манифест попадают (артефакт, смещение, длина, метка),
+    а WAV создаётся по segment_path только когда потребитель попросит (virtual_segments.ensure_segment_file).
+
+    При SEGMENTS_RANGE_READS, если артефакта спикера ещё нет в кэше, файл целиком не декодируется:
+    для каждого интервала читается и ресемплируется только его диапазон (audio_cache.AudioRangeReader, файл открывается один раз на спикера).
+
+    Вырезка и кодирование идут в пуле SegmentWriter. При delivery_format ("mp3" / "opus") рядом
+    с WAV сразу пишется файл доставки, который export берёт как есть; в virtual-режиме пишется только он.
+
+    on_segment(позиция, сегмент) вызывается, как только сегмент готов к распознаванию (файл записан
+    или уже был на диске), — для потоковой передачи сегментов в распознавание до конца вырезки.
+    Вызов может прийти из потока пула; позиция — индекс сегмента в итоговом interval_segments.
+    on_plan(interval_segments) вызывается один раз до первого on_segment, когда список сегментов
+    (пути, границы, метки) уже известен, а вырезка ещё не началась.
     """
     SEGMENTS_DIR = unique_tmp_path / "audio_segments"
     SEGMENTS_DIR.mkdir(parents=True, exist_ok=True)
 
-    cache_hash = hash_intervals(intervals, speaker_to_label)
-    cache_path = SEGMENTS_DIR / f"audio_segments_{cache_hash}.json"
+    table = load_intervals(intervals)
+    cache_path = segments_cache_path(unique_tmp_path, table, speaker_to_label)
 
     # --- 1️⃣ Попробуем загрузить кэш ---
     if cache_path.exists():
         print(f"[INFO] Загружаем кэшированные сегменты из {cache_path}")
+        if on_segment is not None or on_plan is not None:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached_segments = json.load(f)["interval_segments"]
+            if on_plan is not None:
+                on_plan(cached_segments)
+            if on_segment is not None:
+                for position, segment in enumerate(cached_segments):
+                    on_segment(position, segment)
         return cache_path
 
     # --- 2️⃣ Маппинг label -> файл, speaker -> файл ---
@@ -57,63 +123,108 @@ def prepare_audio_segments(
     for spk, p in speaker_to_file.items():
         print(f"  {spk:10s} -> {p}")
 
-    # --- 3️⃣ Вспомогательные функции ---
-    def load_and_prepare_wav(path: str, target_sr: int) -> Tuple[torch.Tensor, int]:
-        wav, sr = torchaudio.load(path)
-        if wav.size(0) > 1:
-            wav = wav.mean(dim=0, keepdim=True)
-        if sr != target_sr:
-            wav = torchaudio.functional.resample(wav, sr, target_sr)
-            sr = target_sr
-        return wav, sr
-
-    spk_audio: Dict[str, Tuple[torch.Tensor, int]] = {}
-    for spk in sorted({spk for _, _, spk in intervals}):
+    # --- 3️⃣ Источник аудио спикеров: артефакт из кэша или чтение диапазонов из исходного файла ---
+    cache_dir = audio_cache_dir(unique_tmp_path)
+    spk_audio: Dict[str, Tuple[int, Callable[[int, int], np.ndarray]]] = {}  # spk -> (длина, чтение [s, e))
+    spk_fingerprint: Dict[str, str] = {}
+    range_readers: List[AudioRangeReader] = []
+    for spk in sorted(table.labels[c] for c in np.unique(table.codes).tolist()):
         fpath = speaker_to_file.get(spk)
         if fpath is None:
             print(f"[SEGMENTS] Для {spk} нет файла в merged_audio, пропускаем этот спикер.")
             continue
-        print(f"[SEGMENTS] Загружаем файл спикера {spk}: {os.path.basename(fpath)}")
-        wav, sr = load_and_prepare_wav(fpath, sample_rate)
-        spk_audio[spk] = (wav, sr)
+        spk_fingerprint[spk] = source_fingerprint(fpath)
+        if virtual or not SEGMENTS_RANGE_READS or artifact_path(fpath, sample_rate, cache_dir).exists():
+            print(f"[SEGMENTS] Загружаем файл спикера {spk}: {os.path.basename(fpath)}")
+            audio = get_audio_artifact(fpath, sample_rate, cache_dir)
+            spk_audio[spk] = (len(audio), lambda s, e, a=audio: a[s:e])
+        else:
+            print(f"[SEGMENTS] Читаем диапазоны файла спикера {spk}: {os.path.basename(fpath)}")
+            reader = AudioRangeReader(fpath)  # файл открывается один раз на спикера
+            range_readers.append(reader)
+            spk_audio[spk] = (reader.length(sample_rate), lambda s, e, r=reader: r.read(s, e, sample_rate))
 
     all_segment_paths: List[str] = []
     interval_segments: List[Dict[str, Any]] = []
+    cuts: List[Tuple[Path, int, int, Callable[[int, int], np.ndarray]]] = []  # (файл, начало, конец, чтение)
 
-    for idx, (start, end, spk) in enumerate(intervals):
+    starts_sample, ends_sample = table.sample_ranges(sample_rate)
+    for idx, (start, end, spk) in enumerate(table.to_tuples()):
         if spk not in spk_audio:
             print(f"[SEGMENTS] interval {idx:04d} ({spk}) — нет аудио спикера, пропуск")
             continue
-        wav, sr = spk_audio[spk]
+        num_samples, read_range = spk_audio[spk]
+        sr = sample_rate
         if end <= start:
             print(f"[SEGMENTS] interval {idx:04d} ({spk}) — end <= start, пропуск")
             continue
-        start_sample = max(0, int(start * sr))
-        end_sample = min(wav.size(1), int(end * sr))
+        start_sample = max(0, int(starts_sample[idx]))
+        end_sample = min(num_samples, int(ends_sample[idx]))
         if end_sample <= start_sample:
             print(f"[SEGMENTS] interval {idx:04d} ({spk}) — пустой диапазон после обрезки, пропуск")
             continue
 
-        seg_wave = wav[:, start_sample:end_sample]
         spk_label = speaker_to_label.get(spk, spk)
         safe_label = "".join(ch if ch.isalnum() or ch in "._-" else "_" for ch in spk_label)
-        seg_filename = f"seg_{idx:04d}_{safe_label}.wav"
+        seg_key = segment_key(spk_fingerprint[spk], start_sample, end_sample, sr, spk_label)
+        seg_filename = f"seg_{idx:04d}_{seg_key}_{safe_label}.wav"
         seg_path = SEGMENTS_DIR / seg_filename
-
-        # ✅ атомарная запись
-        tmp_path = seg_path.with_name(seg_path.name + ".tmp.wav")
-        torchaudio.save(tmp_path, seg_wave, sr)
-        tmp_path.rename(seg_path)
-
-        all_segment_paths.append(str(seg_path))
-        interval_segments.append({
+        segment = {
             "start": start,
             "end": end,
             "speaker_id": spk,
             "speaker_label": spk_label,
             "segment_path": str(seg_path),
             "speaker_file": speaker_to_file.get(spk),
-        })
+        }
+
+        if virtual:
+            segment.update({
+                "virtual": True,
+                "source": str(artifact_path(speaker_to_file[spk], sample_rate, cache_dir)),
+                "offset": start_sample,
+                "length": end_sample - start_sample,
+                "sample_rate": sr,
+            })
+
+        all_segment_paths.append(str(seg_path))
+        interval_segments.append(segment)
+        cuts.append((seg_path, start_sample, end_sample, read_range))
+
+    if on_plan is not None:
+        on_plan(interval_segments)
+
+    reused = 0
+    by_key = existing_segments_by_key(SEGMENTS_DIR)
+    writer = SegmentWriter(
+        max_workers=SEGMENTS_WRITER_WORKERS,
+        max_pending=SEGMENTS_WRITER_MAX_PENDING,
+        delivery_format=delivery_format,
+        write_wav=not virtual,
+        mp3_bitrate=EXPORT_MP3_BITRATE,
+        ffmpeg=FFMPEG_BINARY,
+    )
+    for position, (segment, (seg_path, start_sample, end_sample, read_range)) in enumerate(zip(interval_segments, cuts)):
+        ready = None if on_segment is None else (lambda p=position, seg=segment: on_segment(p, seg))
+        donor = by_key.get(seg_path.name.split("_", 3)[2])
+        if not writer.is_done(seg_path) and donor is not None and donor != seg_path and writer.is_done(donor):
+            # тот же диапазон уже вырезан под другим индексом — ссылка вместо повторной вырезки
+            for src, dst in zip(writer.outputs(donor), writer.outputs(seg_path)):
+                if not dst.exists():
+                    link_or_copy(src, dst)
+        if not writer.outputs(seg_path) or writer.is_done(seg_path):
+            # virtual без формата доставки — писать нечего; иначе файлы уже на диске
+            reused += bool(writer.outputs(seg_path))
+            if ready is not None:
+                ready()
+        else:
+            # ✅ атомарная запись в пуле
+            writer.submit(seg_path, lambda s=start_sample, e=end_sample, r=read_range: r(s, e), sample_rate, on_done=ready)
+
+    writer.close()
+    for reader in range_readers:
+        reader.close()
+    print(f"[SEGMENTS] Сегментов: {len(interval_segments)}, переиспользовано с диска: {reused}")
 
     # --- 4️⃣ Сохраняем JSON кэш ---
     tmp_cache = cache_path.with_name(cache_path.name + ".tmp")
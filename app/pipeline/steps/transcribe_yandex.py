@@ -1,7 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+import asyncio
+import hashlib
 import json
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from app.pipeline.config import (
+    SPEECHKIT_API_KEY, SPEECHKIT_CONCURRENCY_INITIAL, SPEECHKIT_CONCURRENCY_MAX, SPEECHKIT_CONCURRENCY_MIN,
+    SPEECHKIT_DEADLINE, SPEECHKIT_FOLDER_ID, SPEECHKIT_LATENCY_PER_SECOND, SPEECHKIT_LATENCY_TARGET,
+    SPEECHKIT_MAX_RETRIES, SPEECHKIT_PACK_GAP_SECONDS, SPEECHKIT_PACK_MAX_SECONDS, SPEECHKIT_PACK_SHORT_SECONDS,
+    SPEECHKIT_SYNC_MAX_BYTES, SPEECHKIT_SYNC_MAX_SECONDS, SPEECHKIT_URL,
+    TRANSCRIBE_CHECKPOINT, TRANSCRIBE_CHECKPOINT_CHUNK, TRANSCRIBE_CHUNKS_IN_FLIGHT, TRANSCRIBE_ENGINE, TRANSCRIPTION_CACHE, TRANSCRIPTION_CACHE_MAX_BYTES, TRANSCRIPTION_CACHE_PATH,
+)
 from app.pipeline.progress.Yandex_SST import transcribe_with_yandex_async
+from app.pipeline.progress.speechkit_client import AIMDLimiter, SpeechKitDispatcher
+from app.pipeline.progress.transcription_cache import TranscriptionCache
+from app.pipeline.progress.transcription_checkpoint import TranscriptionCheckpoint
+from app.pipeline.progress.virtual_segments import materialize_segments
 import tempfile, os
 from pathlib import Path
 
@@ -15,6 +29,126 @@ def json_safe(obj):
     return obj
 
 
+NOT_RECOGNIZED_TEXT = "Распознать текст не удалось"
+
+
+def build_dispatcher() -> SpeechKitDispatcher:
+    """Диспетчер SpeechKit с параметрами из config."""
+    return SpeechKitDispatcher(
+        SPEECHKIT_URL,
+        SPEECHKIT_API_KEY,
+        AIMDLimiter(
+            SPEECHKIT_CONCURRENCY_INITIAL,
+            SPEECHKIT_CONCURRENCY_MIN,
+            SPEECHKIT_CONCURRENCY_MAX,
+            SPEECHKIT_LATENCY_TARGET,
+            latency_per_second=SPEECHKIT_LATENCY_PER_SECOND,
+        ),
+        folder_id=SPEECHKIT_FOLDER_ID,
+        pack_max_seconds=SPEECHKIT_PACK_MAX_SECONDS,
+        pack_short_seconds=SPEECHKIT_PACK_SHORT_SECONDS,
+        pack_gap_seconds=SPEECHKIT_PACK_GAP_SECONDS,
+        sync_max_seconds=SPEECHKIT_SYNC_MAX_SECONDS,
+        sync_max_bytes=SPEECHKIT_SYNC_MAX_BYTES,
+        max_retries=SPEECHKIT_MAX_RETRIES,
+        deadline=SPEECHKIT_DEADLINE,
+    )
+
+
+def is_recognized(item: Dict[str, Any]) -> bool:
+    return (item.get("transcription") or "").strip() not in ("", NOT_RECOGNIZED_TEXT)
+
+
+def write_transcription_json(
+    output_path: Path,
+    meta: Dict[str, Any],
+    intervals_with_text_all: List[Dict[str, Any]],
+) -> Path:
+    """Атомарная запись итогового JSON распознавания (meta, intervals_all, intervals_with_text)."""
+    intervals_with_text = [it for it in intervals_with_text_all if is_recognized(it)]
+    meta = dict(meta, created_at=datetime.utcnow().isoformat(), intervals_recognized=len(intervals_with_text))
+    with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8", dir=output_path.parent, delete=False) as tmp:
+        json.dump({
+            "meta": meta,
+            "intervals_all": json_safe(intervals_with_text_all),
+            "intervals_with_text": json_safe(intervals_with_text)
+        }, tmp, ensure_ascii=False, indent=2)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        tmp_path = Path(tmp.name)
+    tmp_path.replace(output_path)
+    return output_path
+
+
+def recognize_segments(
+    interval_segments: List[Dict[str, Any]],
+    *,
+    model: str,
+    language_code: str,
+    engine: str,
+    on_item: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+    chunk_size: int = TRANSCRIBE_CHECKPOINT_CHUNK,
+    chunks_in_flight: int = TRANSCRIBE_CHUNKS_IN_FLIGHT,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Отправляет сегменты в выбранный движок: (intervals_with_text, intervals_all, метрики запросов).
+    on_item(индекс, элемент) — по готовности сегмента: у диспетчера по одному, у transcribe_with_yandex_async
+    после каждой порции из chunk_size сегментов. Порции transcribe_with_yandex_async идут внахлёст
+    (chunks_in_flight одновременно), чтобы медленный сегмент одной порции не останавливал остальные.
+    """
+    if engine == "speechkit_dispatcher":
+        # адаптивный лимит параллельности + повторы; виртуальные сегменты читаются без записи WAV
+        dispatcher = build_dispatcher()
+        intervals_with_text, intervals_with_text_all = asyncio.run(dispatcher.transcribe_segments(
+            interval_segments,
+            language_code=language_code,
+            model=model,
+            not_recognized_text=NOT_RECOGNIZED_TEXT,
+            on_result=on_item,
+        ))
+        return intervals_with_text, intervals_with_text_all, dispatcher.metrics.summary()
+
+    def run_chunk(chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # распознаватель читает файлы сам — виртуальные сегменты материализуем
+        _, chunk_all = transcribe_with_yandex_async(
+            interval_segments=materialize_segments(chunk),
+            not_recognized_text=NOT_RECOGNIZED_TEXT,
+        )
+        return chunk_all
+
+    size = max(1, chunk_size)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(interval_segments)
+    with ThreadPoolExecutor(max_workers=max(1, chunks_in_flight), thread_name_prefix="yandex-chunk") as pool:
+        futures = {
+            pool.submit(run_chunk, interval_segments[start:start + size]): start
+            for start in range(0, len(interval_segments), size)
+        }
+        # контрольная точка — по готовности каждой порции, в каком бы порядке они ни завершались
+        for future in as_completed(futures):
+            chunk_start = futures[future]
+            try:
+                chunk_all = future.result()
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            by_file = {str(Path(it["file_name"])): it for it in chunk_all}
+            for offset, segment in enumerate(interval_segments[chunk_start:chunk_start + size]):
+                seg_file = str(Path(segment["segment_path"]))
+                item = by_file.get(seg_file) or dict(segment, file_name=seg_file, transcription=NOT_RECOGNIZED_TEXT)
+                results[chunk_start + offset] = item
+                if on_item is not None:
+                    on_item(chunk_start + offset, item)
+    intervals_with_text_all = list(results)
+    return [it for it in intervals_with_text_all if is_recognized(it)], intervals_with_text_all, None
+
+
+def checkpoint_scope(interval_segments: List[Dict[str, Any]], engine: str, model: str, language_code: str) -> str:
+    m = hashlib.sha256()
+    m.update(json.dumps([str(s["segment_path"]) for s in interval_segments]).encode())
+    m.update(f"{engine}|{model}|{language_code}".encode())
+    return m.hexdigest()[:16]
+
+
 def transcribe_step_yandex(
     interval_segments: List[Dict[str, Any]],
     output_path: str | Path,
@@ -22,27 +156,89 @@ def transcribe_step_yandex(
     force: bool = False,
     model: str = "general",
     language_code: str = "ru-RU",
+    engine: str = TRANSCRIBE_ENGINE,
+    use_cache: bool = TRANSCRIPTION_CACHE,
+    use_checkpoint: bool = TRANSCRIBE_CHECKPOINT,
 ) -> Path:
+    """
+    Распознавание сегментов в JSON (meta, intervals_all, intervals_with_text).
+
+    Каждый распознанный сегмент сразу пишется в журнал <output>.checkpoint.jsonl (fsync); после падения
+    воркера или повторной доставки задачи (task_acks_late) распознаются только сегменты, которых
+    нет в журнале, а итог собирается тот же. Журнал удаляется после записи итогового JSON.
+    """
     output_path = Path(output_path)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
     if output_path.exists() and not force:
         return output_path
 
-    intervals_with_text, intervals_with_text_all = transcribe_with_yandex_async(
-        interval_segments=interval_segments,
-        not_recognized_text="Распознать текст не удалось",
-    )
+    # 1️⃣ Контрольная точка: сегменты, распознанные до падения
+    checkpoint = TranscriptionCheckpoint(
+        output_path.with_name(output_path.name + ".checkpoint.jsonl"),
+        checkpoint_scope(interval_segments, engine, model, language_code),
+    ) if use_checkpoint else None
+    done: Dict[int, Dict[str, Any]] = checkpoint.load() if checkpoint else {}
+    resumed = len(done)
 
-    with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8", dir=output_path.parent, delete=False) as tmp:
-        json.dump({
-            "meta": {"engine": "yandex_speechkit_v3", "model": model, "language": language_code, "created_at": datetime.utcnow().isoformat(), "intervals_total": len(interval_segments), "intervals_recognized": len(intervals_with_text)},
-            "intervals_all": json_safe(intervals_with_text_all),
-            "intervals_with_text": json_safe(intervals_with_text)
-        }, tmp, ensure_ascii=False, indent=2)
-        tmp.flush()
-        os.fsync(tmp.fileno())
-        tmp_path = Path(tmp.name)
-    tmp_path.replace(output_path)
+    # 2️⃣ Кэш по содержимому сегментов: в движок уходят только промахи
+    cache = TranscriptionCache(
+        TRANSCRIPTION_CACHE_PATH, TRANSCRIPTION_CACHE_MAX_BYTES, engine, model, language_code
+    ) if use_cache else None
+    keys: Dict[int, str] = {}
+    for idx, segment in enumerate(interval_segments):
+        if idx in done or cache is None:
+            continue
+        keys[idx] = cache.key(segment)
+        text = cache.get(keys[idx])
+        if text is not None:
+            done[idx] = dict(segment, file_name=str(Path(segment["segment_path"])), transcription=text)
+    positions = [idx for idx in range(len(interval_segments)) if idx not in done]
+
+    # 3️⃣ Распознавание оставшихся; каждый результат — в журнал и в кэш
+    if checkpoint:
+        checkpoint.open(done)
+
+    def on_item(local_idx: int, item: Dict[str, Any]) -> None:
+        position = positions[local_idx]
+        done[position] = item
+        if not is_recognized(item):
+            return  # неудачные сегменты в журнал не пишем — при продолжении они распознаются заново
+        if checkpoint:
+            checkpoint.append(position, json_safe(item))
+        if cache:
+            cache.put(keys[position], item["transcription"].strip())
+
+    requests_meta = None
+    try:
+        if positions:
+            _, _, requests_meta = recognize_segments(
+                [interval_segments[idx] for idx in positions],
+                model=model, language_code=language_code, engine=engine, on_item=on_item,
+            )
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+    # 4️⃣ Сборка в исходном порядке
+    intervals_with_text_all = [
+        done.get(idx) or dict(segment, file_name=str(Path(segment["segment_path"])), transcription=NOT_RECOGNIZED_TEXT)
+        for idx, segment in enumerate(interval_segments)
+    ]
+    if cache:
+        cache.cache.evict()
+        print(f"[TRANSCRIBE] кэш: попаданий {cache.hits}, промахов {cache.misses}")
+
+    write_transcription_json(output_path, {
+        "engine": "yandex_speechkit_v3" if engine != "speechkit_dispatcher" else "yandex_speechkit_v1_rest",
+        "model": model,
+        "language": language_code,
+        "intervals_total": len(interval_segments),
+        "requests": requests_meta,
+        "cache": cache.stats() if cache else None,
+        "resumed": resumed,
+    }, intervals_with_text_all)
+    if checkpoint:
+        checkpoint.close(remove=True)
 
     return output_path  # возвращаем путь к JSON
@@ -1,8 +1,32 @@
 import json
 import random
 from pathlib import Path
-from copy import deepcopy
-from typing import List, Tuple
+from typing import Dict, List, Tuple
+from app.pipeline.config import (
+    VOICEPRINT_CACHE_PATH,
+    VOICEPRINT_CACHE_MAX_BYTES,
+    VOICEPRINT_MODEL_VERSION,
+    VOICEPRINT_PARAMS,
+    VOICEPRINT_BATCHED,
+    VOICEPRINT_EMBEDDING_MODEL,
+    VOICEPRINT_BATCH_SIZE,
+    VOICEPRINT_MAX_INTERVALS_PER_SPEAKER,
+    VOICEPRINT_MIN_INTERVAL_SECONDS,
+    VOICEPRINT_MAX_INTERVAL_SECONDS,
+    SPEAKER_ENERGY_FAST_PATH,
+    SPEAKER_ENERGY_MARGIN_DB,
+    SPEAKER_ENERGY_FRAME_SECONDS,
+)
+from app.pipeline.audio_cache import audio_cache_dir, get_audio_artifact
+from app.pipeline.model_registry import get_embedding_model
+from app.pipeline.progress.batched_embeddings import (
+    build_file_voiceprints_batched,
+    build_src_speaker_voiceprints_batched,
+)
+from app.pipeline.progress.energy_assignment import assign_by_energy, speaker_mic_energy_db
+from app.pipeline.progress.interval_table import IntervalSource, IntervalTable, load_intervals
+from app.pipeline.progress.voiceprint_cache import VoiceprintStore, cached_file_voiceprints
+from app.pipeline.utils import get_speaker_name
 from app.pipeline.progress.VAD import (
     build_src_speaker_voiceprints,
     build_file_voiceprints,
@@ -11,19 +35,21 @@ from app.pipeline.progress.VAD import (
 
 
 Interval = Tuple[float, float, str]
+ENERGY_SAMPLE_RATE = 8000  # частота артефактов микрофонов, декодированных на шаге слияния
 
-def vad_hungarian_step(intervals: List[Interval], merged_audio_path: Path, wav_files: List[Path], tmp_dir: Path) -> Path:
+def vad_hungarian_step(intervals: IntervalSource, merged_audio_path: Path, wav_files: List[Path], tmp_dir: Path) -> Path:
     """
     Шаг пайплайна: VAD + Венгерский алгоритм для присвоения уникальных меток спикеров.
 
     Args:
-        intervals: исходные интервалы (от merge_consecutive_intervals)
+        intervals: исходные интервалы (merge_intervals.npz от merge_intervals_step, таблица или список)
         merged_audio_path: основной аудиофайл
         wav_files: список исходных файлов спикеров
         tmp_dir: директория для временного хранения результата
 
     Returns:
-        updated_intervals: интервалы с уникальными метками спикеров
+        путь к JSON с speaker_to_label; интервалы с уникальными метками лежат рядом
+        в vad_hungarian_intervals.npz (IntervalTable), см. load_vad_hungarian
     """
     tmp_dir.mkdir(parents=True, exist_ok=True)
     step_tmp_path = tmp_dir / "vad_hungarian_intervals.json"
@@ -34,20 +60,71 @@ def vad_hungarian_step(intervals: List[Interval], merged_audio_path: Path, wav_f
         return step_tmp_path
 
     random.seed(42)
+    table = load_intervals(intervals)
+    intervals = table.to_tuples()  # построители голосовых отпечатков принимают список
+    cache_dir = audio_cache_dir(merged_audio_path.parent)
+    speaker_to_label = None
+
+    # ⚡ быстрый путь: у каждого участника свой микрофон — сравниваем энергию каналов
+    if SPEAKER_ENERGY_FAST_PATH:
+        channels = [get_audio_artifact(f, ENERGY_SAMPLE_RATE, cache_dir) for f in wav_files]
+        speakers, energy_db = speaker_mic_energy_db(table, channels, ENERGY_SAMPLE_RATE, SPEAKER_ENERGY_FRAME_SECONDS)
+        speaker_to_label, margin = assign_by_energy(
+            speakers, [get_speaker_name(f) for f in wav_files], energy_db, SPEAKER_ENERGY_MARGIN_DB
+        )
+        if speaker_to_label is None:
+            print(f"[VAD+Hungarian] Энергия неоднозначна (запас {margin:.1f} дБ), переходим к эмбеддингам")
+        else:
+            print(f"[VAD+Hungarian] Назначение по энергии каналов, запас {margin:.1f} дБ")
+
     # выполняем VAD + эмбеддинги + Венгерский алгоритм
-    spk_to_vec = build_src_speaker_voiceprints(intervals, merged_audio_path)
-    file_to_vec = build_file_voiceprints(wav_files)
-    speaker_to_label, _, _ = assign_unique_labels_to_speakers(spk_to_vec, file_to_vec)
+    if speaker_to_label is None:
+        if VOICEPRINT_BATCHED:
+            # обе стороны сравнения — одной моделью, иначе Венгерский алгоритм сравнит разные пространства
+            embedding = get_embedding_model()
+            spk_to_vec = build_src_speaker_voiceprints_batched(
+                intervals,
+                merged_audio_path,
+                embedding,
+                cache_dir,
+                batch_size=VOICEPRINT_BATCH_SIZE,
+                max_per_speaker=VOICEPRINT_MAX_INTERVALS_PER_SPEAKER,
+                min_duration=VOICEPRINT_MIN_INTERVAL_SECONDS,
+                max_duration=VOICEPRINT_MAX_INTERVAL_SECONDS,
+            )
+            build_files = lambda paths: build_file_voiceprints_batched(
+                paths,
+                embedding,
+                cache_dir,
+                key_fn=get_speaker_name,
+                batch_size=VOICEPRINT_BATCH_SIZE,
+                max_per_file=VOICEPRINT_MAX_INTERVALS_PER_SPEAKER,
+                crop_duration=VOICEPRINT_MAX_INTERVAL_SECONDS,
+            )
+            model_version = VOICEPRINT_EMBEDDING_MODEL
+        else:
+            spk_to_vec = build_src_speaker_voiceprints(intervals, merged_audio_path)
+            build_files, model_version = build_file_voiceprints, VOICEPRINT_MODEL_VERSION
+        store = VoiceprintStore(VOICEPRINT_CACHE_PATH, VOICEPRINT_CACHE_MAX_BYTES, model_version, VOICEPRINT_PARAMS)
+        file_to_vec = cached_file_voiceprints(wav_files, build_files, store, key_fn=get_speaker_name)
+        speaker_to_label, _, _ = assign_unique_labels_to_speakers(spk_to_vec, file_to_vec)
 
     print(speaker_to_label)
-    updated_intervals = deepcopy(intervals)
-    for i in range(len(updated_intervals)):
-        updated_intervals[i] = (updated_intervals[i][0], updated_intervals[i][1], speaker_to_label[updated_intervals[i][2]])
+    intervals_path = table.relabel(speaker_to_label).save(step_tmp_path.with_suffix(".npz"))
 
-    # атомарное сохранение
+    # атомарное сохранение; JSON пишется последним — по нему шаг считается выполненным
     tmp_file = step_tmp_path.with_name(step_tmp_path.name + ".tmp")
     with open(tmp_file, "w") as f:
-        json.dump({"intervals": updated_intervals, "speaker_to_label": speaker_to_label}, f)
+        json.dump({"intervals_path": intervals_path.name, "speaker_to_label": speaker_to_label}, f)
     tmp_file.rename(step_tmp_path)
 
-    return step_tmp_path
\ No newline at end of file
+    return step_tmp_path
+
+
+def load_vad_hungarian(step_path: Path) -> Tuple[IntervalTable, Dict[str, str]]:
+    """Результат vad_hungarian_step: (интервалы с уникальными метками, speaker_to_label)."""
+    with open(step_path, "r") as f:
+        data = json.load(f)
+    if "intervals_path" not in data:  # формат прежних версий: интервалы списком внутри JSON
+        return IntervalTable.from_tuples(data["intervals"]), data["speaker_to_label"]
+    return IntervalTable.load(Path(step_path).parent / data["intervals_path"]), data["speaker_to_label"]
\ No newline at end of file
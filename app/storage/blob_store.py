@@ -0,0 +1,102 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+BLOBS_PREFIX = "blobs"
+OPERATIONS_PREFIX = "operations"
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def blob_key(sha256: str, suffix: str) -> str:
+    """blobs/ab/abcdef...mp3 — ключ по содержимому; два символа шардируют префикс."""
+    return f"{BLOBS_PREFIX}/{sha256[:2]}/{sha256}{suffix}"
+
+
+def operation_prefix(operation_id: str) -> str:
+    return f"{OPERATIONS_PREFIX}/{operation_id}"
+
+
+class OperationManifest:
+    """
+    Манифест операции в контентно-адресуемом хранилище: имя файла операции -> blob.
+
+    Аудио (сегменты, контейнер, Merged.mp3) хранится один раз под blobs/<sha[:2]>/<sha256>.<ext>
+    и разделяется между перезапусками и операциями; у операции — только маленький manifest.json
+    под operations/<operation_id>/. Локальная копия манифеста служит журналом: файл с теми же
+    размером и mtime не хэшируется повторно, а уже загруженный blob не проверяется на S3.
+    """
+
+    def __init__(self, path: Path, operation_id: str):
+        self.path = Path(path)
+        self.operation_id = operation_id
+        self.objects: Dict[str, Dict[str, Any]] = self._load()
+        self._content_types: Dict[str, str] = {}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if data.get("operation_id") != self.operation_id:
+            return {}
+        return data.get("objects", {})
+
+    def add(self, local_path: Path, content_type: str, name: str | None = None) -> str:
+        """Регистрирует файл операции и возвращает ключ его blob (хэш — только если файл изменился)."""
+        local_path = Path(local_path)
+        name = name or local_path.name
+        st = local_path.stat()
+        entry = self.objects.get(name)
+        if not entry or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            sha = file_sha256(local_path)
+            entry = {
+                "blob": blob_key(sha, local_path.suffix),
+                "sha256": sha,
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "uploaded": bool(entry and entry["sha256"] == sha and entry.get("uploaded")),
+            }
+            self.objects[name] = entry
+        entry["local_path"] = str(local_path)
+        self._content_types[name] = content_type
+        return entry["blob"]
+
+    def pending(self) -> List[Tuple[Path, str, str]]:
+        """Blob'ы, о загрузке которых манифест не знает (один blob — одна загрузка)."""
+        items: Dict[str, Tuple[Path, str, str]] = {}
+        for name, entry in self.objects.items():
+            if not entry.get("uploaded") and name in self._content_types:
+                items.setdefault(entry["blob"], (Path(entry["local_path"]), entry["blob"], self._content_types[name]))
+        return list(items.values())
+
+    def mark_uploaded(self, blob_keys) -> None:
+        blob_keys = set(blob_keys)
+        for entry in self.objects.values():
+            if entry["blob"] in blob_keys:
+                entry["uploaded"] = True
+
+    def save(self) -> Path:
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"operation_id": self.operation_id, "objects": self.objects}, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(self.path)
+        return self.path
+
+    def to_json(self) -> Dict[str, Any]:
+        """Манифест для S3: без локальных путей и служебных полей (одинаковый при повторе — не перезагружается)."""
+        return {
+            "operation_id": self.operation_id,
+            "objects": {
+                name: {"blob": e["blob"], "sha256": e["sha256"], "size": e["size"]}
+                for name, e in sorted(self.objects.items())
+                if name in self._content_types
+            },
+        }
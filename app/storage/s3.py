@@ -1,31 +1,52 @@
 import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
 import torchaudio
 import torch
 from botocore.client import Config, ClientError
+from botocore.exceptions import BotoCoreError
 import tempfile
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
 import json
 
+from app.storage.upload_ledger import UploadLedger
+
 S3_BUCKET = "local-bucket"
 S3_REGION = "us-east-1"
 S3_ACCESS_KEY = "minio"
 S3_SECRET_KEY = "minio123"
+S3_ENDPOINT_URL = "http://localhost:9000"
+
+S3_UPLOAD_WORKERS = 16                      # параллельных объектов в upload_many
+S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024   # файлы больше — multipart
+S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+S3_MULTIPART_CONCURRENCY = 4                # частей одного файла одновременно
+S3_LEDGER_VERIFY = False                    # сверять журнал загрузок со списком объектов при каждом export
+
+
+def make_s3_client(max_pool_connections: int = 10, **config_kwargs):
+    return boto3.client(
+        "s3",
+        endpoint_url=S3_ENDPOINT_URL,
+        aws_access_key_id=S3_ACCESS_KEY,
+        aws_secret_access_key=S3_SECRET_KEY,
+        region_name=S3_REGION,
+        config=Config(
+            signature_version="s3v4",
+            connect_timeout=10,  # время подключения
+            read_timeout=30,
+            max_pool_connections=max_pool_connections,
+            **config_kwargs,
+        ),
+    )
 
 
-s3_client = boto3.client(
-    "s3",
-    endpoint_url="http://localhost:9000",
-    aws_access_key_id=S3_ACCESS_KEY,
-    aws_secret_access_key=S3_SECRET_KEY,
-    region_name=S3_REGION,
-    config=Config(
-        signature_version="s3v4",
-        connect_timeout=10,  # время подключения
-        read_timeout=30,
-    ),
-)
+s3_client = make_s3_client()
+_bulk_clients: Dict[int, Any] = {}
 
 def generate_presigned_url(key: str, expires_in: int = 3600) -> str:
     return s3_client.generate_presigned_url(
@@ -80,8 +101,8 @@ def download_segment_from_s3(s3_client, bucket: str, key: str) -> str:
     return tmp_file.name
 
 
-def upload_mp3_to_s3(local_path: Path, s3_key: str):
-    """Заливает mp3 в S3, если его там еще нет"""
+def upload_mp3_to_s3(local_path: Path, s3_key: str, content_type: str = "audio/mpeg"):
+    """Заливает mp3 (или другой аудиофайл доставки) в S3, если его там еще нет"""
     try:
         s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key)
         # если объект есть — не загружаем повторно
@@ -92,10 +113,15 @@ def upload_mp3_to_s3(local_path: Path, s3_key: str):
             Filename=str(local_path),
             Bucket=S3_BUCKET,
             Key=s3_key,
-            ExtraArgs={"ContentType": "audio/mpeg"},
+            ExtraArgs={"ContentType": content_type},
         )
 
 
+def get_s3_object_range(s3_key: str, first: int, last: int):
+    """Ответ get_object только для байт [first, last] (включительно); тело читается потоком."""
+    return s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key, Range=f"bytes={first}-{last}")
+
+
 def upload_json_to_s3(
     data: Dict[str, Any],
     s3_key: str,
@@ -136,4 +162,141 @@ def upload_file_to_s3(file_path: Path, s3_key: str):
         Filename=str(file_path),
         Bucket=S3_BUCKET,
         Key=s3_key
-    )
\ No newline at end of file
+    )
+
+
+def bulk_s3_client(workers: int = S3_UPLOAD_WORKERS):
+    """
+    Клиент для upload_many: пул соединений под workers объектов по S3_MULTIPART_CONCURRENCY частей,
+    иначе потоки ждут свободное соединение (botocore по умолчанию держит 10).
+    """
+    if workers not in _bulk_clients:
+        _bulk_clients[workers] = make_s3_client(
+            max_pool_connections=workers * S3_MULTIPART_CONCURRENCY,
+            retries={"max_attempts": 5, "mode": "standard"},
+        )
+    return _bulk_clients[workers]
+
+
+def list_s3_objects(prefix: str, bucket: str = S3_BUCKET, client=None) -> Dict[str, Tuple[int, str]]:
+    """Один проход ListObjectsV2 по префиксу: {ключ: (размер, ETag)} (по 1000 ключей на запрос)."""
+    client = client or s3_client
+    objects: Dict[str, Tuple[int, str]] = {}
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix.rstrip("/") + "/"):
+        for obj in page.get("Contents", []):
+            objects[obj["Key"]] = (obj["Size"], obj["ETag"].strip('"'))
+    return objects
+
+
+def upload_many(
+    items: Iterable[Sequence[Any]],
+    workers: int = S3_UPLOAD_WORKERS,
+    skip_existing: bool = False,
+    bucket: str = S3_BUCKET,
+    ledger: Optional[UploadLedger] = None,
+    verify: bool = False,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Параллельная загрузка файлов: items — (локальный путь, ключ[, content_type]).
+
+    Объекты грузятся пулом из workers потоков через общий клиент bulk_s3_client; файлы больше
+    S3_MULTIPART_THRESHOLD — multipart частями S3_MULTIPART_CHUNKSIZE (TransferConfig).
+    skip_existing — не грузить, если объект с тем же размером уже есть (HEAD).
+    Ошибка одного объекта не прерывает остальные.
+
+    С ledger (журнал загрузок операции) неизменённые файлы из журнала пропускаются без запросов.
+    Остальные (и все при verify) сверяются с S3 по размеру и ETag: для ключей под собственным
+    префиксом операции (ledger.covers) — по списку объектов, который запрашивается один раз на журнал,
+    для прочих — HEAD на этот ключ. ETag загруженного объекта берётся HEAD'ом на него же.
+
+    Returns:
+        {ключ: {"status": "uploaded" | "skipped" | "failed", "bytes": ..., "seconds": ..., "error": ...}}
+    """
+    client = bulk_s3_client(workers)
+    transfer = TransferConfig(
+        multipart_threshold=S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=S3_MULTIPART_CONCURRENCY,
+    )
+
+    def head(key: str) -> Optional[Tuple[int, str]]:
+        try:
+            response = client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            return None
+        return response["ContentLength"], response["ETag"].strip('"')
+
+    def one(item: Sequence[Any]) -> Dict[str, Any]:
+        local_path, key = Path(item[0]), item[1]
+        content_type: Optional[str] = item[2] if len(item) > 2 else None
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"key": key, "bytes": 0, "error": None}
+        try:
+            size = local_path.stat().st_size
+            result["bytes"] = size
+            if ledger is not None and key in check_with_head:
+                if ledger.reconcile(local_path, key, head(key), S3_MULTIPART_CHUNKSIZE):
+                    result["status"] = "skipped"
+                    return result
+            elif skip_existing:
+                try:
+                    if client.head_object(Bucket=bucket, Key=key)["ContentLength"] == size:
+                        result["status"] = "skipped"
+                        return result
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                        raise
+            client.upload_file(
+                Filename=str(local_path),
+                Bucket=bucket,
+                Key=key,
+                ExtraArgs={"ContentType": content_type} if content_type else None,
+                Config=transfer,
+            )
+            result["status"] = "uploaded"
+            if ledger is not None:
+                remote = head(key)
+                ledger.record(local_path, key, remote[1] if remote else None)
+        except (ClientError, BotoCoreError, S3UploadFailedError, OSError) as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+        finally:
+            result["seconds"] = time.perf_counter() - started
+        return result
+
+    items = list(items)
+    results: Dict[str, Dict[str, Any]] = {}
+    check_with_head = set()
+    if ledger is not None:
+        doubtful = {item[1] for item in items if verify or not ledger.is_uploaded(Path(item[0]), item[1])}
+        if ledger.remote is None and any(ledger.covers(key) for key in doubtful):
+            ledger.remote = list_s3_objects(ledger.prefix, bucket, client)  # один раз на журнал (на export)
+        todo = []
+        for item in items:
+            local_path, key = Path(item[0]), item[1]
+            if key not in doubtful:
+                skipped = True
+            elif ledger.covers(key):
+                skipped = ledger.reconcile(local_path, key, ledger.remote.get(key), S3_MULTIPART_CHUNKSIZE)
+            else:
+                skipped = False
+                check_with_head.add(key)  # общий префикс: HEAD в пуле, без списка всего префикса
+            if skipped:
+                results[key] = {"status": "skipped", "bytes": ledger.entries[key]["size"], "error": None, "seconds": 0.0}
+            else:
+                todo.append(item)
+        items, skip_existing = todo, False  # журнал уже ответил на вопрос о существовании
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items) or 1))) as pool:
+        results.update({r.pop("key"): r for r in pool.map(one, items)})
+
+    if ledger is not None:
+        ledger.save()
+
+    counts: Dict[str, int] = {}
+    for r in results.values():
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    print(f"[S3] upload_many: {len(results)} объектов, {counts}")
+    return results
@@ -0,0 +1,114 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+
+def file_md5(path: Path) -> str:
+    h = hashlib.md5()
+    with Path(path).open("rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_multipart_etag(path: Path, part_size: int) -> str:
+    """ETag, который S3 выдаёт multipart-объекту из частей по part_size: md5(md5 частей)-<число частей>."""
+    digests = []
+    with Path(path).open("rb") as f:
+        while True:
+            h = hashlib.md5()
+            remaining = part_size
+            while remaining > 0 and (chunk := f.read(min(1 << 20, remaining))):
+                h.update(chunk)
+                remaining -= len(chunk)
+            if remaining == part_size:
+                break
+            digests.append(h.digest())
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+class UploadLedger:
+    """
+    Локальный журнал загрузок одной операции: ключ -> размер и mtime_ns локального файла, ETag.
+
+    Если файл не менялся с момента записи в журнал, он считается загруженным без запросов к S3,
+    поэтому повторный export готовой операции не делает HEAD/MD5 на каждый сегмент.
+    При сомнении (ключа нет в журнале, файл изменился, явная сверка) вызывающий узнаёт размер и ETag
+    объекта и передаёт их в reconcile():
+    - listable (prefix принадлежит только этой операции, например operations/<id>) — один проход
+      ListObjectsV2 по prefix на весь журнал (remote), дальше список дополняется своими загрузками;
+    - иначе (общий префикс вроде segments/, где лежат объекты всех операций) — HEAD на сомнительный
+      ключ: список такого префикса растёт с историей bucket'а, а не с операцией.
+    """
+
+    def __init__(self, path: Path, prefix: str, listable: bool = True):
+        self.path = Path(path)
+        self.prefix = prefix
+        self.listable = listable
+        self.remote: Optional[Dict[str, Tuple[int, str]]] = None  # ответ ListObjectsV2, если уже запрошен
+        self.entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if data.get("prefix") != self.prefix:
+            return {}
+        return data.get("objects", {})
+
+    @staticmethod
+    def local_state(local_path: Path) -> Dict[str, int]:
+        st = Path(local_path).stat()
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def is_uploaded(self, local_path: Path, key: str) -> bool:
+        entry = self.entries.get(key)
+        if not entry:
+            return False
+        try:
+            state = self.local_state(local_path)
+        except OSError:
+            return False
+        return entry["size"] == state["size"] and entry["mtime_ns"] == state["mtime_ns"]
+
+    def covers(self, key: str) -> bool:
+        """Ключ виден в списке объектов префикса журнала (сверка списком, а не HEAD)."""
+        return self.listable and key.startswith(self.prefix.rstrip("/") + "/")
+
+    def record(self, local_path: Path, key: str, etag: Optional[str]) -> None:
+        self.entries[key] = dict(self.local_state(local_path), etag=etag)
+        if self.remote is not None and etag is not None:
+            self.remote[key] = (self.entries[key]["size"], etag)
+
+    def reconcile(self, local_path: Path, key: str, remote: Optional[Tuple[int, str]], part_size: Optional[int] = None) -> bool:
+        """
+        Сверка с объектом на S3 (размер, ETag). True — объект совпадает с локальным файлом
+        и записан в журнал; False — его нужно загрузить.
+        MD5 файла считается, только если ETag не тот, что записан в журнале (объект мог перезаписать
+        кто-то другой); multipart ETag сверяется с посчитанным по частям part_size.
+        """
+        if remote is None:
+            self.entries.pop(key, None)
+            return False
+        size, etag = remote
+        if size != self.local_state(local_path)["size"]:
+            return False
+        known = self.is_uploaded(local_path, key) and self.entries[key].get("etag") == etag
+        if not known:
+            if "-" in etag:
+                if not part_size or -(-size // part_size) != int(etag.rsplit("-", 1)[1]):
+                    return False  # части другого размера — не проверить, надёжнее загрузить заново
+                if file_multipart_etag(local_path, part_size) != etag:
+                    return False
+            elif file_md5(local_path) != etag:
+                return False
+        self.record(local_path, key, etag)
+        return True
+
+    def save(self) -> None:
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"prefix": self.prefix, "objects": self.entries}, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(self.path)
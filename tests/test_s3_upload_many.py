@@ -0,0 +1,157 @@
+import os
+
+import boto3
+import pytest
+from moto.server import ThreadedMotoServer
+
+from app.storage import s3
+from app.storage.upload_ledger import UploadLedger
+
+BUCKET = "test-bucket"
+MiB = 1024 * 1024
+
+
+@pytest.fixture(scope="module")
+def moto_endpoint():
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def client(moto_endpoint, monkeypatch):
+    """upload_many против локального moto: свой endpoint, multipart с минимальной частью S3 (5 МБ)."""
+    monkeypatch.setattr(s3, "S3_ENDPOINT_URL", moto_endpoint)
+    monkeypatch.setattr(s3, "S3_MULTIPART_THRESHOLD", 5 * MiB)
+    monkeypatch.setattr(s3, "S3_MULTIPART_CHUNKSIZE", 5 * MiB)
+    monkeypatch.setattr(s3, "_bulk_clients", {})
+    c = boto3.client(
+        "s3",
+        endpoint_url=moto_endpoint,
+        aws_access_key_id=s3.S3_ACCESS_KEY,
+        aws_secret_access_key=s3.S3_SECRET_KEY,
+        region_name=s3.S3_REGION,
+    )
+    c.create_bucket(Bucket=BUCKET)
+    yield c
+    for page in c.get_paginator("list_objects_v2").paginate(Bucket=BUCKET):
+        for obj in page.get("Contents", []):
+            c.delete_object(Bucket=BUCKET, Key=obj["Key"])
+    c.delete_bucket(Bucket=BUCKET)
+
+
+def write_file(path, size):
+    path.write_bytes(os.urandom(size))
+    return path
+
+
+def test_multipart_upload(client, tmp_path):
+    big = write_file(tmp_path / "Merged.mp3", 11 * MiB)
+    small = write_file(tmp_path / "seg.mp3", 1000)
+
+    results = s3.upload_many(
+        [(big, "op/Merged.mp3", "audio/mpeg"), (small, "op/seg.mp3", "audio/mpeg")], bucket=BUCKET, workers=2
+    )
+
+    assert {k: r["status"] for k, r in results.items()} == {"op/Merged.mp3": "uploaded", "op/seg.mp3": "uploaded"}
+    head = client.head_object(Bucket=BUCKET, Key="op/Merged.mp3")
+    assert head["ContentLength"] == 11 * MiB
+    assert head["ETag"].strip('"').endswith("-3")  # 5 + 5 + 1 МБ
+    assert head["ContentType"] == "audio/mpeg"
+    assert "-" not in client.head_object(Bucket=BUCKET, Key="op/seg.mp3")["ETag"]
+
+
+def test_skip_existing(client, tmp_path):
+    path = write_file(tmp_path / "seg.mp3", 2000)
+    s3.upload_many([(path, "op/seg.mp3")], bucket=BUCKET)
+
+    again = s3.upload_many([(path, "op/seg.mp3")], bucket=BUCKET, skip_existing=True)
+    assert again["op/seg.mp3"]["status"] == "skipped"
+
+    write_file(path, 3000)  # другой размер — загружается заново
+    changed = s3.upload_many([(path, "op/seg.mp3")], bucket=BUCKET, skip_existing=True)
+    assert changed["op/seg.mp3"]["status"] == "uploaded"
+    assert client.head_object(Bucket=BUCKET, Key="op/seg.mp3")["ContentLength"] == 3000
+
+
+def test_skip_with_ledger(client, tmp_path):
+    files = [write_file(tmp_path / f"seg_{i}.mp3", 1000 + i) for i in range(3)]
+    items = [(f, f"op/{f.name}") for f in files]
+    ledger = UploadLedger(tmp_path / "ledger.json", "op")
+    assert {r["status"] for r in s3.upload_many(items, bucket=BUCKET, ledger=ledger).values()} == {"uploaded"}
+
+    # новый журнал с диска: всё уже загружено, S3 не спрашивается
+    ledger = UploadLedger(tmp_path / "ledger.json", "op")
+    assert all(ledger.is_uploaded(f, key) for f, key in items)
+    assert {r["status"] for r in s3.upload_many(items, bucket=BUCKET, ledger=ledger).values()} == {"skipped"}
+
+    # объект удалили с S3 — сверка со списком объектов загружает его снова
+    client.delete_object(Bucket=BUCKET, Key="op/seg_1.mp3")
+    results = s3.upload_many(items, bucket=BUCKET, ledger=ledger, verify=True)
+    assert results["op/seg_1.mp3"]["status"] == "uploaded"
+    assert results["op/seg_0.mp3"]["status"] == "skipped"
+
+
+def test_ledger_lists_prefix_once(client, tmp_path, monkeypatch):
+    listings = []
+    list_s3_objects = s3.list_s3_objects
+    monkeypatch.setattr(s3, "list_s3_objects", lambda *a, **kw: listings.append(a) or list_s3_objects(*a, **kw))
+
+    ledger = UploadLedger(tmp_path / "ledger.json", "op")
+    for name in ("seg.mp3", "result.json", "Merged.mp3"):
+        path = write_file(tmp_path / name, 1000)
+        assert s3.upload_many([(path, f"op/{name}")], bucket=BUCKET, ledger=ledger)[f"op/{name}"]["status"] == "uploaded"
+    assert len(listings) == 1
+
+    # ETag в журнале — от HEAD на загруженный ключ, а не от повторного списка
+    head = client.head_object(Bucket=BUCKET, Key="op/Merged.mp3")
+    assert ledger.entries["op/Merged.mp3"]["etag"] == head["ETag"].strip('"')
+
+
+def test_shared_key_overwritten_by_other_operation(client, tmp_path):
+    mine = write_file(tmp_path / "pipeline_intervals.json", 2000)
+    ledger = UploadLedger(tmp_path / "ledger.json", "segments", listable=False)
+    s3.upload_many([(mine, "segments/pipeline_intervals.json")], bucket=BUCKET, ledger=ledger)
+
+    # нетронутый общий ключ: HEAD, ETag совпадает с журналом — не загружается
+    again = s3.upload_many([(mine, "segments/pipeline_intervals.json")], bucket=BUCKET, ledger=ledger, verify=True)
+    assert again["segments/pipeline_intervals.json"]["status"] == "skipped"
+
+    # другая операция записала свой файл того же размера под тем же ключом
+    client.put_object(Bucket=BUCKET, Key="segments/pipeline_intervals.json", Body=os.urandom(2000))
+    ledger = UploadLedger(tmp_path / "ledger.json", "segments", listable=False)
+    assert ledger.is_uploaded(mine, "segments/pipeline_intervals.json")
+    results = s3.upload_many([(mine, "segments/pipeline_intervals.json")], bucket=BUCKET, ledger=ledger, verify=True)
+    assert results["segments/pipeline_intervals.json"]["status"] == "uploaded"
+    body = client.get_object(Bucket=BUCKET, Key="segments/pipeline_intervals.json")["Body"].read()
+    assert body == mine.read_bytes()
+
+
+def test_reconcile_multipart_etag(client, tmp_path):
+    big = write_file(tmp_path / "Merged.mp3", 11 * MiB)
+    s3.upload_many([(big, "segments/Merged.mp3")], bucket=BUCKET)
+
+    # журнала нет: multipart ETag сверяется с посчитанным по частям S3_MULTIPART_CHUNKSIZE
+    ledger = UploadLedger(tmp_path / "ledger.json", "segments", listable=False)
+    results = s3.upload_many([(big, "segments/Merged.mp3")], bucket=BUCKET, ledger=ledger, verify=True)
+    assert results["segments/Merged.mp3"]["status"] == "skipped"
+
+    write_file(big, 11 * MiB)
+    results = s3.upload_many([(big, "segments/Merged.mp3")], bucket=BUCKET, ledger=ledger, verify=True)
+    assert results["segments/Merged.mp3"]["status"] == "uploaded"
+
+
+def test_failures_are_reported_per_object(client, tmp_path):
+    ok = write_file(tmp_path / "ok.mp3", 1000)
+    missing = tmp_path / "missing.mp3"
+
+    results = s3.upload_many([(ok, "op/ok.mp3"), (missing, "op/missing.mp3")], bucket=BUCKET)
+    assert results["op/ok.mp3"]["status"] == "uploaded"
+    assert results["op/missing.mp3"]["status"] == "failed"
+    assert results["op/missing.mp3"]["error"]
+
+    no_bucket = s3.upload_many([(ok, "op/ok.mp3")], bucket="no-such-bucket")
+    assert no_bucket["op/ok.mp3"]["status"] == "failed"
+    assert "NoSuchBucket" in no_bucket["op/ok.mp3"]["error"]